@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import statistics
+from time import perf_counter
+from storage import Storage
+from journal import Journal
+from service import InventoryService
+from records import Batch, StockEntry, TimelineEvent, new_id
+from indexes import ActivityIndex, BatchNameIndex, ConsolidatedHistory
+from kpis import ProductionKPIs
+from dashboard_view import DashboardView
+from location_view import LocationView
+from timeutil import now_ts
+
+DAY = 86400
+TOLERANCE = 0.25    # a median this much slower than the baseline counts as a regression
+COLD_AFTER_DAYS = 180   # archive cutoff of the cold-tier scenario, the app's default
+COLD_DAYS = 400         # history span of the cold-tier scenario, well past the cutoff
+
+
+# --- SYNTHETIC PLANT ---
+# factories x rooms x sub-zones, each holding `batches` batches (half active, half archived) whose timelines
+# run up to `timeline` entries, plus a stock ledger. Some archived batches share a name, as split batches do,
+# so the history consolidation has groups to merge.
+def build_plant(factories=3, rooms=4, sub_zones=3, batches=40, timeline=8, products=4, days=90, seed=0):
+    rnd = random.Random(seed); now = now_ts(); steps_per = max(1, timeline // 2)
+    products_config = {f"Product {p + 1}": [f"Step {s + 1}" for s in range(steps_per)] for p in range(products)}
+    factory_names = [f"Factory {f + 1}" for f in range(factories)]
+    factory_sub_locations = {fac: [f"Room {r + 1}" for r in range(rooms)] for fac in factory_names}
+    level3_data = {}; counter = 0
+
+    def new_batch(ptype, name, archived):
+        steps = products_config[ptype]; t = now - rnd.randint(0, days * DAY)
+        done = len(steps) if archived else rnd.randint(0, len(steps)); processing = not archived and done < len(steps) and rnd.random() < 0.5
+        logs = [TimelineEvent("Created from Stock", t)]
+        for s in steps[:done]: t += rnd.randint(60, DAY); logs.append(TimelineEvent(f"Started: {s}", t)); t += rnd.randint(60, DAY); logs.append(TimelineEvent(f"Completed: {s}", t))
+        if processing: t += rnd.randint(60, DAY); logs.append(TimelineEvent(f"Started: {steps[done]}", t))
+        item = Batch(new_id(), ptype, name, rnd.randint(1, 50), steps, logs, done, processing)
+        if archived: t += rnd.randint(60, DAY); item["entry_type"] = "Batch"; item["date_completed"] = t; item["timeline"].append(TimelineEvent("Batch Finalized & Archived", t))
+        return item
+
+    for fac in factory_names:
+        for room in factory_sub_locations[fac]:
+            tabs = [f"Zone {z + 1}" for z in range(sub_zones)]
+            level3_data[f"{fac}::{room}"] = {"tabs": tabs, "data": {}}
+            for tab in tabs:
+                active, history, archived_names = [], [], []; stock = {p: float(rnd.randint(100, 1000)) for p in products_config}
+                for b in range(batches):
+                    ptype = rnd.choice(list(products_config)); archived = b % 2 == 1
+                    if archived and archived_names and rnd.random() < 0.3: name = rnd.choice(archived_names)
+                    else: counter += 1; name = f"Batch {counter}"
+                    if archived: archived_names.append(name)
+                    (history if archived else active).append(new_batch(ptype, name, archived))
+                    if rnd.random() < 0.2: history.append(StockEntry(ptype, "Added to Stock", rnd.randint(10, 100), now - rnd.randint(0, days * DAY)))
+                level3_data[f"{fac}::{room}"]["data"][tab] = {"stock": stock, "active": active, "history": history}
+    return products_config, factory_names, factory_sub_locations, level3_data
+
+
+def write_plant(path, state):
+    # stores a generated plant as a checkpoint, the way a long-running install would have it on disk
+    db = Storage(path); db.state = state; db.mark_config()
+    for key, loc in state[3].items():
+        db.mark_location(key)
+        for sub, tab_data in loc["data"].items():
+            for product in tab_data["stock"]: db.mark_stock(key, sub, product)
+            for item in tab_data["active"]: db.mark_batch(key, sub, "active", item, timeline_from=0)
+            for entry in tab_data["history"]:
+                if entry.get("entry_type") == "Stock": db.mark_ledger(key, sub, entry)
+                else: db.mark_batch(key, sub, "history", entry, timeline_from=0)
+    db.close(); db.conn.close()
+
+
+def remove_db(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+
+
+# --- HEADLESS PAGE ---
+class FakePage:
+    def __init__(self): self.overlay = []; self.width = 1200; self.height = 800
+    def update(self, *controls): pass
+    def open(self, control): pass
+    def close(self, control): pass
+    def run_thread(self, fn, *args, **kwargs): fn(*args, **kwargs)
+
+
+# --- RUNNER ---
+def bench(name, fn, setup=lambda: None, rounds=5):
+    times = []
+    for _ in range(rounds):
+        arg = setup(); start = perf_counter(); fn(arg); times.append(perf_counter() - start)
+    return {"name": name, "rounds": rounds, "min": min(times), "median": statistics.median(times), "max": max(times)}
+
+def run_suite(scale, rounds=5, cold_days=COLD_DAYS):
+    workdir = tempfile.mkdtemp(prefix="erp_bench_"); path = os.path.join(workdir, "bench.db")
+    state = build_plant(**scale); remove_db(path); write_plant(path, state)
+
+    def load(_):
+        db = Storage(path); Journal(db).load(); db.conn.close()
+    def fresh_db():
+        remove_db(path + ".save"); return path + ".save"
+
+    results = [bench("build plant", lambda _: build_plant(**scale), rounds=rounds), bench("snapshot save", lambda p: write_plant(p, state), fresh_db, rounds), bench("load + replay", load, rounds=rounds)]
+
+    db = Storage(path); journal = Journal(db); products_config, factories, factory_sub_locations, level3_data = journal.load()
+    page = FakePage(); service = InventoryService(journal, products_config)
+    dashboard = DashboardView(page, journal, journal.attach(ActivityIndex()), journal.attach(ProductionKPIs())); dashboard.start_date = dashboard.end_date = None
+    key = next(iter(level3_data)); fac, loc = key.split("::")
+    view = LocationView(page, products_config, lambda: (fac, loc), factories, factory_sub_locations, level3_data, service, journal.attach(ConsolidatedHistory())); view.view_mode_tabs.selected_index = 1
+    names = BatchNameIndex()
+
+    def fresh_names():
+        names.rebuild(level3_data); return names
+
+    results += [
+        bench("populate dashboard", lambda _: dashboard.populate(), rounds=rounds),
+        bench("batch name index", lambda _: names.rebuild(level3_data), rounds=rounds),
+        bench("unique batch name", lambda n: n.unique_name(), fresh_names, rounds),
+        bench("history consolidation", lambda _: ConsolidatedHistory().rebuild(level3_data), rounds=rounds),
+        bench("history render_lists", lambda _: view.render_lists(None), rounds=rounds),
+    ]
+    db.conn.close(); remove_db(path); remove_db(path + ".save")
+    results += run_cold_suite(scale, rounds, cold_days, os.path.join(workdir, "cold.db"))
+    os.rmdir(workdir)
+    return results
+
+def run_cold_suite(scale, rounds, days, path):
+    # a plant whose history reaches `days` back: the first open moves what is older than COLD_AFTER_DAYS into the cold
+    # tier, then startup, full cold reads (segments decoded, then cached) and the KPI rebuild from segment summaries are timed
+    state = build_plant(**scale, days=days); remove_db(path); write_plant(path, state)
+    def open_db(): return Storage(path, archive_after_days=COLD_AFTER_DAYS)
+    def load(_):
+        db = open_db(); Journal(db).load(); db.conn.close(); db.archive_conn.close()
+    first = perf_counter(); load(None); results = [{"name": "cold tier first move", "rounds": 1, **dict.fromkeys(("min", "median", "max"), perf_counter() - first)}]
+
+    db = open_db(); level3_data = Journal(db).load()[3]
+    def cold_scan(_): return sum(1 for _ in db.archived())
+    def uncached(): db.segment.cache_clear()
+    results += [
+        bench("load + cold tier", load, rounds=rounds),
+        bench("cold archived() read", cold_scan, uncached, rounds),
+        bench("cold archived() cached", cold_scan, rounds=rounds),
+        bench("kpis from cold summaries", lambda _: ProductionKPIs(db.archive_kpis).rebuild(level3_data), rounds=rounds),
+    ]
+    db.conn.close(); db.archive_conn.close(); remove_db(path)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    base = {r["name"]: r for r in baseline}
+    return [(r["name"], base[r["name"]]["median"], r["median"]) for r in results if r["name"] in base and r["median"] > base[r["name"]]["median"] * (1 + tolerance)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times the data paths of the app against a synthetic plant.")
+    for field, default in (("factories", 3), ("rooms", 4), ("sub-zones", 3), ("batches", 40), ("timeline", 8)): parser.add_argument(f"--{field}", type=int, default=default)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--cold-days", type=int, default=COLD_DAYS, help=f"history span of the cold-tier scenario (archive cutoff {COLD_AFTER_DAYS} days)")
+    parser.add_argument("--save", help="write the results as JSON, to be used as a later --baseline")
+    parser.add_argument("--baseline", help="JSON results to compare against; exits 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+    scale = {"factories": args.factories, "rooms": args.rooms, "sub_zones": args.sub_zones, "batches": args.batches, "timeline": args.timeline}
+
+    results = run_suite(scale, args.rounds, args.cold_days)
+    print(f"{'path':<24}{'min ms':>10}{'median ms':>12}{'max ms':>10}")
+    for r in results: print(f"{r['name']:<24}{r['min'] * 1000:>10.2f}{r['median'] * 1000:>12.2f}{r['max'] * 1000:>10.2f}")
+    if args.save:
+        with open(args.save, "w") as f: json.dump({"scale": scale, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f: regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for name, before, after in regressions: print(f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
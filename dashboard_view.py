@@ -0,0 +1,225 @@
+import os
+import time
+import logging
+import threading
+import flet as ft
+from datetime import datetime
+from collections import Counter
+from scheduler import batched, mark_dirty, get_scheduler, LatestQuery, QueryError
+from storage import default_db_path
+from export import export_history, count_source
+from timeutil import fmt_ts, day_bounds, in_range
+from perf import timed
+
+CARD_BG = "#FFFFFF"
+TEXT_MAIN = "#0F172A"
+TEXT_SUB = "#64748B"
+PRIMARY = "#2563EB"
+
+PAGE_SIZE = 20          # cards built per page; more are appended as the list is scrolled
+TIMELINE_PREVIEW = 3    # timeline rows shown per card until it is expanded
+SCROLL_MARGIN = 400     # px from the bottom at which the next page is loaded
+REFRESH_INTERVAL = 2.0  # s; changes from other sessions re-query a shown dashboard at most this often
+
+log = logging.getLogger("erp.dashboard")
+
+def fmt_duration(seconds):
+    if seconds < 3600: return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.1f}h" if seconds < 86400 else f"{seconds / 86400:.1f}d"
+
+def loading_placeholder(text): return ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Row([ft.ProgressRing(width=18, height=18, stroke_width=2, color=PRIMARY), ft.Text(text, color=TEXT_SUB, size=15)], alignment=ft.MainAxisAlignment.CENTER, spacing=10))
+
+class DashboardView(ft.Container):
+    def __init__(self, page: ft.Page, journal, activity, kpis):
+        super().__init__()
+        self.page = page
+        self.journal = journal
+        self.activity = activity
+        self.kpis = kpis
+        self.padding = ft.padding.all(15)
+        self.visible = True
+        self.expand = True
+
+        self.start_date = datetime.now()
+        self.end_date = datetime.now()
+        self.dashboard_items = []
+        self.shown = 0
+        self.query = LatestQuery(page)
+        self.populated_at = 0.0
+        self.refresh_timer = None
+        self.refresh_lock = threading.Lock()
+
+        self.start_picker = ft.DatePicker(on_change=self.on_start_change)
+        self.end_picker = ft.DatePicker(on_change=self.on_end_change)
+        self.overlay_controls = [self.start_picker, self.end_picker]
+
+        btn_style = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))
+        self.start_btn = ft.ElevatedButton("", on_click=lambda _: self.start_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=btn_style)
+        self.end_btn = ft.ElevatedButton("", on_click=lambda _: self.end_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=btn_style)
+        self.summary = ft.Text("", size=12, color=TEXT_SUB)
+        self.kpi_row = ft.Row(spacing=10, wrap=True)
+        self.cycle_table = ft.Column(spacing=2)
+        self.cycle_tile = ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, "#E2E8F0"), content=ft.ExpansionTile(title=ft.Text("Step Cycle Times", weight=ft.FontWeight.W_600, color=TEXT_MAIN), subtitle=ft.Text("Started → Completed, all time", size=12, color=TEXT_SUB), controls_padding=ft.padding.symmetric(horizontal=15, vertical=10), controls=[self.cycle_table]))
+        self.dash_list = ft.ListView(expand=True, spacing=15, padding=ft.padding.only(bottom=40), on_scroll=self.on_scroll, on_scroll_interval=100)
+        self.more_btn = ft.TextButton("", on_click=lambda e: self.show_next_page(), style=ft.ButtonStyle(color=PRIMARY))
+
+        # --- HISTORY EXPORT (runs on a worker thread, reports progress, can be cancelled) ---
+        self.export_cancelled = False
+        self.export_progress = ft.ProgressBar(value=0, color=PRIMARY, bgcolor="#E2E8F0")
+        self.export_status = ft.Text("", size=12, color=TEXT_SUB)
+        self.export_close_btn = ft.TextButton("Cancel", on_click=self.close_export, style=ft.ButtonStyle(color=TEXT_SUB))
+        self.export_dialog = ft.AlertDialog(modal=True, shape=ft.RoundedRectangleBorder(radius=12), title=ft.Text("Exporting History", weight=ft.FontWeight.BOLD), content=ft.Column([self.export_progress, self.export_status], tight=True, width=380), actions=[self.export_close_btn])
+
+        self.content = ft.Column(expand=True, controls=[
+            ft.Row([ft.Text("Global Overview", size=24, weight=ft.FontWeight.W_800, color=TEXT_MAIN)], alignment=ft.MainAxisAlignment.SPACE_BETWEEN), ft.Container(height=5),
+            ft.Container(padding=15, bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=15, color="#0000000A", offset=ft.Offset(0, 4)), content=ft.Row([
+                ft.Row([ft.Icon(ft.Icons.FILTER_ALT, color=TEXT_SUB, size=20), ft.Text("Activity Date Filter:", color=TEXT_SUB, weight=ft.FontWeight.W_500)]),
+                ft.Row([self.start_btn, self.end_btn, ft.IconButton(ft.Icons.CLOSE, on_click=self.clear_dates, tooltip="Clear Dates", icon_color="#EF4444", bgcolor="#FEF2F2"), ft.IconButton(ft.Icons.DOWNLOAD, on_click=self.start_export, tooltip="Export history (CSV + columnar)", icon_color=PRIMARY, bgcolor="#EFF6FF")], wrap=True)
+            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True)),
+            ft.Container(height=5), self.kpi_row, self.cycle_tile, self.summary, ft.Container(height=5), self.dash_list
+        ])
+
+    @batched
+    def on_start_change(self, e): self.start_date = self.start_picker.value; self.populate(); mark_dirty(self)
+    @batched
+    def on_end_change(self, e): self.end_date = self.end_picker.value; self.populate(); mark_dirty(self)
+    @batched
+    def clear_dates(self, e): self.start_date = None; self.end_date = None; self.populate(); mark_dirty(self)
+
+    def populate(self):
+        # shows a placeholder right away; the activity query runs off the UI thread and only the latest filter is rendered
+        self.start_btn.text = f"Start: {self.start_date.strftime('%d %b %Y') if self.start_date else 'Any'}"
+        self.end_btn.text = f"End: {self.end_date.strftime('%d %b %Y') if self.end_date else 'Any'}"
+        self.dash_list.controls = [loading_placeholder("Loading activity...")]; self.shown = 0
+        self.dashboard_items = []; self.summary.value = ""; lo, hi = day_bounds(self.start_date, self.end_date); self.populated_at = time.monotonic()
+        self.render_kpis(lo, hi)
+        self.query.submit(lambda is_stale: self.collect(lo, hi, is_stale), self.show_results)
+
+    def refresh_soon(self):
+        # a burst of announcements costs one re-query per REFRESH_INTERVAL, and the last change is always shown
+        with self.refresh_lock:
+            if self.refresh_timer: return
+            self.refresh_timer = threading.Timer(max(0.0, self.populated_at + REFRESH_INTERVAL - time.monotonic()), self.refresh_due); self.refresh_timer.daemon = True; self.refresh_timer.start()
+
+    def refresh_due(self):
+        with self.refresh_lock: self.refresh_timer = None
+        if not self.visible: return
+        with get_scheduler(self.page).frame(): self.populate(); mark_dirty(self)
+
+    def kpi_tile(self, label, value, color):
+        return ft.Container(padding=ft.padding.symmetric(horizontal=16, vertical=12), bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, "#E2E8F0"), content=ft.Column([ft.Text(label, size=12, color=TEXT_SUB, weight=ft.FontWeight.W_500), ft.Text(value, size=22, color=color, weight=ft.FontWeight.W_800)], spacing=2, tight=True))
+
+    def render_kpis(self, lo, hi):
+        # reads the running counters only, so the cost does not grow with the number of batches
+        with self.journal.db.lock: totals = self.kpis.totals(); completed = self.kpis.completed_between(lo, hi); cycles = self.kpis.cycle_times()
+        span = "Completed (range)" if lo is not None or hi is not None else "Completed (all time)"
+        self.kpi_row.controls = [self.kpi_tile("Work in Progress", f"{totals['wip']} batches", PRIMARY), self.kpi_tile("WIP Quantity", f"{totals['wip_qty']:g}", PRIMARY), self.kpi_tile("In Stock", f"{totals['stock']:g}", TEXT_MAIN), self.kpi_tile(span, f"{sum(completed.values())} batches", "#10B981")]
+        if not cycles: self.cycle_table.controls = [ft.Text("No completed steps yet.", size=12, color=TEXT_SUB)]; return
+        header = ft.Row([ft.Text("Product / Step", size=12, color=TEXT_SUB, weight=ft.FontWeight.W_600, expand=True)] + [ft.Text(h, size=12, color=TEXT_SUB, weight=ft.FontWeight.W_600, width=60, text_align=ft.TextAlign.RIGHT) for h in ("Runs", "Mean", "p95")])
+        self.cycle_table.controls = [header] + [ft.Row([ft.Text(f"{c['product']} · {c['step']}", size=13, color=TEXT_MAIN, expand=True)] + [ft.Text(v, size=13, color=TEXT_MAIN, width=60, text_align=ft.TextAlign.RIGHT) for v in (str(c["count"]), fmt_duration(c["mean"]), fmt_duration(c["p95"]))]) for c in cycles]
+
+    @timed("populate_dashboard")
+    def collect(self, lo, hi, is_stale):
+        with self.journal.db.lock:
+            matches = [(self.journal.batches.get(item_id), valid_logs) for item_id, valid_logs in self.activity.query(lo, hi).items()]
+            day_counts = self.activity.events_per_day(lo, hi)
+        if self.journal.db.reaches_archive(lo):
+            # the range reaches back into the cold tier: archived batches with activity in range are read from its segments
+            counts = Counter(dict(day_counts))
+            for key, sub, item in self.journal.db.archived(lo=lo):
+                if is_stale(): return None
+                valid_logs = [log for log in item.get("timeline", ()) if in_range(log["time"], lo, hi)]
+                if valid_logs: matches.append(((item, key, sub, "history"), valid_logs)); counts.update(datetime.fromtimestamp(log["time"]).date() for log in valid_logs)
+            day_counts = sorted(counts.items())
+        dashboard_items = []
+        for (item, key, sub_name, status), valid_logs in matches:
+            if is_stale(): return None
+            fac, loc = key.split("::")
+            valid_logs.reverse()
+            dashboard_items.append({"item": item, "fac": fac, "loc": loc, "sub_name": sub_name, "status_type": "active" if status == "active" else "completed", "valid_logs": valid_logs, "latest_time": valid_logs[0]["time"]})
+        dashboard_items.sort(key=lambda x: x["latest_time"], reverse=True)
+        return dashboard_items, day_counts
+
+    def show_results(self, result):
+        if isinstance(result, QueryError):
+            self.dashboard_items = []; self.summary.value = ""; self.dash_list.controls = [ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text(f"Could not load activity: {result}", color="#EF4444", size=16))]
+            mark_dirty(self); return
+        self.dashboard_items, day_counts = result
+        self.summary.value = f"{sum(c for d, c in day_counts)} timeline events across {len(day_counts)} active day{'s' if len(day_counts) != 1 else ''}" if day_counts else ""
+        self.dash_list.controls.clear(); self.shown = 0
+        if not self.dashboard_items: self.dash_list.controls.append(ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("No active or completed processes found in this date range.", color=TEXT_SUB, size=16)))
+        else: self.show_next_page(update=False)
+        mark_dirty(self)
+
+    @batched
+    def start_export(self, e):
+        self.export_cancelled = False; self.export_progress.value = 0; self.export_status.value = "Preparing..."; self.export_close_btn.text = "Cancel"
+        self.page.open(self.export_dialog)
+        self.page.run_thread(self.run_export, *day_bounds(self.start_date, self.end_date))
+
+    def run_export(self, lo, hi):
+        # worker thread; the same date range as the activity list, all locations
+        out_dir = os.path.join(os.path.dirname(default_db_path()), "exports"); base = os.path.join(out_dir, f"history_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        db = self.journal.db; total = max(1, count_source(self.journal.level3_data) + db.archive_scan_size(lo))
+        def progress(scanned):
+            self.export_progress.value = min(1, scanned / total); self.export_status.value = f"Scanned {scanned:,} of {total:,} entries"; mark_dirty(self.export_progress, self.export_status)
+        status = "Export failed."
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            result = export_history(self.journal.level3_data, base, lo, hi, lock=db.lock, progress=progress, is_cancelled=lambda: self.export_cancelled, archived=lambda key, sub: (entry for k, s, entry in db.archived(key, sub, lo)))
+            status = "Export cancelled." if result is None else f"{result[1]:,} rows written to {result[0][0]} and {os.path.basename(result[0][1])}"
+        except OSError as err: status = f"Export failed: {err}"
+        except Exception as err: log.exception("history export failed"); status = f"Export failed: {type(err).__name__}: {err}"
+        finally:
+            # whatever happened, the dialog leaves the running state: Close button, bar full unless cancelled
+            with get_scheduler(self.page).frame():
+                self.export_status.value = status; self.export_close_btn.text = "Close"
+                if not self.export_cancelled: self.export_progress.value = 1
+                mark_dirty(self.export_dialog)
+
+    def close_export(self, e): self.export_cancelled = True; self.page.close(self.export_dialog)
+
+    @batched
+    def show_next_page(self, update=True):
+        if self.more_btn in self.dash_list.controls: self.dash_list.controls.remove(self.more_btn)
+        end = min(self.shown + PAGE_SIZE, len(self.dashboard_items))
+        self.dash_list.controls.extend(self.build_card(d_item) for d_item in self.dashboard_items[self.shown:end])
+        self.shown = end
+        remaining = len(self.dashboard_items) - self.shown
+        if remaining > 0: self.more_btn.text = f"Show more ({remaining} remaining)"; self.dash_list.controls.append(self.more_btn)
+        if update: mark_dirty(self.dash_list)
+
+    @batched
+    def on_scroll(self, e):
+        if self.shown < len(self.dashboard_items) and e.max_scroll_extent is not None and e.pixels >= e.max_scroll_extent - SCROLL_MARGIN: self.show_next_page()
+
+    def build_timeline(self, valid_logs, limit):
+        timeline_controls = []
+        for i, log in enumerate(valid_logs[:limit]):
+            color = TEXT_MAIN if i == 0 else TEXT_SUB; weight = ft.FontWeight.W_500 if i == 0 else ft.FontWeight.NORMAL
+            timeline_controls.append(ft.Row([ft.Icon(ft.Icons.CIRCLE, size=8, color="#CBD5E1"), ft.Text(f"{log['step']}", size=13, color=color, weight=weight, expand=True), ft.Text(fmt_ts(log['time']), size=11, color="#94A3B8")]))
+        return timeline_controls
+
+    @batched
+    def expand_timeline(self, timeline_col, valid_logs):
+        timeline_col.controls = self.build_timeline(valid_logs, None); mark_dirty(timeline_col)
+
+    def build_card(self, d_item):
+        item = d_item["item"]; status_type = d_item["status_type"]; valid_logs = d_item["valid_logs"]
+        loc_label = "Current" if status_type == "active" else "Final"
+        timeline_col = ft.Column(self.build_timeline(valid_logs, TIMELINE_PREVIEW), spacing=4)
+        if len(valid_logs) > TIMELINE_PREVIEW:
+            timeline_col.controls.append(ft.TextButton(f"Show all {len(valid_logs)} entries", on_click=lambda e, c=timeline_col, v=valid_logs: self.expand_timeline(c, v), style=ft.ButtonStyle(color=PRIMARY, padding=0)))
+        subtitle_col = ft.Column([ft.Container(height=5), ft.Row([ft.Icon(ft.Icons.LOCATION_ON, size=14, color="#94A3B8"), ft.Text(f"{loc_label}: {d_item['fac']} → {d_item['loc']} → {d_item['sub_name']}", size=13, color=TEXT_SUB, weight=ft.FontWeight.W_500, expand=True)]), ft.Container(padding=ft.padding.only(left=5, top=5), content=timeline_col)], spacing=0)
+
+        if status_type == "active":
+            icon_color = PRIMARY; title_text = f"{item['type']} - {item['name']}"
+            chip_bg = "#FEF3C7" if item.get("is_processing") else "#DBEAFE"; chip_color = "#D97706" if item.get("is_processing") else PRIMARY; chip_text = "In Process" if item.get("is_processing") else "Pending"
+        else:
+            icon_color = "#10B981"; title_text = f"{item['type']} - {item['name']}"; chip_bg = "#D1FAE5"; chip_color = "#059669"; chip_text = "Completed"
+
+        status_chip = ft.Container(padding=ft.padding.symmetric(horizontal=10, vertical=4), bgcolor=chip_bg, border_radius=16, content=ft.Text(chip_text, size=11, color=chip_color, weight=ft.FontWeight.BOLD))
+        return ft.Container(bgcolor=CARD_BG, border_radius=12, padding=15, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)), content=ft.Row([
+            ft.Container(padding=12, bgcolor="#F8FAFC", border_radius=12, content=ft.Icon(ft.Icons.INVENTORY_2_OUTLINED, color=icon_color, size=24)),
+            ft.Column([ft.Row([ft.Text(title_text, size=15, weight=ft.FontWeight.BOLD, color=TEXT_MAIN, expand=True), status_chip], spacing=5), subtitle_col], expand=True),
+        ], vertical_alignment=ft.CrossAxisAlignment.START))
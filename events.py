@@ -0,0 +1,140 @@
+from records import Batch, StockEntry, TimelineEvent, intern_steps, to_id
+from timeutil import to_ts
+
+# --- EVENT TYPES ---
+SUB_ZONE_ADDED = "sub_zone_added"
+STOCK_ADDED = "stock_added"
+BATCH_CREATED = "batch_created"
+BATCH_UPDATED = "batch_updated"
+STEP_STARTED = "step_started"
+STEP_COMPLETED = "step_completed"
+STEP_INSERTED = "step_inserted"
+STEP_DELETED = "step_deleted"
+STEP_REVERTED = "step_reverted"
+BATCH_MOVED = "batch_moved"
+BATCH_ARCHIVED = "batch_archived"
+
+
+def new_sub_zone(): return {"stock": {}, "active": [], "history": []}
+
+def get_sub_zone(level3_data, key, sub, create=False):
+    if create:
+        loc = level3_data.setdefault(key, {"tabs": [], "data": {}})
+        if sub not in loc["data"]: loc["tabs"].append(sub); loc["data"][sub] = new_sub_zone()
+    return level3_data[key]["data"][sub]
+
+def find_active(level3_data, key, sub, item_id, index=None):
+    active_items = get_sub_zone(level3_data, key, sub)["active"]
+    if index is not None:
+        entry = index.get(item_id)
+        if entry and entry[1:] == (key, sub, "active"): return entry[0], active_items
+    else:
+        for item in active_items:
+            if item["id"] == item_id: return item, active_items
+    raise KeyError(item_id)
+
+
+# --- REDUCERS: each mutates level3_data in place, marks the touched rows on db and returns the touched record ---
+# `index` is an optional BatchIndex used to resolve batch ids without scanning the active list.
+# Event times are epoch seconds; the formatted strings of older journals are converted as the journal is read.
+def _sub_zone_added(level3_data, ev, db, index):
+    loc = level3_data.setdefault(ev["key"], {"tabs": [], "data": {}})
+    if ev["sub"] not in loc["data"]: loc["tabs"].append(ev["sub"]); loc["data"][ev["sub"]] = new_sub_zone()
+    if db: db.mark_location(ev["key"])
+    return loc
+
+def _stock_added(level3_data, ev, db, index):
+    tab_data = get_sub_zone(level3_data, ev["key"], ev["sub"])
+    tab_data["stock"][ev["product"]] = tab_data["stock"].get(ev["product"], 0) + ev["qty"]
+    entry = StockEntry(ev["product"], "Added to Stock", ev["qty"], to_ts(ev["time"]))
+    tab_data["history"].append(entry)
+    if db: db.mark_stock(ev["key"], ev["sub"], ev["product"]); db.mark_ledger(ev["key"], ev["sub"], entry)
+    return entry
+
+def _batch_created(level3_data, ev, db, index):
+    tab_data = get_sub_zone(level3_data, ev["key"], ev["sub"])
+    tab_data["stock"][ev["product"]] = tab_data["stock"].get(ev["product"], 0) - ev["qty"]
+    # new events reference a routing template version; older journals carry the copied step list
+    steps = db.routings.steps(*ev["routing"]) if "routing" in ev else ev["steps"]
+    item = Batch(ev["id"], ev["product"], ev["name"], ev["qty"], steps, [TimelineEvent("Created from Stock", to_ts(ev["time"]))], routing=ev.get("routing"), step_times=[[None, None] for _ in steps])
+    tab_data["active"].append(item)
+    if db: db.mark_stock(ev["key"], ev["sub"], ev["product"]); db.mark_batch(ev["key"], ev["sub"], "active", item, timeline_from=0)
+    return item
+
+def _batch_updated(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    item[ev["field"]] = ev["value"]
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item)
+    return item
+
+def _step_started(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    item["is_processing"] = True; item["timeline"].append(TimelineEvent(f"Started: {item['steps'][item['step_idx']]}", to_ts(ev["time"])))
+    item["step_times"][item["step_idx"]][0] = item["timeline"][-1]["time"]
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item, timeline_from=len(item["timeline"]) - 1)
+    return item
+
+def _step_completed(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    item["is_processing"] = False; item["timeline"].append(TimelineEvent(f"Completed: {item['steps'][item['step_idx']]}", to_ts(ev["time"])))
+    item["step_times"][item["step_idx"]][1] = item["timeline"][-1]["time"]; item["step_idx"] += 1
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item, timeline_from=len(item["timeline"]) - 1)
+    return item
+
+def _step_inserted(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index); pos_idx = ev["pos"]
+    item["steps"] = intern_steps(item["steps"][:pos_idx] + (ev["step"],) + item["steps"][pos_idx:]); item["step_times"].insert(pos_idx, [None, None])
+    if pos_idx < item["step_idx"]: item["step_idx"] += 1
+    elif pos_idx == item["step_idx"] and item.get("is_processing"): item["step_idx"] += 1
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item)
+    return item
+
+def _step_deleted(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    item["steps"] = intern_steps(item["steps"][:ev["pos"]] + item["steps"][ev["pos"] + 1:]); item["step_times"].pop(ev["pos"])
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item)
+    return item
+
+def _step_reverted(level3_data, ev, db, index):
+    item, _ = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    if item.get("is_processing", False):
+        item["is_processing"] = False; item["step_times"][item["step_idx"]][0] = None
+        if item["timeline"] and "Started:" in item["timeline"][-1]["step"]: item["timeline"].pop()
+    elif item["step_idx"] > 0:
+        item["step_idx"] -= 1; item["is_processing"] = True; item["step_times"][item["step_idx"]][1] = None
+        if item["timeline"] and "Completed:" in item["timeline"][-1]["step"]: item["timeline"].pop()
+    if db: db.mark_batch(ev["key"], ev["sub"], "active", item, timeline_from=len(item["timeline"]))
+    return item
+
+def _batch_moved(level3_data, ev, db, index):
+    item, active_items = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    # the destination is resolved before the batch leaves its source, so a bad key cannot drop it from memory
+    curr_fac, curr_loc = ev["key"].split("::"); fac, loc = ev["to_key"].split("::")
+    dest = get_sub_zone(level3_data, ev["to_key"], ev["to_sub"], create=True)
+    active_items.remove(item)
+    item["timeline"].append(TimelineEvent(f"Relocated: [{curr_fac} > {curr_loc} > {ev['sub']}] → [{fac} > {loc} > {ev['to_sub']}]", to_ts(ev["time"])))
+    dest["active"].append(item)
+    if db: db.mark_location(ev["to_key"]); db.mark_batch(ev["to_key"], ev["to_sub"], "active", item, timeline_from=len(item["timeline"]) - 1)
+    return item
+
+def _batch_archived(level3_data, ev, db, index):
+    item, active_items = find_active(level3_data, ev["key"], ev["sub"], ev["id"], index)
+    # the record moves from the active list to history as is; nothing else holds on to it as an active batch
+    active_items.remove(item); item["date_completed"] = to_ts(ev["time"]); item["entry_type"] = "Batch"
+    item["timeline"].append(TimelineEvent("Batch Finalized & Archived", item["date_completed"]))
+    get_sub_zone(level3_data, ev["key"], ev["sub"])["history"].append(item)
+    if db: db.mark_batch(ev["key"], ev["sub"], "history", item, timeline_from=len(item["timeline"]) - 1)
+    return item
+
+
+REDUCERS = {
+    SUB_ZONE_ADDED: _sub_zone_added, STOCK_ADDED: _stock_added, BATCH_CREATED: _batch_created, BATCH_UPDATED: _batch_updated,
+    STEP_STARTED: _step_started, STEP_COMPLETED: _step_completed, STEP_INSERTED: _step_inserted, STEP_DELETED: _step_deleted,
+    STEP_REVERTED: _step_reverted, BATCH_MOVED: _batch_moved, BATCH_ARCHIVED: _batch_archived,
+}
+
+def apply_event(level3_data, ev, db=None, index=None):
+    if "id" in ev: ev["id"] = to_id(ev["id"])  # journals written before integer ids carry uuid strings
+    result = REDUCERS[ev["type"]](level3_data, ev, db, index)
+    if "id" in ev: result["rev"] = result.get("rev", 0) + 1  # batch revision, lets views skip rebuilding unchanged cards
+    return result
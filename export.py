@@ -0,0 +1,80 @@
+import os
+import csv
+import gzip
+import json
+from contextlib import nullcontext
+from itertools import chain, islice
+from timeutil import fmt_ts, in_range
+
+CHUNK = 1000        # rows written per chunk (one columnar block); progress is reported once per chunk scanned
+EXPORT_TIME_FORMAT = "%Y-%m-%d %H:%M"
+COLUMNS = ("kind", "factory", "room", "sub_zone", "batch_id", "product", "name", "step", "quantity", "time")
+
+
+# --- STREAMING HISTORY EXPORT ---
+# Stock logs, archived batches and every timeline event (active batches included) are walked sub-zone by sub-zone
+# and yielded as COLUMNS tuples, time as epoch seconds: each entry's row, then its timeline. Only one sub-zone's lists
+# are copied (under `lock`) at a time. `archived(key, sub)` iterates the sub-zone's older entries from the cold tier,
+# exported ahead of the resident ones as they are read, so a long cold history is never held in memory.
+def matches_location(key, locations): return not locations or key in locations or key.split("::")[0] in locations
+
+def count_source(level3_data, locations=None):
+    # entries the walk will scan, for progress reporting
+    total = 0
+    for key, loc in list(level3_data.items()):
+        if not matches_location(key, locations): continue
+        for tab_data in list(loc["data"].values()): total += len(tab_data["history"]) + sum(len(item["timeline"]) for item in tab_data["active"] + [h for h in tab_data["history"] if h.get("entry_type") != "Stock"])
+    return total
+
+def iter_rows(level3_data, lo=None, hi=None, locations=None, lock=None, progress=None, archived=None):
+    lock = lock or nullcontext(); scanned = 0
+    for key in list(level3_data):
+        if not matches_location(key, locations): continue
+        fac, room = key.split("::")
+        for sub in list(level3_data[key]["tabs"]):
+            with lock:
+                tab_data = level3_data[key]["data"].get(sub)
+                if tab_data is None: continue
+                history = list(tab_data["history"]); active = list(tab_data["active"])
+            for item in chain(archived(key, sub) if archived else (), history, active):
+                if item.get("entry_type") == "Stock":
+                    scanned += 1
+                    if in_range(item["date"], lo, hi): yield ("stock", fac, room, sub, None, item["type"], None, item["action"], item["quantity"], item["date"])
+                    continue
+                if item.get("entry_type") == "Batch":
+                    scanned += 1
+                    if in_range(item["date_completed"], lo, hi): yield ("batch", fac, room, sub, item["id"], item["type"], item["name"], "Archived", item["quantity"], item["date_completed"])
+                for log in list(item["timeline"]):
+                    scanned += 1
+                    if in_range(log["time"], lo, hi): yield ("timeline", fac, room, sub, item["id"], item["type"], item["name"], log["step"], None, log["time"])
+                    if progress and not scanned % CHUNK: progress(scanned)
+            if progress: progress(scanned)
+
+
+def write_csv_chunk(writer, chunk):
+    writer.writerows(row[:-1] + (fmt_ts(row[-1], EXPORT_TIME_FORMAT),) for row in chunk)
+
+def write_columnar_chunk(f, chunk):
+    # one gzip'd JSON line per chunk: {"rows": n, "columns": {name: [values...]}}
+    f.write(json.dumps({"rows": len(chunk), "columns": dict(zip(COLUMNS, (list(col) for col in zip(*chunk))))}, separators=(",", ":")) + "\n")
+
+def read_columnar(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            block = json.loads(line); cols = [block["columns"][name] for name in COLUMNS]
+            for row in zip(*cols): yield dict(zip(COLUMNS, row))
+
+
+def export_history(level3_data, base_path, lo=None, hi=None, locations=None, lock=None, progress=None, is_cancelled=lambda: False, archived=None):
+    # writes <base_path>.csv and <base_path>.cols.jsonl.gz in one streaming pass; returns (paths, rows) or None when cancelled
+    csv_path, cols_path = base_path + ".csv", base_path + ".cols.jsonl.gz"
+    rows = iter_rows(level3_data, lo, hi, locations, lock, progress, archived); written = 0
+    with open(csv_path, "w", newline="", encoding="utf-8") as csv_file, gzip.open(cols_path, "wt", encoding="utf-8") as cols_file:
+        writer = csv.writer(csv_file); writer.writerow(COLUMNS)
+        while True:
+            if is_cancelled(): break
+            chunk = list(islice(rows, CHUNK))
+            if not chunk: return (csv_path, cols_path), written
+            write_csv_chunk(writer, chunk); write_columnar_chunk(cols_file, chunk); written += len(chunk)
+    for path in (csv_path, cols_path): os.remove(path)
+    return None
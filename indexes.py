@@ -0,0 +1,176 @@
+import re
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+import events
+from timeutil import in_range
+from records import Batch
+
+BATCH_NAME_RE = re.compile(r"Batch (\d+)$")
+
+
+def iter_batches(level3_data):
+    for key, loc_data in level3_data.items():
+        for sub, tab_data in loc_data["data"].items():
+            for item in tab_data.get("active", []): yield key, sub, "active", item
+            for item in tab_data.get("history", []):
+                if item.get("entry_type") == "Batch": yield key, sub, "history", item
+
+
+# --- BATCH ID INDEX: id -> (item, key, sub, status) where status is the "active" or "history" list holding it ---
+class BatchIndex:
+    def __init__(self):
+        self.entries = {}
+
+    def rebuild(self, level3_data):
+        self.entries = {item["id"]: (item, key, sub, status) for key, sub, status, item in iter_batches(level3_data)}
+
+    def get(self, item_id): return self.entries.get(item_id)
+
+    def on_event(self, ev, result):
+        if ev["type"] == events.BATCH_CREATED: self.entries[result["id"]] = (result, ev["key"], ev["sub"], "active")
+        elif ev["type"] == events.BATCH_MOVED: self.entries[result["id"]] = (result, ev["to_key"], ev["to_sub"], "active")
+        elif ev["type"] == events.BATCH_ARCHIVED: self.entries[result["id"]] = (result, ev["key"], ev["sub"], "history")
+
+
+# --- GLOBAL BATCH NAME INDEX: name -> number of batches using it, plus the lowest free "Batch N" ---
+class BatchNameIndex:
+    def __init__(self, archived=None):
+        self.archived = archived  # () -> (id, name) of the cold tier's batches, whose names stay taken
+        self.counts = {}
+        self.names_by_id = {}
+        self.next_free = 1
+
+    def rebuild(self, level3_data):
+        self.counts.clear(); self.names_by_id.clear(); self.next_free = 1
+        for key, sub, status, item in iter_batches(level3_data): self.add(item["id"], item.get("name"))
+        for item_id, name in self.archived() if self.archived else (): self.add(item_id, name)
+
+    def __contains__(self, name): return name in self.counts
+
+    def add(self, item_id, name):
+        self.names_by_id[item_id] = name; self.counts[name] = self.counts.get(name, 0) + 1
+
+    def discard(self, item_id):
+        name = self.names_by_id.pop(item_id, None)
+        if name not in self.counts: return
+        self.counts[name] -= 1
+        if self.counts[name]: return
+        del self.counts[name]
+        match = BATCH_NAME_RE.match(name or "")
+        if match: self.next_free = min(self.next_free, int(match.group(1)))
+
+    def unique_name(self):
+        while f"Batch {self.next_free}" in self.counts: self.next_free += 1
+        return f"Batch {self.next_free}"
+
+    def on_event(self, ev, result):
+        if ev["type"] == events.BATCH_CREATED: self.add(result["id"], result["name"])
+        elif ev["type"] == events.BATCH_UPDATED and ev["field"] == "name": self.discard(result["id"]); self.add(result["id"], result["name"])
+        elif ev["type"] in (events.BATCH_MOVED, events.BATCH_ARCHIVED) and self.names_by_id.get(result["id"]) != result["name"]: self.discard(result["id"]); self.add(result["id"], result["name"])
+
+
+# --- ACTIVITY INDEX: every timeline entry as (ts, batch id, position), kept sorted for bisect range queries ---
+class ActivityIndex:
+    def __init__(self):
+        self.keys = []
+        self.by_batch = {}       # batch id -> its registered keys, in timeline order
+        self.items = {}          # batch id -> batch record
+        self.day_counts = {}     # date ordinal -> timeline entries on that day
+        self.days = []
+
+    def rebuild(self, level3_data):
+        self.__init__()
+        for key, sub, status, item in iter_batches(level3_data):
+            self.items[item["id"]] = item; self.by_batch[item["id"]] = keys = [(log["time"], item["id"], pos) for pos, log in enumerate(item["timeline"])]
+            self.keys.extend(keys)
+            for k in keys: self.count_day(k[0], 1)
+        self.keys.sort()
+
+    def count_day(self, ts, delta):
+        day = datetime.fromtimestamp(ts).toordinal()
+        if day not in self.day_counts: self.day_counts[day] = 0; insort(self.days, day)
+        self.day_counts[day] += delta
+
+    def on_event(self, ev, result):
+        if not isinstance(result, Batch): return
+        item_id = result["id"]; self.items[item_id] = result
+        old = self.by_batch.get(item_id, []); new = [(log["time"], item_id, pos) for pos, log in enumerate(result["timeline"])]
+        same = 0
+        while same < len(old) and same < len(new) and old[same] == new[same]: same += 1
+        for k in old[same:]:
+            i = bisect_left(self.keys, k)
+            if i < len(self.keys) and self.keys[i] == k: del self.keys[i]; self.count_day(k[0], -1)
+        for k in new[same:]: insort(self.keys, k); self.count_day(k[0], 1)
+        self.by_batch[item_id] = new
+
+    def query(self, lo=None, hi=None):
+        # batch id -> its timeline entries inside [lo, hi], oldest first
+        start = 0 if lo is None else bisect_left(self.keys, (lo,))
+        end = len(self.keys) if hi is None else bisect_left(self.keys, (hi + 1,))
+        matches = {}
+        for ts, item_id, pos in self.keys[start:end]: matches.setdefault(item_id, []).append(self.items[item_id]["timeline"][pos])
+        return matches
+
+    def events_per_day(self, lo=None, hi=None):
+        start = 0 if lo is None else bisect_left(self.days, datetime.fromtimestamp(lo).toordinal())
+        end = len(self.days) if hi is None else bisect_right(self.days, datetime.fromtimestamp(hi).toordinal())
+        return [(datetime.fromordinal(day).date(), self.day_counts[day]) for day in self.days[start:end] if self.day_counts[day]]
+
+
+# --- CONSOLIDATED HISTORY: per sub-zone, archived batches grouped by name with their timelines merged, kept current on archive ---
+def history_ts(item):
+    ts = item.get("date") or item.get("date_completed")
+    if not ts and item.get("timeline"): ts = item["timeline"][-1]["time"]
+    return ts or 0
+
+def log_time(log): return log["time"]
+
+class ConsolidatedHistory:
+    def __init__(self):
+        self.zones = {}     # (key, sub) -> {"batches": {name: group}, "stock": [(seq, ts, entry)], "seq": history entries seen}
+
+    def rebuild(self, level3_data):
+        self.zones = {}
+        for key, loc_data in level3_data.items():
+            for sub, tab_data in loc_data["data"].items():
+                for item in tab_data.get("history", []): self.add(key, sub, item)
+
+    def add(self, key, sub, item):
+        zone = self.zones.setdefault((key, sub), {"batches": {}, "stock": [], "seq": 0}); seq = zone["seq"]; zone["seq"] += 1
+        if item.get("entry_type") == "Stock": zone["stock"].append((seq, history_ts(item), item)); return
+        group = zone["batches"].get(item["name"])
+        if group is None: zone["batches"][item["name"]] = self.new_group(seq, item)
+        else: self.merge(group, seq, item)
+
+    def new_group(self, seq, item):
+        timeline = sorted(item["timeline"], key=log_time)
+        return {"type": item["type"], "name": item["name"], "quantity": item["quantity"], "timeline": timeline, "times": {log["time"] for log in timeline}, "members": [(seq, history_ts(item), item)]}
+
+    def merge(self, group, seq, item):
+        # later archives of the same name only contribute entries at times not seen yet, merged in time order
+        new_logs = []
+        for log in item["timeline"]:
+            if log["time"] not in group["times"]: group["times"].add(log["time"]); new_logs.append(log)
+        new_logs.sort(key=log_time)
+        group["timeline"] = list(heapq.merge(group["timeline"], new_logs, key=log_time))
+        group["quantity"] += item["quantity"]; group["members"].append((seq, history_ts(item), item))
+
+    def on_event(self, ev, result):
+        if ev["type"] in (events.BATCH_ARCHIVED, events.STOCK_ADDED): self.add(ev["key"], ev["sub"], result)
+
+    def query(self, key, sub, lo=None, hi=None):
+        # (batch groups, stock entries) archived inside [lo, hi], in archive order; groups only partly in range are re-merged
+        zone = self.zones.get((key, sub))
+        if zone is None: return [], []
+        stock = [item for seq, ts, item in zone["stock"] if in_range(ts, lo, hi)]
+        batches = []
+        for group in zone["batches"].values():
+            members = [m for m in group["members"] if in_range(m[1], lo, hi)]
+            if not members: continue
+            if len(members) < len(group["members"]):
+                group = self.new_group(members[0][0], members[0][2])
+                for seq, ts, item in members[1:]: self.merge(group, seq, item)
+            batches.append((members[0][0], group))
+        batches.sort(key=lambda b: b[0])
+        return [group for seq, group in batches], stock
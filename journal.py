@@ -0,0 +1,81 @@
+import threading
+from contextlib import contextmanager
+from events import apply_event
+from indexes import BatchIndex
+
+
+class RevisionConflict(Exception): pass
+
+
+# --- APPEND-ONLY EVENT JOURNAL ---
+# All shop-floor state changes go through emit(): the event is applied to level3_data, appended to the
+# journal and the touched rows are marked for the next snapshot checkpoint.
+# Passing `rev` makes the emit a compare-and-set: the event is only applied if the batch is still at the revision
+# the caller validated against, otherwise RevisionConflict is raised and nothing changes. `check` is called under the
+# same lock right before the event is applied; whatever it raises rejects the event the same way.
+class Journal:
+    def __init__(self, db):
+        self.db = db
+        self.level3_data = None
+        self.listeners = []
+        self.indexes = []            # attached indexes, rebuilt after history moves into the cold tier
+        self.settle_listeners = []   # called when a thread's outermost hold (or transaction) exits
+        self.batches = BatchIndex()
+        self.depth = 0
+        self.local = threading.local()
+        db.on_archived = self.rebuild_indexes
+
+    def load(self):
+        state = self.db.load(); self.level3_data = state[3]
+        self.batches.rebuild(self.level3_data)
+        for ev in self.db.events_since_checkpoint(): self.batches.on_event(ev, apply_event(self.level3_data, ev, self.db, self.batches))
+        return state
+
+    def subscribe(self, listener, on_settled=None):
+        self.listeners.append(listener)
+        if on_settled: self.settle_listeners.append(on_settled)
+
+    def held(self): return getattr(self.local, "holds", 0) > 0
+
+    def attach(self, index):
+        index.rebuild(self.level3_data); self.indexes.append(index); self.subscribe(index.on_event)
+        return index
+
+    def rebuild_indexes(self):
+        # under db.lock, after Storage.archive_aged() removed entries from the history lists
+        self.batches.rebuild(self.level3_data)
+        for index in self.indexes: index.rebuild(self.level3_data)
+
+    def emit(self, ev, rev=None, check=None):
+        with self.db.lock:
+            if rev is not None:
+                entry = self.batches.get(ev["id"])
+                if entry is None or entry[0].get("rev", 0) != rev: raise RevisionConflict(ev["id"])
+            if check: check()
+            result = apply_event(self.level3_data, ev, self.db, self.batches)
+            self.db.append_event(ev); self.batches.on_event(ev, result)
+            for listener in self.listeners: listener(ev, result)  # indexes stay consistent with level3_data under the lock
+        if not self.depth: self.db.save()
+        return result
+
+    @contextmanager
+    def hold(self):
+        # marks a bulk operation of this thread (an import, a transaction): its events are applied and journaled as
+        # usual, and listeners that announce changes wait for the outermost hold to exit to announce them once
+        self.local.holds = getattr(self.local, "holds", 0) + 1
+        try: yield self
+        finally:
+            self.local.holds -= 1
+            if not self.local.holds:
+                for listener in self.settle_listeners: listener()
+
+    @contextmanager
+    def transaction(self):
+        # the events emitted inside are committed together by one flush when the outermost block exits, after the
+        # lock is released so other operators do not wait on the disk write
+        with self.hold():
+            self.db.lock.acquire(); self.depth += 1
+            try: yield self
+            finally:
+                self.depth -= 1; outermost = not self.depth; self.db.lock.release()
+                if outermost: self.db.flush()
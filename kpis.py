@@ -0,0 +1,134 @@
+import math
+from collections import Counter
+from datetime import datetime
+import events
+from indexes import iter_batches
+from records import Batch
+
+
+# --- LOG-SCALE HISTOGRAM: exact mean, p95 to within one bucket (~19%), samples can be added and taken back in O(1) ---
+def bucket_of(seconds): return 0 if seconds <= 0 else int(math.log2(seconds) * 4) + 1
+def bucket_upper(bucket): return 0 if bucket == 0 else 2 ** (bucket / 4)
+
+class Histogram:
+    __slots__ = ("count", "total", "buckets")
+
+    def __init__(self): self.count = 0; self.total = 0; self.buckets = {}
+
+    def add(self, value, n=1):
+        b = bucket_of(value); self.count += n; self.total += value * n
+        self.buckets[b] = self.buckets.get(b, 0) + n
+        if not self.buckets[b]: del self.buckets[b]
+
+    def merge(self, count, total, buckets):
+        self.count += count; self.total += total
+        for b, n in buckets: self.buckets[b] = self.buckets.get(b, 0) + n
+
+    def mean(self): return self.total / self.count if self.count else 0
+
+    def percentile(self, q):
+        seen, rank = 0, q * self.count
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank: return bucket_upper(b)
+        return 0
+
+
+def cycle_samples(item): return Counter((step, completed - started) for step, (started, completed) in zip(item["steps"], item["step_times"]) if started is not None and completed is not None)
+
+def completed_day(item): return datetime.fromtimestamp(item["date_completed"]).toordinal()
+
+def summarize(entries):
+    # what a cold segment adds to the KPIs, stored beside it as JSON: [day, product, batches] completions and
+    # [product, step, count, total, [[bucket, n], ...]] cycle-time histograms
+    completed = Counter(); cycles = {}
+    for item in entries:
+        if item.get("entry_type") != "Batch": continue
+        completed[(completed_day(item), item["type"])] += 1
+        for (step, seconds), n in cycle_samples(item).items():
+            hist = cycles.get((item["type"], step))
+            if hist is None: hist = cycles[(item["type"], step)] = Histogram()
+            hist.add(seconds, n)
+    return {"completed": [[day, product, n] for (day, product), n in completed.items()], "cycles": [[product, step, hist.count, hist.total, list(hist.buckets.items())] for (product, step), hist in cycles.items()]}
+
+
+# --- PRODUCTION KPIs: running counters kept current from the journal, never recomputed from the tree ---
+# Per (product, "Factory::Room"): WIP batches and quantity, quantity in stock and batches completed per day;
+# per (product, step): Started -> Completed cycle times. Every event costs O(steps of the batch it touches).
+class ProductionKPIs:
+    def __init__(self, archived=None):
+        self.archived = archived  # () -> (key, summary) per cold segment, see summarize(); added up by rebuild
+        self.wip = {}           # (product, key) -> [batches, quantity]
+        self.stock = {}         # (product, key) -> quantity
+        self.completed = {}     # date ordinal -> Counter((product, key) -> batches archived that day)
+        self.cycles = {}        # (product, step) -> Histogram of seconds
+        self.batches = {}       # active batch id -> (product, key, quantity, Counter((step, seconds)))
+
+    def rebuild(self, level3_data):
+        self.__init__(self.archived)
+        for key, loc in level3_data.items():
+            for tab_data in loc["data"].values():
+                for product, qty in tab_data["stock"].items(): self.add_stock(product, key, qty)
+        for key, sub, status, item in iter_batches(level3_data):
+            if status == "active": self.track(item, key)
+            else: self.add_samples(item["type"], cycle_samples(item)); self.count_completed(item, key)
+        for key, summary in self.archived() if self.archived else (): self.add_summary(key, summary)
+
+    def add_summary(self, key, summary):
+        for day, product, n in summary["completed"]: self.completed.setdefault(day, Counter())[(product, key)] += n
+        for product, step, count, total, buckets in summary["cycles"]:
+            hist = self.cycles.get((product, step))
+            if hist is None: hist = self.cycles[(product, step)] = Histogram()
+            hist.merge(count, total, buckets)
+
+    def add_samples(self, product, samples, sign=1):
+        for (step, seconds), n in samples.items():
+            hist = self.cycles.get((product, step))
+            if hist is None: hist = self.cycles[(product, step)] = Histogram()
+            hist.add(seconds, n * sign)
+
+    def add_stock(self, product, key, qty): self.stock[(product, key)] = self.stock.get((product, key), 0) + qty
+
+    def add_wip(self, product, key, n, qty):
+        counts = self.wip.setdefault((product, key), [0, 0]); counts[0] += n; counts[1] += qty
+
+    def count_completed(self, item, key):
+        self.completed.setdefault(completed_day(item), Counter())[(item["type"], key)] += 1
+
+    def track(self, item, key):
+        samples = cycle_samples(item); self.batches[item["id"]] = (item["type"], key, item["quantity"], samples)
+        self.add_wip(item["type"], key, 1, item["quantity"]); self.add_samples(item["type"], samples)
+
+    def untrack(self, item_id):
+        product, key, qty, samples = self.batches.pop(item_id)
+        self.add_wip(product, key, -1, -qty); self.add_samples(product, samples, -1)
+
+    def on_event(self, ev, result):
+        if ev["type"] == events.STOCK_ADDED: self.add_stock(ev["product"], ev["key"], ev["qty"]); return
+        if ev["type"] == events.BATCH_CREATED: self.add_stock(ev["product"], ev["key"], -ev["qty"])
+        if not isinstance(result, Batch): return
+        if result["id"] in self.batches: self.untrack(result["id"])
+        if ev["type"] == events.BATCH_ARCHIVED: self.add_samples(result["type"], cycle_samples(result)); self.count_completed(result, ev["key"])
+        else: self.track(result, ev["to_key"] if ev["type"] == events.BATCH_MOVED else ev["key"])
+
+    # --- QUERIES: cost depends on products x rooms (and days with completions), not on the number of batches ---
+    def totals(self, by=None):
+        # by: None for plant totals, or "product" / "factory" / "room" -> {name: {"wip", "wip_qty", "stock"}}
+        def group(product, key): return None if by is None else product if by == "product" else key.split("::")[0] if by == "factory" else key
+        result = {}
+        for (product, key), (n, qty) in self.wip.items():
+            row = result.setdefault(group(product, key), {"wip": 0, "wip_qty": 0, "stock": 0}); row["wip"] += n; row["wip_qty"] += qty
+        for (product, key), qty in self.stock.items(): result.setdefault(group(product, key), {"wip": 0, "wip_qty": 0, "stock": 0})["stock"] += qty
+        return result if by else result.get(None, {"wip": 0, "wip_qty": 0, "stock": 0})
+
+    def completed_between(self, lo=None, hi=None):
+        # archived batches per product inside [lo, hi] (epoch seconds, day granularity)
+        first = None if lo is None else datetime.fromtimestamp(lo).toordinal(); last = None if hi is None else datetime.fromtimestamp(hi).toordinal()
+        result = Counter()
+        for day, counts in self.completed.items():
+            if (first is None or day >= first) and (last is None or day <= last):
+                for (product, key), n in counts.items(): result[product] += n
+        return result
+
+    def cycle_times(self):
+        return [{"product": product, "step": step, "count": hist.count, "mean": hist.mean(), "p95": hist.percentile(0.95)} for (product, step), hist in sorted(self.cycles.items()) if hist.count]
@@ -1,7 +1,12 @@
+import csv
+import heapq
+import logging
 import flet as ft
-import uuid
-import copy
-from datetime import datetime
+from scheduler import batched, mark_dirty, get_scheduler, LatestQuery, QueryError
+from timeutil import fmt_ts, day_bounds
+from indexes import ConsolidatedHistory
+from service import ServiceError, ConflictError, parse_qty, new_import_summary
+from perf import timed
 
 CARD_BG = "#FFFFFF"
 TEXT_MAIN = "#0F172A"
@@ -11,18 +16,14 @@ SUCCESS = "#10B981"
 WARNING = "#F59E0B"
 BORDER = "#E2E8F0"
 
-def parse_qty(val):
-    try: return float(val)
-    except (ValueError, TypeError): return None
+log = logging.getLogger("erp.location")
 
-def parse_date(date_str):
-    try: return datetime.strptime(date_str, "%Y-%m-%d %I:%M %p")
-    except ValueError:
-        try: return datetime.strptime(date_str, "%I:%M %p, %d %b")
-        except: return datetime.now() 
+def loading_placeholder(text): return ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Row([ft.ProgressRing(width=18, height=18, stroke_width=2, color=PRIMARY), ft.Text(text, color=TEXT_SUB, size=15)], alignment=ft.MainAxisAlignment.CENTER, spacing=10))
+
+def make_input(val, lbl, width, on_blur_cb): return ft.TextField(value=val, label=lbl, height=44, content_padding=ft.padding.symmetric(horizontal=12, vertical=5), text_size=13, width=width, expand=(width is None), border_radius=8, border_color="#E2E8F0", focused_border_color=PRIMARY, on_blur=on_blur_cb)
 
 class LocationView(ft.Container):
-    def __init__(self, page: ft.Page, products_config: dict, get_context_cb, factories: list, factory_sub_locations: dict, level3_data: dict, save_cb):
+    def __init__(self, page: ft.Page, products_config: dict, get_context_cb, factories: list, factory_sub_locations: dict, level3_data: dict, service, archive):
         super().__init__()
         self.page = page
         self.products_config = products_config
@@ -31,18 +32,29 @@ class LocationView(ft.Container):
         self.factory_sub_locations = factory_sub_locations
         
         self.level3_data = level3_data 
-        self.save_cb = save_cb 
+        self.service = service
+        self.journal = service.journal 
+        self.db = service.db 
+        self.names = service.names
+        self.archive = archive
         
         self.expand = True
         self.padding = 15 
         self.visible = False
 
         self.current_action_item = None 
+        self.current_action_rev = None   # batch revision the operator saw when opening the dialog
         self.current_process_product = None 
         self.is_finishing_batch = False
         
         self.expanded_active_groups = set()
         self.expanded_history_groups = set()
+        self.selected_tabs = {}  # "Factory::Location" -> sub-zone this session works in; level3_data is shared by all sessions
+
+        self.cache_key = None
+        self.card_cache = {}     # batch id -> (rev, card control)
+        self.group_tiles = {}    # product -> controls of its ExpansionTile
+        self.history_query = LatestQuery(page)
 
         self.history_start_date = None
         self.history_end_date = None
@@ -51,20 +63,22 @@ class LocationView(ft.Container):
         
         # --- SAFE OVERLAY FIX ---
         # DO NOT APPEND HERE. Main.py will append these safely.
-        self.overlay_controls = [self.start_date_picker, self.end_date_picker]
+        self.csv_picker = ft.FilePicker(on_result=self.on_csv_picked)
+        self.overlay_controls = [self.start_date_picker, self.end_date_picker, self.csv_picker]
 
         self.l3_tabs = ft.Tabs(selected_index=0, on_change=self.on_l3_tab_change, animation_duration=300, expand=True, label_color=PRIMARY, unselected_label_color=TEXT_SUB, indicator_color=PRIMARY)
         self.add_l3_btn = ft.IconButton(icon=ft.Icons.ADD_BOX, icon_color=PRIMARY, on_click=self.open_add_l3_dialog)
         
         btn_style = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))
         self.add_stock_btn = ft.ElevatedButton("Import Stock", icon=ft.Icons.ADD_SHOPPING_CART, on_click=self.open_add_stock_dialog, bgcolor=TEXT_MAIN, color="#FFFFFF", style=btn_style)
+        self.import_csv_btn = ft.TextButton("Import CSV", icon=ft.Icons.UPLOAD_FILE, on_click=lambda e: self.csv_picker.pick_files(dialog_title="Import stock from CSV", allowed_extensions=["csv"]), style=ft.ButtonStyle(color=TEXT_MAIN, shape=ft.RoundedRectangleBorder(radius=8)))
         
         self.view_mode_tabs = ft.Tabs(selected_index=0, on_change=self.on_view_mode_change, animation_duration=300, label_color=PRIMARY, unselected_label_color=TEXT_SUB, indicator_color=PRIMARY)
         self.list_container = ft.ListView(spacing=20, expand=True, padding=ft.padding.only(bottom=40))
 
         self.content = ft.Column([
             ft.Container(padding=10, bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=8, color="#00000005", offset=ft.Offset(0, 2)), content=ft.Row([self.l3_tabs, self.add_l3_btn], alignment=ft.MainAxisAlignment.START)),
-            ft.Container(height=10), ft.Row([self.view_mode_tabs, self.add_stock_btn], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True), ft.Container(height=5), self.list_container
+            ft.Container(height=10), ft.Row([self.view_mode_tabs, ft.Row([self.import_csv_btn, self.add_stock_btn], spacing=5)], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True), ft.Container(height=5), self.list_container
         ], expand=True)
 
         dlg_shape = ft.RoundedRectangleBorder(radius=12)
@@ -98,55 +112,56 @@ class LocationView(ft.Container):
     def show_snackbar(self, msg, is_error=False): self.page.open(ft.SnackBar(content=ft.Text(msg, color="#FFFFFF", weight=ft.FontWeight.W_500), bgcolor="#EF4444" if is_error else "#10B981", behavior=ft.SnackBarBehavior.FLOATING, margin=20, shape=ft.RoundedRectangleBorder(radius=8)))
 
     def get_current_data(self):
-        factory, loc = self.get_context(); key = f"{factory}::{loc}"
-        if key not in self.level3_data: self.level3_data[key] = {"tabs": [], "active_tab": 0, "data": {}}
-        for tab_val, tab_data in self.level3_data[key]["data"].items():
-            if "stock" not in tab_data: tab_data["stock"] = {}
-        return self.level3_data[key]
+        factory, loc = self.get_context()
+        return self.level3_data.get(f"{factory}::{loc}") or {"tabs": [], "data": {}}
+
+    def current_sub(self):
+        # the sub-zone selected in this session, or the location's first one until one is picked
+        factory, loc = self.get_context(); tabs = self.get_current_data()["tabs"]; sub = self.selected_tabs.get(f"{factory}::{loc}")
+        return sub if sub in tabs else tabs[0] if tabs else None
+
+    def select_tab(self, key, sub): self.selected_tabs[key] = sub
+
+    def get_current_tab(self):
+        factory, loc = self.get_context(); sub = self.current_sub()
+        return f"{factory}::{loc}", sub, self.get_current_data()["data"][sub]
 
     def get_item_by_id(self, item_id, return_list=False):
-        data_ctx = self.get_current_data()
-        if not data_ctx["tabs"]: return None
-        active_items = data_ctx["data"][data_ctx["tabs"][data_ctx["active_tab"]]]["active"]
-        for item in active_items:
-            if item["id"] == item_id: return (item, active_items) if return_list else item
-        return None
-
-    def get_all_batch_names(self):
-        names = set()
-        for loc_data in self.level3_data.values():
-            for tab_data in loc_data["data"].values():
-                for item in tab_data.get("active", []): names.add(item.get("name"))
-                for item in tab_data.get("history", []):
-                    if item.get("entry_type") == "Batch": names.add(item.get("name"))
-        return names
-
-    def get_unique_batch_name(self):
-        existing = self.get_all_batch_names()
-        i = 1
-        while f"Batch {i}" in existing: i += 1
-        return f"Batch {i}"
+        entry = self.journal.batches.get(item_id)
+        if entry is None or entry[3] != "active" or not self.get_current_data()["tabs"]: return None
+        item, key, sub, status = entry; curr_key, curr_sub, tab_data = self.get_current_tab()
+        if (key, sub) != (curr_key, curr_sub): return None
+        return (item, tab_data["active"]) if return_list else item
+
+    def get_unique_batch_name(self): return self.names.unique_name()
 
     def update_context(self): self.render()
 
+    def focus_item(self, item, status):
+        # for search results: open the view mode holding the batch with its product group expanded
+        self.expanded_active_groups.clear(); self.expanded_history_groups.clear()
+        if status == "active": self.view_mode_tabs.selected_index = 0; self.expanded_active_groups.add(item["type"]); self.group_tiles.pop(item["type"], None)
+        else: self.view_mode_tabs.selected_index = 1; self.expanded_history_groups.add(item["type"]); self.history_start_date = None; self.history_end_date = None
+
     def open_add_l3_dialog(self, e): self.l3_name_input.value = ""; self.page.open(self.l3_dialog)
+    @batched
     def save_l3_tab(self, e):
         val = self.l3_name_input.value.strip()
         if not val: return
-        data_ctx = self.get_current_data()
-        if val not in data_ctx["tabs"]:
-            data_ctx["tabs"].append(val); data_ctx["data"][val] = {"stock": {}, "active": [], "history": []}; data_ctx["active_tab"] = len(data_ctx["tabs"]) - 1
-            self.page.close(self.l3_dialog); self.render()
-        else: self.show_snackbar("Name already exists!", True)
+        factory, loc = self.get_context()
+        try: self.service.add_sub_zone(f"{factory}::{loc}", val)
+        except ServiceError as err: self.show_snackbar(str(err), True); return
+        self.select_tab(f"{factory}::{loc}", val); self.page.close(self.l3_dialog); self.render()
 
+    @batched
     def on_l3_tab_change(self, e): 
-        data_ctx = self.get_current_data()
-        data_ctx["active_tab"] = self.l3_tabs.selected_index
+        factory, loc = self.get_context(); self.select_tab(f"{factory}::{loc}", self.l3_tabs.tabs[self.l3_tabs.selected_index].text)
         self.view_mode_tabs.selected_index = 0
         self.expanded_active_groups.clear()
         self.expanded_history_groups.clear()
         self.render()
 
+    @batched
     def on_view_mode_change(self, e):
         self.expanded_active_groups.clear()
         self.expanded_history_groups.clear()
@@ -156,130 +171,141 @@ class LocationView(ft.Container):
         if not self.products_config: self.show_snackbar("Configure products in Settings first!", True); return
         self.prod_dropdown.options = [ft.dropdown.Option(p) for p in self.products_config.keys()]; self.prod_dropdown.value = None; self.stock_qty_input.value = ""; self.page.open(self.stock_dialog)
 
+    @batched
     def save_stock(self, e):
         prod_name = self.prod_dropdown.value; qty = parse_qty(self.stock_qty_input.value.strip())
         if not prod_name or qty is None or qty <= 0: return
-        data_ctx = self.get_current_data(); tab_data = data_ctx["data"][data_ctx["tabs"][data_ctx["active_tab"]]]
-        tab_data["stock"][prod_name] = tab_data["stock"].get(prod_name, 0) + qty
-        tab_data["history"].append({"entry_type": "Stock", "type": prod_name, "action": "Added to Stock", "quantity": qty, "date": datetime.now().strftime("%Y-%m-%d %I:%M %p")})
+        if self.call(self.service.add_stock, prod_name, qty) is None: return
         self.expanded_active_groups.add(prod_name); self.page.close(self.stock_dialog); self.render()
 
+    @batched
+    def on_csv_picked(self, e):
+        if not e.files: return
+        if not e.files[0].path: self.show_snackbar("CSV import needs a local file (not available in the web build).", True); return
+        key, sub, _ = self.get_current_tab(); self.show_snackbar(f"Importing {e.files[0].name}...")
+        self.import_csv_btn.disabled = True; self.import_csv_btn.text = "Importing..."; mark_dirty(self.import_csv_btn)
+        self.page.run_thread(self.run_csv_import, e.files[0].path, key, sub)
+
+    def run_csv_import(self, path, key, sub):
+        # worker thread: the whole file is streamed through the service, then the view renders once. If reading stops part
+        # way the chunks committed so far stay, and the summary reports them with the error.
+        summary = new_import_summary(); error = None
+        try:
+            with get_scheduler(self.page).origin(): self.service.import_stock_csv(path, key, sub, summary)
+        except (OSError, UnicodeDecodeError, csv.Error) as err: error = f"Could not read the file: {err}"
+        except Exception as err: log.exception("CSV import of %s failed", path); error = f"Import failed: {err}"
+        finally:
+            with get_scheduler(self.page).frame(): self.import_csv_btn.disabled = False; self.import_csv_btn.text = "Import CSV"; mark_dirty(self.import_csv_btn)
+        with get_scheduler(self.page).frame():
+            if summary["added"] or summary["rejected"]: self.render()
+            self.show_import_summary(summary, error)
+
+    def show_import_summary(self, summary, error=None):
+        lines = [ft.Text(f"{summary['added']} lines added ({summary['quantity']:g} units) to {len(summary['zones'])} sub-zone(s), {summary['rejected']} rejected.", color=TEXT_MAIN)]
+        if error: lines.insert(0, ft.Text(f"{error}. The import stopped there; the lines counted below were committed.", color="#EF4444", weight=ft.FontWeight.W_600))
+        if summary["samples"]:
+            shown = "" if summary["rejected"] == len(summary["samples"]) else f" (first {len(summary['samples'])})"
+            lines += [ft.Text(f"Rejected rows{shown}:", weight=ft.FontWeight.W_600, color=TEXT_MAIN), ft.Column([ft.Text(f"Line {line_no}: {reason}", size=12, color=TEXT_SUB) for line_no, reason in summary["samples"]], spacing=2, scroll=ft.ScrollMode.AUTO, height=200)]
+        dialog = ft.AlertDialog(shape=ft.RoundedRectangleBorder(radius=12), title=ft.Text("Stock Import Stopped" if error else "Stock Import Finished", weight=ft.FontWeight.BOLD), content=ft.Column(lines, tight=True, spacing=8), actions=[ft.TextButton("Close", on_click=lambda e: self.page.close(dialog), style=ft.ButtonStyle(color=TEXT_SUB))])
+        self.page.open(dialog)
+
     def open_process_dialog(self, product_name):
         self.current_process_product = product_name; self.process_batch_input.value = self.get_unique_batch_name(); self.process_qty_input.value = ""; self.page.open(self.process_dialog)
 
+    @batched
     def execute_process(self, e):
         ptype = self.current_process_product; qty = parse_qty(self.process_qty_input.value)
-        batch_name = self.process_batch_input.value.strip() or self.get_unique_batch_name()
-        if batch_name in self.get_all_batch_names(): self.show_snackbar(f"Batch name '{batch_name}' is already in use!", True); return
         if qty is None or qty <= 0: return
-        data_ctx = self.get_current_data(); tab_data = data_ctx["data"][data_ctx["tabs"][data_ctx["active_tab"]]]
-        current_stock = tab_data["stock"].get(ptype, 0)
-        if qty > current_stock: self.show_snackbar(f"Not enough stock! Only {current_stock:g} available.", True); return
-            
-        tab_data["stock"][ptype] -= qty
-        independent_steps = list(self.products_config.get(ptype, []))
-        time_str = datetime.now().strftime("%Y-%m-%d %I:%M %p")
-        tab_data["active"].append({"id": str(uuid.uuid4()), "type": ptype, "name": batch_name, "quantity": qty, "steps": independent_steps, "step_idx": 0, "is_processing": False, "timeline": [{"step": "Created from Stock", "time": time_str}]})
+        if self.call(self.service.create_batch, ptype, qty, self.process_batch_input.value) is None: return
         self.page.close(self.process_dialog); self.render()
 
-    def update_field(self, item_id, field, value):
+    @batched
+    def update_field(self, item_id, field, value, rev=None):
         item = self.get_item_by_id(item_id)
         if not item: return
         if field == "quantity":
-            val = parse_qty(value)
-            if val is not None: item[field] = val
-        elif field == "name":
-            val = value.strip()
-            if val in self.get_all_batch_names() and val != item["name"]: self.show_snackbar("This batch name exists elsewhere! Change reverted.", True); self.render(); return
-            item[field] = val if val else item[field]
-        else: item[field] = value
-
-    def open_confirm_step(self, item_id):
-        self.current_action_item = item_id; item = self.get_item_by_id(item_id)
+            value = parse_qty(value)
+            if value is None: return
+        if self.call(self.service.update_batch, item_id, field, value, rev=rev) is None: self.card_cache.pop(item_id, None); self.render()
+        else: self.refresh_item(item_id)  # the card's actions must carry the batch's new revision
+
+    def call(self, op, *args, **kwargs):
+        # runs a service operation on the current sub-zone; a rejected one is shown as a snackbar and returns None.
+        # On a conflict the action dialog is closed and the sub-zone re-rendered, so the operator retries on current data.
+        key, sub, tab_data = self.get_current_tab()
+        try: return op(key, sub, *args, **kwargs)
+        except ConflictError as err:
+            for dialog in (self.confirm_dialog, self.step_dialog, self.complete_batch_dialog, self.move_dialog):
+                if dialog.open: self.page.close(dialog)
+            self.show_snackbar(str(err), True); self.render()
+        except ServiceError as err: self.show_snackbar(str(err), True)
+
+    @batched
+    def open_confirm_step(self, item_id, rev=None):
+        self.current_action_item = item_id; self.current_action_rev = rev; item = self.get_item_by_id(item_id)
+        if item is None: self.show_snackbar(str(self.service.conflict(item_id)), True); self.render(); return  # archived or moved by another operator
         if item["step_idx"] < len(item["steps"]):
             self.is_finishing_batch = False; step_name = item["steps"][item["step_idx"]]
             if not item.get("is_processing", False): self.confirm_text.value = f"Commence step '{step_name}'?"; self.confirm_btn.text = "Yes, Start"; self.confirm_btn.bgcolor = PRIMARY
             else: self.confirm_text.value = f"Log '{step_name}' as fully completed?"; self.confirm_btn.text = "Yes, Complete"; self.confirm_btn.bgcolor = "#0D9488" 
             self.page.open(self.confirm_dialog)
 
-    def open_custom_step(self, item_id): self.current_action_item = item_id; self.custom_step_input.value = ""; self.custom_step_pos_input.value = ""; self.page.open(self.step_dialog)
-    def open_complete_batch(self, item_id): self.current_action_item = item_id; self.page.open(self.complete_batch_dialog)
+    def open_custom_step(self, item_id, rev=None): self.current_action_item = item_id; self.current_action_rev = rev; self.custom_step_input.value = ""; self.custom_step_pos_input.value = ""; self.page.open(self.step_dialog)
+    def open_complete_batch(self, item_id, rev=None): self.current_action_item = item_id; self.current_action_rev = rev; self.page.open(self.complete_batch_dialog)
 
-    def open_move_dialog(self, item_id):
-        self.current_action_item = item_id; self.move_fac_dd.options = [ft.dropdown.Option(f) for f in self.factories]
+    def open_move_dialog(self, item_id, rev=None):
+        self.current_action_item = item_id; self.current_action_rev = rev; self.move_fac_dd.options = [ft.dropdown.Option(f) for f in self.factories]
         curr_fac, curr_loc = self.get_context(); self.move_fac_dd.value = curr_fac; self.on_move_fac_change(None); self.move_loc_dd.value = curr_loc; self.on_move_loc_change(None) 
-        if self.get_current_data()["tabs"]: self.move_sub_dd.value = self.get_current_data()["tabs"][self.get_current_data()["active_tab"]]
+        self.move_sub_dd.value = self.current_sub()
         self.page.open(self.move_dialog)
 
+    @batched
     def on_move_fac_change(self, e):
         fac = self.move_fac_dd.value; self.move_loc_dd.options = [ft.dropdown.Option(l) for l in self.factory_sub_locations[fac]] if fac and fac in self.factory_sub_locations else []
         self.move_loc_dd.value = None; self.move_sub_dd.options = []; self.move_sub_dd.value = None
-        if e: self.page.update()
+        if e: mark_dirty(self.move_loc_dd, self.move_sub_dd)
 
+    @batched
     def on_move_loc_change(self, e):
         fac, loc = self.move_fac_dd.value, self.move_loc_dd.value
         key = f"{fac}::{loc}"
         if fac and loc and key in self.level3_data and self.level3_data[key]["tabs"]: self.move_sub_dd.options = [ft.dropdown.Option(t) for t in self.level3_data[key]["tabs"]]
         else: self.move_sub_dd.options = []
         self.move_sub_dd.value = None
-        if e: self.page.update()
+        if e: mark_dirty(self.move_sub_dd)
 
+    @batched
     def execute_move(self, e):
         fac, loc, sub = self.move_fac_dd.value, self.move_loc_dd.value, self.move_sub_dd.value
         if not (fac and loc and sub): return
-        curr_fac, curr_loc = self.get_context(); curr_sub = self.get_current_data()["tabs"][self.get_current_data()["active_tab"]]
-        item, active_items_list = self.get_item_by_id(self.current_action_item, return_list=True)
-        active_items_list.remove(item)
-        item["timeline"].append({"step": f"Relocated: [{curr_fac} > {curr_loc} > {curr_sub}] → [{fac} > {loc} > {sub}]", "time": datetime.now().strftime("%Y-%m-%d %I:%M %p")})
-        target_key = f"{fac}::{loc}"
-        if target_key not in self.level3_data: self.level3_data[target_key] = {"tabs": [sub], "active_tab": 0, "data": {sub: {"stock": {}, "active": [], "history": []}}}
-        elif sub not in self.level3_data[target_key]["data"]: self.level3_data[target_key]["tabs"].append(sub); self.level3_data[target_key]["data"][sub] = {"stock": {}, "active": [], "history": []}
-        self.level3_data[target_key]["data"][sub]["active"].append(item)
+        if self.call(self.service.move, self.current_action_item, f"{fac}::{loc}", sub, rev=self.current_action_rev) is None: return
         self.page.close(self.move_dialog); self.show_snackbar("Batch safely relocated!"); self.render()
 
+    @batched
     def execute_step(self, e):
-        item, active_items_list = self.get_item_by_id(self.current_action_item, return_list=True)
-        if item["step_idx"] < len(item["steps"]):
-            step_name = item["steps"][item["step_idx"]]
-            if not item.get("is_processing", False): item["is_processing"] = True; item["timeline"].append({"step": f"Started: {step_name}", "time": datetime.now().strftime("%Y-%m-%d %I:%M %p")})
-            else: item["is_processing"] = False; item["timeline"].append({"step": f"Completed: {step_name}", "time": datetime.now().strftime("%Y-%m-%d %I:%M %p")}); item["step_idx"] += 1
-        self.page.close(self.confirm_dialog); self.render()
+        self.call(self.service.advance, self.current_action_item, rev=self.current_action_rev)
+        self.page.close(self.confirm_dialog); self.refresh_item(self.current_action_item)
 
+    @batched
     def execute_custom_step(self, e):
         val = self.custom_step_input.value.strip(); pos_str = self.custom_step_pos_input.value.strip()
         if val:
-            item = self.get_item_by_id(self.current_action_item); pos_idx = len(item["steps"]) 
-            if pos_str.isdigit():
-                pos_idx = int(pos_str) - 1
-                if pos_idx < 0: pos_idx = 0
-                if pos_idx > len(item["steps"]): pos_idx = len(item["steps"])
-            item["steps"].insert(pos_idx, val)
-            if pos_idx < item["step_idx"]: item["step_idx"] += 1
-            elif pos_idx == item["step_idx"] and item.get("is_processing"): item["step_idx"] += 1
-            self.page.close(self.step_dialog); self.render()
-
-    def delete_specific_step(self, item_id, step_idx):
-        item = self.get_item_by_id(item_id)
-        if item and step_idx < len(item["steps"]): item["steps"].pop(step_idx); self.render()
+            if self.call(self.service.insert_step, self.current_action_item, val, int(pos_str) - 1 if pos_str.isdigit() else None, rev=self.current_action_rev) is None: return
+            self.page.close(self.step_dialog); self.refresh_item(self.current_action_item)
 
-    def execute_revert(self, item_id):
-        item = self.get_item_by_id(item_id)
-        if not item: return
-        if item.get("is_processing", False):
-            item["is_processing"] = False
-            if item["timeline"] and "Started:" in item["timeline"][-1]["step"]: item["timeline"].pop()
-        elif item["step_idx"] > 0:
-            item["step_idx"] -= 1; item["is_processing"] = True
-            if item["timeline"] and "Completed:" in item["timeline"][-1]["step"]: item["timeline"].pop()
-        self.render()
+    @batched
+    def delete_specific_step(self, item_id, step_idx, rev=None):
+        if self.get_item_by_id(item_id) and self.call(self.service.delete_step, item_id, step_idx, rev=rev) is not None: self.refresh_item(item_id)
+
+    @batched
+    def execute_revert(self, item_id, rev=None):
+        if not self.get_item_by_id(item_id): return
+        self.call(self.service.revert, item_id, rev=rev); self.refresh_item(item_id)
 
+    @batched
     def execute_complete_batch(self, e):
-        item, active_items_list = self.get_item_by_id(self.current_action_item, return_list=True)
-        data_ctx = self.get_current_data(); tab_data = data_ctx["data"][data_ctx["tabs"][data_ctx["active_tab"]]]
-        history_item = copy.deepcopy(item); history_item["date_completed"] = datetime.now().strftime("%Y-%m-%d %I:%M %p")
-        history_item["timeline"].append({"step": "Batch Finalized & Archived", "time": history_item["date_completed"]})
-        history_item["entry_type"] = "Batch"
-        tab_data["history"].append(history_item); active_items_list.remove(item) 
+        history_item = self.call(self.service.archive, self.current_action_item, rev=self.current_action_rev)
+        if history_item is None: return
         self.expanded_history_groups.add(history_item["type"]); self.page.close(self.complete_batch_dialog); self.render()
 
     def toggle_group(self, e, ptype, is_active):
@@ -287,144 +313,165 @@ class LocationView(ft.Container):
         if e.data == "true": target_set.add(ptype)
         else: target_set.discard(ptype)
 
+    @batched
     def on_start_date_change(self, e): self.history_start_date = self.start_date_picker.value; self.render_lists(None)
+    @batched
     def on_end_date_change(self, e): self.history_end_date = self.end_date_picker.value; self.render_lists(None)
+    @batched
     def clear_dates(self, e): self.history_start_date = None; self.history_end_date = None; self.render_lists(None)
 
     def render(self):
         data_ctx = self.get_current_data()
         current_l3_names = [t.text for t in self.l3_tabs.tabs]
         if current_l3_names != data_ctx["tabs"]: self.l3_tabs.tabs = [ft.Tab(text=t) for t in data_ctx["tabs"]]
-        self.l3_tabs.selected_index = data_ctx["active_tab"] if data_ctx["tabs"] else 0
+        active_tab_name = self.current_sub(); self.l3_tabs.selected_index = data_ctx["tabs"].index(active_tab_name) if active_tab_name else 0
         has_tabs = len(data_ctx["tabs"]) > 0
-        self.add_stock_btn.visible = has_tabs; self.view_mode_tabs.visible = has_tabs
+        self.add_stock_btn.visible = has_tabs; self.import_csv_btn.visible = has_tabs; self.view_mode_tabs.visible = has_tabs
         if not has_tabs:
             self.list_container.controls = [ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("Define a sub-location using the '+' icon above to start managing inventory.", color=TEXT_SUB, size=15))]
         else:
-            active_tab_name = data_ctx["tabs"][data_ctx["active_tab"]]
-            has_history = len(data_ctx["data"][active_tab_name]["history"]) > 0
+            factory, loc = self.get_context(); has_history = len(data_ctx["data"][active_tab_name]["history"]) > 0 or (f"{factory}::{loc}", active_tab_name) in self.db.archive_zones
             new_view_tab_names = ["Active Matrix"]
             if has_history: new_view_tab_names.append("Archive & Logs")
             current_view_tab_names = [t.text for t in self.view_mode_tabs.tabs]
             if current_view_tab_names != new_view_tab_names: self.view_mode_tabs.tabs = [ft.Tab(text=n) for n in new_view_tab_names]
             if self.view_mode_tabs.selected_index >= len(self.view_mode_tabs.tabs): self.view_mode_tabs.selected_index = 0
             self.render_lists(None)
-        if self.page: self.update()
+        if self.page: mark_dirty(self)
         
-        self.save_cb() 
+        self.db.save() 
 
+    @timed()
     def render_lists(self, e):
+        self.history_query.cancel()  # before clearing: a history query finishing now must not fill the new list
         self.list_container.controls.clear()
-        data_ctx = self.get_current_data()
-        tab_data = data_ctx["data"][data_ctx["tabs"][data_ctx["active_tab"]]]
+        tab_data = self.get_current_tab()[2]
         is_history_view = self.view_mode_tabs.selected_index == 1
-        
-        def make_input(val, lbl, width, on_blur_cb): return ft.TextField(value=val, label=lbl, height=44, content_padding=ft.padding.symmetric(horizontal=12, vertical=5), text_size=13, width=width, expand=(width is None), border_radius=8, border_color="#E2E8F0", focused_border_color=PRIMARY, on_blur=on_blur_cb)
 
         if is_history_view:
             date_row = ft.Container(padding=15, bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=10, color="#00000005", offset=ft.Offset(0, 2)), content=ft.Row([ft.Text("Log Filter:", color=TEXT_SUB, weight=ft.FontWeight.W_500), ft.ElevatedButton(f"Start: {self.history_start_date.strftime('%d %b %Y') if self.history_start_date else 'Any'}", on_click=lambda _: self.start_date_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))), ft.ElevatedButton(f"End: {self.history_end_date.strftime('%d %b %Y') if self.history_end_date else 'Any'}", on_click=lambda _: self.end_date_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))), ft.IconButton(ft.Icons.CLOSE, on_click=self.clear_dates, tooltip="Clear", icon_color="#EF4444", bgcolor="#FEF2F2")], wrap=True)) 
-            self.list_container.controls.append(date_row)
-
-            filtered_items = []
-            for item in tab_data["history"]:
-                dt_str = item.get("date") or item.get("date_completed")
-                if not dt_str and "timeline" in item and item["timeline"]: dt_str = item["timeline"][-1]["time"]
-                dt = parse_date(dt_str)
-                if self.history_start_date and dt.date() < self.history_start_date.date(): continue
-                if self.history_end_date and dt.date() > self.history_end_date.date(): continue
-                filtered_items.append(item)
-
-            if not filtered_items:
-                self.list_container.controls.append(ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("No history matching this date range.", color=TEXT_SUB, size=15)))
-                if self.page: self.update(); return
-
-            consolidated_batches = {}; stock_logs = []
-            for item in filtered_items:
-                if item.get("entry_type") == "Stock": stock_logs.append(item)
-                else:
-                    b_name = item["name"]
-                    if b_name not in consolidated_batches: consolidated_batches[b_name] = copy.deepcopy(item)
-                    else:
-                        consolidated_batches[b_name]["quantity"] += item["quantity"]; existing_times = [log["time"] for log in consolidated_batches[b_name]["timeline"]]
-                        for log in item["timeline"]:
-                            if log["time"] not in existing_times: consolidated_batches[b_name]["timeline"].append(log); existing_times.append(log["time"])
-
-            for b_name, b_data in consolidated_batches.items():
-                b_data["timeline"].sort(key=lambda x: parse_date(x["time"]))
-                should_expand = b_data["type"] in self.expanded_history_groups
-                logs_ui = []
-                for log in b_data["timeline"]:
-                    dt_obj = parse_date(log['time'])
-                    time_formatted = dt_obj.strftime("%d %b %Y, %I:%M %p")
-                    logs_ui.append(ft.Row([ft.Icon(ft.Icons.CIRCLE, size=6, color="#94A3B8"), ft.Text(f"{log['step']}", size=13, color=TEXT_MAIN, expand=True), ft.Text(time_formatted, size=11, color=TEXT_SUB)]))
-                
-                self.list_container.controls.append(ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=8, color="#00000005", offset=ft.Offset(0, 2)), content=ft.ExpansionTile(title=ft.Text(f"{b_data['type']} - {b_name}", weight=ft.FontWeight.W_700, color=TEXT_MAIN), subtitle=ft.Text(f"Archived Qty: {b_data['quantity']:g} | Last update: {b_data['timeline'][-1]['time']}", size=12, color=TEXT_SUB), leading=ft.Container(padding=8, bgcolor="#F0FDF4", border_radius=8, content=ft.Icon(ft.Icons.ARCHIVE_OUTLINED, color=SUCCESS, size=20)), initially_expanded=should_expand, on_change=lambda e, n=b_data["type"]: self.toggle_group(e, n, False), controls_padding=0, controls=[ft.Divider(height=1, color=BORDER), ft.Container(padding=ft.padding.symmetric(horizontal=20, vertical=15), bgcolor="#F8FAFC", content=ft.Column(logs_ui, spacing=6))])))
-
-            for item in reversed(stock_logs): 
-                is_added = "Added" in item["action"]
-                bg_c = "#EFF6FF" if is_added else "#FFF7ED"
-                icon_c = PRIMARY if is_added else WARNING
-                icon_t = ft.Icons.ADD_SHOPPING_CART if is_added else ft.Icons.PLAY_ARROW
-                dt_obj = parse_date(item['date'])
-                
-                self.list_container.controls.append(ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), padding=ft.padding.symmetric(vertical=5), content=ft.ListTile(leading=ft.Container(padding=8, bgcolor=bg_c, border_radius=8, content=ft.Icon(icon_t, color=icon_c, size=20)), title=ft.Text(f"{item['type']} - {item['action']}", weight=ft.FontWeight.W_600, color=TEXT_MAIN), subtitle=ft.Text(f"Quantity: {item['quantity']:g}", color=TEXT_SUB), trailing=ft.Text(dt_obj.strftime("%d %b %Y, %I:%M %p"), size=12, color=TEXT_SUB))))
+            self.list_container.controls.extend([date_row, loading_placeholder("Loading archive...")])
+            key, sub, _ = self.get_current_tab(); lo, hi = day_bounds(self.history_start_date, self.history_end_date); expanded = set(self.expanded_history_groups)
+            self.history_query.submit(lambda is_stale: self.build_history(key, sub, lo, hi, expanded, is_stale), self.show_history)
         else:
-            grouped_products = set(tab_data["stock"].keys())
-            for item in tab_data["active"]: grouped_products.add(item["type"])
+            grouped_products = list(dict.fromkeys(list(tab_data["stock"].keys()) + [item["type"] for item in tab_data["active"]]))
             if not grouped_products:
                 self.list_container.controls.append(ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("Inventory is empty. Import stock to begin.", color=TEXT_SUB, size=15)))
-                if self.page: self.update(); return
+                if self.page: mark_dirty(self); return
 
+            # reconcile against the controls built on previous renders: groups are keyed by product, cards by batch id + revision
+            cache_key = self.get_current_tab()[:2]
+            if self.cache_key != cache_key: self.card_cache.clear(); self.group_tiles.clear(); self.cache_key = cache_key
+            live_ids = set()
             for ptype in grouped_products:
-                curr_stock = tab_data["stock"].get(ptype, 0); p_items = [b for b in tab_data["active"] if b["type"] == ptype]; batch_row = ft.ResponsiveRow(columns=12, spacing=15, run_spacing=15)
-                for item in p_items: 
-                    name_field = make_input(item["name"], "Batch Tag", None, lambda e, i=item["id"]: self.update_field(i, "name", e.control.value))
-                    qty_field = make_input(f"{item['quantity']:g}", "Qty", 80, lambda e, i=item["id"]: self.update_field(i, "quantity", e.control.value))
-                    max_steps = len(item["steps"]); step_idx = item["step_idx"]; is_processing = item.get("is_processing", False)
-                    
-                    steps_visual = ft.Column(spacing=4, scroll=ft.ScrollMode.AUTO, height=120 if max_steps > 0 else 10)
-                    for idx, s_name in enumerate(item["steps"]):
-                        step_time_str = ""
-                        if idx < step_idx:
-                            icon, color, font_w = ft.Icons.CHECK_CIRCLE, SUCCESS, ft.FontWeight.W_600
-                            for log in reversed(item["timeline"]):
-                                if log["step"] == f"Completed: {s_name}": 
-                                    dt_obj = parse_date(log['time'])
-                                    step_time_str = f" • {dt_obj.strftime('%d %b %Y, %I:%M %p')}"
-                                    break
-                        elif idx == step_idx and is_processing:
-                            icon, color, font_w = ft.Icons.MOTION_PHOTOS_ON, WARNING, ft.FontWeight.W_700
-                            for log in reversed(item["timeline"]):
-                                if log["step"] == f"Started: {s_name}": 
-                                    dt_obj = parse_date(log['time'])
-                                    step_time_str = f" • {dt_obj.strftime('%d %b %Y, %I:%M %p')}"
-                                    break
-                        elif idx == step_idx and not is_processing: icon, color, font_w = ft.Icons.RADIO_BUTTON_UNCHECKED, PRIMARY, ft.FontWeight.W_600
-                        else: icon, color, font_w = ft.Icons.RADIO_BUTTON_UNCHECKED, "#CBD5E1", ft.FontWeight.W_400
-                            
-                        can_delete = (idx > step_idx) or (idx == step_idx and not is_processing)
-                        del_btn = ft.IconButton(ft.Icons.CLOSE, icon_color="#EF4444", icon_size=12, padding=0, width=16, height=16, on_click=lambda e, i=item["id"], s_i=idx: self.delete_specific_step(i, s_i))
-                        steps_visual.controls.append(ft.Container(padding=ft.padding.only(left=5, right=5, top=4, bottom=4), border_radius=6, bgcolor="#F8FAFC" if (idx == step_idx) else ft.colors.TRANSPARENT, content=ft.Row([ft.Icon(icon, color=color, size=16), ft.Text(f"{s_name}", size=13, color=TEXT_MAIN if color != "#CBD5E1" else TEXT_SUB, weight=font_w, expand=True, max_lines=1, overflow=ft.TextOverflow.ELLIPSIS), ft.Text(step_time_str, size=10, color=TEXT_SUB), del_btn if can_delete else ft.Container(width=16)])))
-
-                    show_move = False
-                    if step_idx >= max_steps: btn_text, btn_color, next_btn_disabled = "Ready to Archive", "#CBD5E1", True 
-                    else: btn_text, btn_color, next_btn_disabled, show_move = (f"Finish Step" if is_processing else f"Start Step"), ("#0D9488" if is_processing else PRIMARY), False, not is_processing 
-
-                    btn_style = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), padding=ft.padding.symmetric(horizontal=12))
-                    add_step_btn = ft.IconButton(ft.Icons.ADD, tooltip="Inject routing step", icon_color=PRIMARY, bgcolor="#EFF6FF", icon_size=16, padding=0, width=28, height=28, on_click=lambda e, i=item["id"]: self.open_custom_step(i))
-                    undo_btn = ft.IconButton(ft.Icons.UNDO, tooltip="Revert Last Action", icon_color=TEXT_SUB, hover_color="#F1F5F9", padding=0, width=32, height=32, on_click=lambda e, i=item["id"]: self.execute_revert(i))
-                    move_btn = ft.IconButton(ft.Icons.DRIVE_FILE_MOVE_OUTLINE, tooltip="Relocate Batch", icon_color=WARNING, bgcolor="#FFFBEB", padding=0, width=32, height=32, on_click=lambda e, i=item["id"]: self.open_move_dialog(i))
-                    next_btn = ft.ElevatedButton(btn_text, disabled=next_btn_disabled, color="#FFFFFF", bgcolor=btn_color, style=btn_style, on_click=lambda e, i=item["id"]: self.open_confirm_step(i))
-                    complete_batch_btn = ft.ElevatedButton("Archive", color="#FFFFFF", bgcolor=SUCCESS, style=btn_style, on_click=lambda e, i=item["id"]: self.open_complete_batch(i))
-
-                    card = ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)), content=ft.Column([ft.Container(padding=15, content=ft.Column([ft.Row([name_field, qty_field]), ft.Divider(height=20, color="#F1F5F9"), steps_visual, ft.Container(height=5), ft.Row([ft.Text("Inject manual step:", size=11, color=TEXT_SUB, weight=ft.FontWeight.W_500), add_step_btn], alignment=ft.MainAxisAlignment.START)])), ft.Container(padding=12, bgcolor="#F8FAFC", border_radius=ft.border_radius.only(bottom_left=12, bottom_right=12), border=ft.border.only(top=ft.border.BorderSide(1, BORDER)), content=ft.Row([complete_batch_btn, ft.Row([undo_btn if (step_idx > 0 or is_processing) else ft.Container(), move_btn if show_move else ft.Container(), next_btn], spacing=5, wrap=True)], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True))], spacing=0))
-                    batch_row.controls.append(ft.Column(col={"xs": 12, "md": 6, "xl": 4}, controls=[card]))
-
-                should_expand = (ptype in self.expanded_active_groups) or len(grouped_products) == 1 
-                btn_style_send = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), padding=ft.padding.symmetric(horizontal=15))
-                process_btn = ft.ElevatedButton("Extract to Batch", icon=ft.Icons.CALL_SPLIT, color="#FFFFFF", bgcolor=TEXT_MAIN, style=btn_style_send, on_click=lambda e, p=ptype: self.open_process_dialog(p), disabled=(curr_stock <= 0))
-                
-                tile = ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=10, color="#00000005", offset=ft.Offset(0, 2)), content=ft.ExpansionTile(title=ft.Text(f"{ptype}", size=18, weight=ft.FontWeight.W_800, color=TEXT_MAIN), subtitle=ft.Text(f"Available Stock: {curr_stock:g} units | Processing: {len(p_items)} batches", color=PRIMARY if curr_stock > 0 else TEXT_SUB, weight=ft.FontWeight.W_500), leading=ft.Container(padding=10, bgcolor="#EFF6FF", border_radius=8, content=ft.Icon(ft.Icons.CATEGORY_OUTLINED, color=PRIMARY, size=24)), initially_expanded=should_expand, on_change=lambda e, p=ptype: self.toggle_group(e, p, True), controls_padding=0, trailing=process_btn, controls=[ft.Divider(height=1, color=BORDER), ft.Container(padding=20, bgcolor="#F8FAFC", content=batch_row if p_items else ft.Text("No active operations. Extract stock to begin.", color=TEXT_SUB))]))
-                self.list_container.controls.append(tile)
-
-        if self.page: self.update()
\ No newline at end of file
+                curr_stock = tab_data["stock"].get(ptype, 0); p_items = [b for b in tab_data["active"] if b["type"] == ptype]
+                group = self.group_tiles.get(ptype)
+                if group is None: group = self.group_tiles[ptype] = self.build_group(ptype, (ptype in self.expanded_active_groups) or len(grouped_products) == 1)
+                group["subtitle"].value = f"Available Stock: {curr_stock:g} units | Processing: {len(p_items)} batches"; group["subtitle"].color = PRIMARY if curr_stock > 0 else TEXT_SUB
+                group["process_btn"].disabled = curr_stock <= 0
+                group["batch_row"].controls = [self.get_card(item) for item in p_items]
+                group["body"].content = group["batch_row"] if p_items else group["empty_text"]
+                live_ids.update(item["id"] for item in p_items)
+                self.list_container.controls.append(group["tile"])
+            for item_id in [i for i in self.card_cache if i not in live_ids]: del self.card_cache[item_id]
+            for ptype in [p for p in self.group_tiles if p not in grouped_products]: del self.group_tiles[ptype]
+
+        if self.page: mark_dirty(self)
+
+    def show_history(self, controls):
+        if isinstance(controls, QueryError): controls = [ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text(f"Could not load the archive: {controls}", color="#EF4444", size=15))]
+        self.list_container.controls[1:] = controls; mark_dirty(self)
+
+    @timed("history_query")
+    def build_history(self, key, sub, lo, hi, expanded, is_stale):
+        # runs off the UI thread: the consolidated archive query and its cards, given up once a newer filter is submitted
+        with self.db.lock:
+            cold = self.db.reaches_archive(lo) and (key, sub) in self.db.archive_zones
+            if cold: resident = list(self.level3_data[key]["data"][sub]["history"])
+            else: batches, stock_logs = self.archive.query(key, sub, lo, hi)
+        if cold:
+            # the range reaches the cold tier: its segments are consolidated with the resident entries for this query only
+            merged = ConsolidatedHistory()
+            for entry in heapq.merge((entry for k, s, entry in self.db.archived(key, sub, lo, hi)), resident, key=lambda entry: entry["seq"]): merged.add(key, sub, entry)
+            batches, stock_logs = merged.query(key, sub, lo, hi)
+        if not batches and not stock_logs: return [ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("No history matching this date range.", color=TEXT_SUB, size=15))]
+        controls = []
+        for b_data in batches:
+            if is_stale(): return None
+            b_name = b_data["name"]
+            should_expand = b_data["type"] in expanded
+            logs_ui = []
+            for log in b_data["timeline"]:
+                time_formatted = fmt_ts(log['time'])
+                logs_ui.append(ft.Row([ft.Icon(ft.Icons.CIRCLE, size=6, color="#94A3B8"), ft.Text(f"{log['step']}", size=13, color=TEXT_MAIN, expand=True), ft.Text(time_formatted, size=11, color=TEXT_SUB)]))
+            
+            controls.append(ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=8, color="#00000005", offset=ft.Offset(0, 2)), content=ft.ExpansionTile(title=ft.Text(f"{b_data['type']} - {b_name}", weight=ft.FontWeight.W_700, color=TEXT_MAIN), subtitle=ft.Text(f"Archived Qty: {b_data['quantity']:g} | Last update: {fmt_ts(b_data['timeline'][-1]['time'])}", size=12, color=TEXT_SUB), leading=ft.Container(padding=8, bgcolor="#F0FDF4", border_radius=8, content=ft.Icon(ft.Icons.ARCHIVE_OUTLINED, color=SUCCESS, size=20)), initially_expanded=should_expand, on_change=lambda e, n=b_data["type"]: self.toggle_group(e, n, False), controls_padding=0, controls=[ft.Divider(height=1, color=BORDER), ft.Container(padding=ft.padding.symmetric(horizontal=20, vertical=15), bgcolor="#F8FAFC", content=ft.Column(logs_ui, spacing=6))])))
+
+        for item in reversed(stock_logs): 
+            is_added = "Added" in item["action"]
+            bg_c = "#EFF6FF" if is_added else "#FFF7ED"
+            icon_c = PRIMARY if is_added else WARNING
+            icon_t = ft.Icons.ADD_SHOPPING_CART if is_added else ft.Icons.PLAY_ARROW
+
+            controls.append(ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), padding=ft.padding.symmetric(vertical=5), content=ft.ListTile(leading=ft.Container(padding=8, bgcolor=bg_c, border_radius=8, content=ft.Icon(icon_t, color=icon_c, size=20)), title=ft.Text(f"{item['type']} - {item['action']}", weight=ft.FontWeight.W_600, color=TEXT_MAIN), subtitle=ft.Text(f"Quantity: {item['quantity']:g}", color=TEXT_SUB), trailing=ft.Text(fmt_ts(item['date']), size=12, color=TEXT_SUB))))
+        return controls
+
+    def get_card(self, item):
+        cached = self.card_cache.get(item["id"])
+        if cached and cached[0] == item.get("rev"): return cached[1]
+        card = self.build_card(item); self.card_cache[item["id"]] = (item.get("rev"), card)
+        return card
+
+    def refresh_item(self, item_id):
+        # rebuild and push only the card of one batch; anything structural falls back to a full (reconciled) render
+        item = self.get_item_by_id(item_id); cached = self.card_cache.get(item_id)
+        group = self.group_tiles.get(item["type"]) if item else None
+        if not (item and cached and group and self.view_mode_tabs.selected_index == 0 and cached[1] in group["batch_row"].controls): self.render(); return
+        row = group["batch_row"]; row.controls[row.controls.index(cached[1])] = self.get_card(item)
+        mark_dirty(row if row.page else self)
+        self.db.save()
+
+    def build_group(self, ptype, should_expand):
+        btn_style_send = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), padding=ft.padding.symmetric(horizontal=15))
+        process_btn = ft.ElevatedButton("Extract to Batch", icon=ft.Icons.CALL_SPLIT, color="#FFFFFF", bgcolor=TEXT_MAIN, style=btn_style_send, on_click=lambda e, p=ptype: self.open_process_dialog(p))
+        subtitle = ft.Text("", weight=ft.FontWeight.W_500)
+        batch_row = ft.ResponsiveRow(columns=12, spacing=15, run_spacing=15)
+        body = ft.Container(padding=20, bgcolor="#F8FAFC")
+        tile = ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=10, color="#00000005", offset=ft.Offset(0, 2)), content=ft.ExpansionTile(title=ft.Text(f"{ptype}", size=18, weight=ft.FontWeight.W_800, color=TEXT_MAIN), subtitle=subtitle, leading=ft.Container(padding=10, bgcolor="#EFF6FF", border_radius=8, content=ft.Icon(ft.Icons.CATEGORY_OUTLINED, color=PRIMARY, size=24)), initially_expanded=should_expand, on_change=lambda e, p=ptype: self.toggle_group(e, p, True), controls_padding=0, trailing=process_btn, controls=[ft.Divider(height=1, color=BORDER), body]))
+        return {"tile": tile, "subtitle": subtitle, "process_btn": process_btn, "batch_row": batch_row, "body": body, "empty_text": ft.Text("No active operations. Extract stock to begin.", color=TEXT_SUB)}
+
+    def build_card(self, item):
+        rev = item.get("rev", 0)  # every action from this card is checked against the revision it shows
+        name_field = make_input(item["name"], "Batch Tag", None, lambda e, i=item["id"]: self.update_field(i, "name", e.control.value, rev))
+        qty_field = make_input(f"{item['quantity']:g}", "Qty", 80, lambda e, i=item["id"]: self.update_field(i, "quantity", e.control.value, rev))
+        max_steps = len(item["steps"]); step_idx = item["step_idx"]; is_processing = item.get("is_processing", False)
+
+        steps_visual = ft.Column(spacing=4, scroll=ft.ScrollMode.AUTO, height=120 if max_steps > 0 else 10)
+        for idx, (s_name, (started, completed)) in enumerate(zip(item["steps"], item["step_times"])):
+            step_time_str = ""
+            if idx < step_idx:
+                icon, color, font_w = ft.Icons.CHECK_CIRCLE, SUCCESS, ft.FontWeight.W_600
+                if completed: step_time_str = f" • {fmt_ts(completed)}"
+            elif idx == step_idx and is_processing:
+                icon, color, font_w = ft.Icons.MOTION_PHOTOS_ON, WARNING, ft.FontWeight.W_700
+                if started: step_time_str = f" • {fmt_ts(started)}"
+            elif idx == step_idx and not is_processing: icon, color, font_w = ft.Icons.RADIO_BUTTON_UNCHECKED, PRIMARY, ft.FontWeight.W_600
+            else: icon, color, font_w = ft.Icons.RADIO_BUTTON_UNCHECKED, "#CBD5E1", ft.FontWeight.W_400
+
+            can_delete = (idx > step_idx) or (idx == step_idx and not is_processing)
+            del_btn = ft.IconButton(ft.Icons.CLOSE, icon_color="#EF4444", icon_size=12, padding=0, width=16, height=16, on_click=lambda e, i=item["id"], s_i=idx: self.delete_specific_step(i, s_i, rev))
+            steps_visual.controls.append(ft.Container(padding=ft.padding.only(left=5, right=5, top=4, bottom=4), border_radius=6, bgcolor="#F8FAFC" if (idx == step_idx) else ft.colors.TRANSPARENT, content=ft.Row([ft.Icon(icon, color=color, size=16), ft.Text(f"{s_name}", size=13, color=TEXT_MAIN if color != "#CBD5E1" else TEXT_SUB, weight=font_w, expand=True, max_lines=1, overflow=ft.TextOverflow.ELLIPSIS), ft.Text(step_time_str, size=10, color=TEXT_SUB), del_btn if can_delete else ft.Container(width=16)])))
+
+        show_move = False
+        if step_idx >= max_steps: btn_text, btn_color, next_btn_disabled = "Ready to Archive", "#CBD5E1", True 
+        else: btn_text, btn_color, next_btn_disabled, show_move = (f"Finish Step" if is_processing else f"Start Step"), ("#0D9488" if is_processing else PRIMARY), False, not is_processing 
+
+        btn_style = ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8), padding=ft.padding.symmetric(horizontal=12))
+        add_step_btn = ft.IconButton(ft.Icons.ADD, tooltip="Inject routing step", icon_color=PRIMARY, bgcolor="#EFF6FF", icon_size=16, padding=0, width=28, height=28, on_click=lambda e, i=item["id"]: self.open_custom_step(i, rev))
+        undo_btn = ft.IconButton(ft.Icons.UNDO, tooltip="Revert Last Action", icon_color=TEXT_SUB, hover_color="#F1F5F9", padding=0, width=32, height=32, on_click=lambda e, i=item["id"]: self.execute_revert(i, rev))
+        move_btn = ft.IconButton(ft.Icons.DRIVE_FILE_MOVE_OUTLINE, tooltip="Relocate Batch", icon_color=WARNING, bgcolor="#FFFBEB", padding=0, width=32, height=32, on_click=lambda e, i=item["id"]: self.open_move_dialog(i, rev))
+        next_btn = ft.ElevatedButton(btn_text, disabled=next_btn_disabled, color="#FFFFFF", bgcolor=btn_color, style=btn_style, on_click=lambda e, i=item["id"]: self.open_confirm_step(i, rev))
+        complete_batch_btn = ft.ElevatedButton("Archive", color="#FFFFFF", bgcolor=SUCCESS, style=btn_style, on_click=lambda e, i=item["id"]: self.open_complete_batch(i, rev))
+
+        card = ft.Container(bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, BORDER), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)), content=ft.Column([ft.Container(padding=15, content=ft.Column([ft.Row([name_field, qty_field]), ft.Divider(height=20, color="#F1F5F9"), steps_visual, ft.Container(height=5), ft.Row([ft.Text("Inject manual step:", size=11, color=TEXT_SUB, weight=ft.FontWeight.W_500), add_step_btn], alignment=ft.MainAxisAlignment.START)])), ft.Container(padding=12, bgcolor="#F8FAFC", border_radius=ft.border_radius.only(bottom_left=12, bottom_right=12), border=ft.border.only(top=ft.border.BorderSide(1, BORDER)), content=ft.Row([complete_batch_btn, ft.Row([undo_btn if (step_idx > 0 or is_processing) else ft.Container(), move_btn if show_move else ft.Container(), next_btn], spacing=5, wrap=True)], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True))], spacing=0))
+        return ft.Column(col={"xs": 12, "md": 6, "xl": 4}, controls=[card])
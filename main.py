@@ -4,17 +4,21 @@ import traceback
 # --- SAFE IMPORTS ---
 INIT_ERROR = None
 try:
-    from datetime import datetime
     from sidebar import Sidebar
     from top_bar import FactoryHeader
     from settings_view import SettingsView
-    from location_view import LocationView, parse_date
+    from location_view import LocationView
+    from dashboard_view import DashboardView
+    from search_view import SearchDialog
+    from store import get_store
+    from scheduler import get_scheduler
+    from perf import timed
+    from perf_view import PerfOverlay
 except Exception as e:
     INIT_ERROR = traceback.format_exc()
 
 def main(page: ft.Page):
     BG_COLOR = "#F8FAFC"
-    CARD_BG = "#FFFFFF"
     TEXT_MAIN = "#0F172A"
     TEXT_SUB = "#64748B"
     PRIMARY = "#2563EB"
@@ -35,17 +39,21 @@ def main(page: ft.Page):
         return
 
     try:
-        # --- TEMPORARY RAM STORAGE ONLY ---
-        products_config = {}
-        factories = []
-        factory_sub_locations = {}
-        level3_data = {}
+        # --- PROCESS-WIDE STORE: every session works on the same plant state (SQLite journal + snapshots) and indexes ---
+        store = get_store()
+        db, journal = store.db, store.journal
+        products_config, factories, factory_sub_locations, level3_data = store.products_config, store.factories, store.factory_sub_locations, store.level3_data
+
+        # --- UPDATE SCHEDULER: handlers only mark what changed, one page update is sent when the handler returns ---
+        sched = get_scheduler(page)
+        session = page.session_id
+        sched.origin = lambda: store.acting_for(session)   # store changes made by this session's handlers are announced as its own
         
         active_factory_index = 0
         current_nav_index = 0
+        seen_version = 0    # store version of the last announcement this session handled
 
-        def save_db():
-            pass
+        def save_config(): store.save_config()
 
         def show_snack(msg, is_error=False):
             page.open(ft.SnackBar(content=ft.Text(msg, color="#FFFFFF", weight=ft.FontWeight.W_500), bgcolor="#EF4444" if is_error else "#10B981", behavior=ft.SnackBarBehavior.FLOATING, margin=20, shape=ft.RoundedRectangleBorder(radius=8)))
@@ -57,6 +65,7 @@ def main(page: ft.Page):
 
         def close_dialog(e=None): page.close(main_dialog)
 
+        @sched.handler
         def process_dialog(e):
             val = text_input.value.strip()
             if not val: show_snack("Name cannot be empty!", True); return
@@ -78,62 +87,53 @@ def main(page: ft.Page):
                 if val != old_val and val in factory_sub_locations[current_factory]: show_snack("Name already exists!", True); return
                 factory_sub_locations[current_factory][target_edit_index] = val; show_snack("Location updated!")
 
-            close_dialog(); save_db(); refresh_ui()
+            close_dialog(); save_config(); refresh_ui()
 
         main_dialog = ft.AlertDialog(shape=ft.RoundedRectangleBorder(radius=12), title=ft.Text("", weight=ft.FontWeight.BOLD, color=TEXT_MAIN), content=text_input, actions=[ft.TextButton("Cancel", on_click=close_dialog, style=ft.ButtonStyle(color=TEXT_SUB)), ft.ElevatedButton("Save", on_click=process_dialog, bgcolor=PRIMARY, color="#FFFFFF", style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8)))])
         def open_dialog(mode, title, default_val=""): nonlocal dialog_mode; dialog_mode = mode; main_dialog.title.value = title; text_input.value = default_val; page.open(main_dialog)
 
+        @sched.handler
         def delete_active_factory(e):
             nonlocal active_factory_index, current_nav_index
             factory_to_delete = factories[active_factory_index]
             factories.pop(active_factory_index); del factory_sub_locations[factory_to_delete]
             active_factory_index = 0; current_nav_index = 0
-            show_snack("Factory deleted!"); save_db(); refresh_ui()
+            show_snack("Factory deleted!"); save_config(); refresh_ui()
 
         def edit_sidebar_loc(index): nonlocal target_edit_index; target_edit_index = index - 2; open_dialog("edit_loc", "Edit Location", factory_sub_locations[factories[active_factory_index]][target_edit_index])
+        @sched.handler
         def delete_sidebar_loc(index):
             nonlocal current_nav_index; sub_loc_index = index - 2; factory_sub_locations[factories[active_factory_index]].pop(sub_loc_index)
             if current_nav_index == index: current_nav_index = 0 
-            show_snack("Location deleted!"); save_db(); refresh_ui()
+            show_snack("Location deleted!"); save_config(); refresh_ui()
 
         def get_current_l3_context(): return factories[active_factory_index], factory_sub_locations[factories[active_factory_index]][current_nav_index - 2]
         
-        location_view = LocationView(page, products_config, get_current_l3_context, factories, factory_sub_locations, level3_data, save_db)
+        location_view = LocationView(page, products_config, get_current_l3_context, factories, factory_sub_locations, level3_data, store.service, store.archive)
         
         if hasattr(location_view, 'overlay_controls'):
             for ctrl in location_view.overlay_controls:
                 page.overlay.append(ctrl)
 
-        settings_view = SettingsView(page, products_config, save_db)
+        settings_view = SettingsView(page, products_config, save_config)
 
-        dash_title = ft.Text("Global Overview", size=24, weight=ft.FontWeight.W_800, color=TEXT_MAIN)
-        dash_start_date = datetime.now()
-        dash_end_date = datetime.now()
-        dash_list = ft.ListView(expand=True, spacing=15, padding=ft.padding.only(bottom=40))
-        
-        def on_dash_start_change(e): nonlocal dash_start_date; dash_start_date = dash_start_picker.value; refresh_ui()
-        def on_dash_end_change(e): nonlocal dash_end_date; dash_end_date = dash_end_picker.value; refresh_ui()
-        def clear_dash_dates(e): nonlocal dash_start_date, dash_end_date; dash_start_date = None; dash_end_date = None; refresh_ui()
-            
-        dash_start_picker = ft.DatePicker(on_change=on_dash_start_change)
-        dash_end_picker = ft.DatePicker(on_change=on_dash_end_change)
-        
-        page.overlay.append(dash_start_picker)
-        page.overlay.append(dash_end_picker)
-
-        dashboard_overview = ft.Container(padding=ft.padding.all(15), visible=True, expand=True, content=ft.Column(expand=True, controls=[
-            ft.Row([dash_title], alignment=ft.MainAxisAlignment.SPACE_BETWEEN), ft.Container(height=5),
-            ft.Container(padding=15, bgcolor=CARD_BG, border_radius=12, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=15, color="#0000000A", offset=ft.Offset(0, 4)), content=ft.Row([
-                ft.Row([ft.Icon(ft.Icons.FILTER_ALT, color=TEXT_SUB, size=20), ft.Text("Activity Date Filter:", color=TEXT_SUB, weight=ft.FontWeight.W_500)]),
-                ft.Row([
-                    ft.ElevatedButton(f"Start: {dash_start_date.strftime('%d %b %Y') if dash_start_date else 'Any'}", on_click=lambda _: dash_start_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
-                    ft.ElevatedButton(f"End: {dash_end_date.strftime('%d %b %Y') if dash_end_date else 'Any'}", on_click=lambda _: dash_end_picker.pick_date(), icon=ft.Icons.CALENDAR_TODAY, color=TEXT_MAIN, bgcolor="#F1F5F9", elevation=0, style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8))),
-                    ft.IconButton(ft.Icons.CLOSE, on_click=clear_dash_dates, tooltip="Clear Dates", icon_color="#EF4444", bgcolor="#FEF2F2")
-                ], wrap=True) 
-            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN, wrap=True)), 
-            ft.Container(height=10), dash_list
-        ]))
+        dashboard_overview = DashboardView(page, journal, store.activity, store.kpis)
+        for ctrl in dashboard_overview.overlay_controls:
+            page.overlay.append(ctrl)
+
+        @sched.handler
+        def open_search_result(item, key, sub, status):
+            nonlocal active_factory_index, current_nav_index
+            fac, loc = key.split("::")
+            if fac not in factories or loc not in factory_sub_locations[fac]: show_snack(f"'{fac} → {loc}' is no longer in the sidebar!", True); return
+            active_factory_index = factories.index(fac); current_nav_index = factory_sub_locations[fac].index(loc) + 2
+            location_view.select_tab(key, sub)
+            location_view.focus_item(item, status)
+            refresh_ui()
 
+        search_dialog = SearchDialog(page, journal, store.search, open_search_result)
+
+        @sched.handler
         def toggle_sidebar(show: bool):
             if show:
                 sidebar.left = 0
@@ -141,14 +141,16 @@ def main(page: ft.Page):
             else:
                 sidebar.left = -280
                 sidebar_overlay.visible = False
-            page.update()
+            sched.mark(page)
 
+        @sched.handler
         def on_top_tab_change(index): 
             nonlocal active_factory_index, current_nav_index
             active_factory_index = index; current_nav_index = 0
             settings_view.expanded_products.clear(); location_view.expanded_active_groups.clear(); location_view.expanded_history_groups.clear()
             refresh_ui()
 
+        @sched.handler
         def on_nav_change(index):
             nonlocal current_nav_index
             if not factories: show_snack("Add a factory first!", True); return
@@ -157,7 +159,7 @@ def main(page: ft.Page):
             if page.width and page.width < 768: toggle_sidebar(False)
             refresh_ui()
 
-        header = FactoryHeader(on_tab_change=on_top_tab_change, on_add_click=lambda e: open_dialog("add_factory", "Add New Factory"), on_edit_click=lambda e: open_dialog("edit_factory", "Edit Factory", factories[active_factory_index]), on_delete_click=delete_active_factory, on_menu_click=lambda e: toggle_sidebar(True))
+        header = FactoryHeader(on_tab_change=on_top_tab_change, on_add_click=lambda e: open_dialog("add_factory", "Add New Factory"), on_edit_click=lambda e: open_dialog("edit_factory", "Edit Factory", factories[active_factory_index]), on_delete_click=delete_active_factory, on_menu_click=lambda e: toggle_sidebar(True), on_search_click=search_dialog.open)
         sidebar = Sidebar(on_nav_change=on_nav_change, on_add_click=lambda: open_dialog("add_loc", "Add Sidebar Location") if factories else show_snack("Add a factory first!", True), on_edit_click=edit_sidebar_loc, on_delete_click=delete_sidebar_loc)
         
         sidebar.left = 0
@@ -171,8 +173,12 @@ def main(page: ft.Page):
         )
 
         sidebar_overlay = ft.Container(bgcolor="#80000000", expand=True, visible=False, on_click=lambda e: toggle_sidebar(False))
-        root_stack = ft.Stack(controls=[content_area, sidebar_overlay, sidebar], expand=True)
+        # --- PERF OVERLAY: span latencies and per-interaction counters, toggled with Ctrl+Shift+P ---
+        perf_overlay = PerfOverlay(page)
+        page.on_keyboard_event = lambda e: perf_overlay.toggle() if e.ctrl and e.shift and e.key.upper() == "P" else None
+        root_stack = ft.Stack(controls=[content_area, sidebar_overlay, sidebar, perf_overlay], expand=True)
 
+        @sched.handler
         def page_resize(e):
             pw = page.width
             if pw is None: pw = 400 
@@ -185,73 +191,48 @@ def main(page: ft.Page):
                 header.set_menu_visible(False)
                 sidebar.left = 0
                 sidebar_overlay.visible = False
-            page.update()
+            sched.mark(page)
 
         page.on_resized = page_resize
+        def on_disconnect(e): perf_overlay.detach(); db.flush()
+        page.on_disconnect = on_disconnect
 
-        def populate_dashboard():
-            dash_list.controls.clear()
-            dashboard_items = []
-            for key, loc_data in location_view.level3_data.items():
-                fac, loc = key.split("::")
-                for sub_name, tab_data in loc_data["data"].items():
-                    for status_type, item_list in [("active", tab_data.get("active", [])), ("completed", tab_data.get("history", []))]:
-                        for item in item_list:
-                            if status_type == "completed" and item.get("entry_type") != "Batch": continue
-                            valid_logs = []
-                            for log in item["timeline"]:
-                                log_time = parse_date(log["time"])
-                                if dash_start_date and log_time.date() < dash_start_date.date(): continue
-                                if dash_end_date and log_time.date() > dash_end_date.date(): continue
-                                valid_logs.append(log)
-                            if not valid_logs: continue 
-                            valid_logs.reverse()
-                            latest_time = parse_date(valid_logs[0]["time"])
-                            dashboard_items.append({"item": item, "fac": fac, "loc": loc, "sub_name": sub_name, "status_type": status_type, "valid_logs": valid_logs, "latest_time": latest_time})
-            dashboard_items.sort(key=lambda x: x["latest_time"], reverse=True)
-            if not dashboard_items:
-                dash_list.controls.append(ft.Container(padding=40, alignment=ft.alignment.center, content=ft.Text("No active or completed processes found in this date range.", color=TEXT_SUB, size=16)))
-                return
-            for d_item in dashboard_items:
-                item = d_item["item"]; status_type = d_item["status_type"]; valid_logs = d_item["valid_logs"]
-                loc_label = "Current" if status_type == "active" else "Final"
-                timeline_controls = []
-                for i, log in enumerate(valid_logs):
-                    color = TEXT_MAIN if i == 0 else TEXT_SUB; weight = ft.FontWeight.W_500 if i == 0 else ft.FontWeight.NORMAL
-                    dt_obj = parse_date(log['time'])
-                    time_formatted = dt_obj.strftime("%d %b %Y, %I:%M %p")
-                    timeline_controls.append(ft.Row([ft.Icon(ft.Icons.CIRCLE, size=8, color="#CBD5E1"), ft.Text(f"{log['step']}", size=13, color=color, weight=weight, expand=True), ft.Text(time_formatted, size=11, color="#94A3B8")]))
-                subtitle_col = ft.Column([ft.Container(height=5), ft.Row([ft.Icon(ft.Icons.LOCATION_ON, size=14, color="#94A3B8"), ft.Text(f"{loc_label}: {d_item['fac']} → {d_item['loc']} → {d_item['sub_name']}", size=13, color=TEXT_SUB, weight=ft.FontWeight.W_500, expand=True)]), ft.Container(padding=ft.padding.only(left=5, top=5), content=ft.Column(timeline_controls, spacing=4))], spacing=0)
-
-                if status_type == "active":
-                    icon_color = PRIMARY; title_text = f"{item['type']} - {item['name']}"; step_val = f"Step {item['step_idx']}/{len(item['steps'])}"
-                    chip_bg = "#FEF3C7" if item.get("is_processing") else "#DBEAFE"; chip_color = "#D97706" if item.get("is_processing") else PRIMARY; chip_text = "In Process" if item.get("is_processing") else "Pending"
-                else:
-                    icon_color = "#10B981"; title_text = f"{item['type']} - {item['name']}"; step_val = "100%"; chip_bg = "#D1FAE5"; chip_color = "#059669"; chip_text = "Completed"
-
-                status_chip = ft.Container(padding=ft.padding.symmetric(horizontal=10, vertical=4), bgcolor=chip_bg, border_radius=16, content=ft.Text(chip_text, size=11, color=chip_color, weight=ft.FontWeight.BOLD))
-                dash_card = ft.Container(bgcolor=CARD_BG, border_radius=12, padding=15, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)), content=ft.Row([
-                    ft.Container(padding=12, bgcolor="#F8FAFC", border_radius=12, content=ft.Icon(ft.Icons.INVENTORY_2_OUTLINED, color=icon_color, size=24)),
-                    ft.Column([ft.Row([ft.Text(title_text, size=15, weight=ft.FontWeight.BOLD, color=TEXT_MAIN, expand=True), status_chip], spacing=5), subtitle_col], expand=True),
-                ], vertical_alignment=ft.CrossAxisAlignment.START))
-                dash_list.controls.append(dash_card)
-
+        @timed("refresh_ui")
         def refresh_ui():
+            nonlocal active_factory_index, current_nav_index
             if not factories:
-                header.update_tabs([], 0); sidebar.update_locations([], 0); dashboard_overview.visible = True; settings_view.visible = False; location_view.visible = False; page.update(); return
+                header.update_tabs([], 0); sidebar.update_locations([], 0); dashboard_overview.visible = True; settings_view.visible = False; location_view.visible = False; sched.mark(page); return
 
+            if active_factory_index >= len(factories): active_factory_index = 0; current_nav_index = 0  # removed from another session
             current_factory = factories[active_factory_index]
+            if current_nav_index >= len(factory_sub_locations[current_factory]) + 2: current_nav_index = 0
             header.update_tabs(factories, active_factory_index); sidebar.update_locations(factory_sub_locations[current_factory], current_nav_index)
             dashboard_overview.visible = False; settings_view.visible = False; location_view.visible = False
 
-            if current_nav_index == 0: populate_dashboard(); dashboard_overview.visible = True
+            if current_nav_index == 0: dashboard_overview.populate(); dashboard_overview.visible = True
             elif current_nav_index == 1: settings_view.visible = True
             else: location_view.update_context(); location_view.visible = True
-            page.update()
-
+            sched.mark(page)
+
+        # --- CHANGES FROM OTHER SESSIONS: re-render only when this session shows an affected location ---
+        # its own changes were rendered by the view that made them; the dashboard re-queries at a throttled rate
+        @sched.handler
+        def on_plant_change(topic, message):
+            nonlocal seen_version
+            if message["version"] <= seen_version: return
+            seen_version = message["version"]
+            if message["origins"] == {session}: return
+            if message["config"]: settings_view.render_products(); refresh_ui()
+            elif not factories: return
+            elif current_nav_index == 0: dashboard_overview.refresh_soon()
+            elif current_nav_index >= 2 and "::".join(get_current_l3_context()) in message["locations"]: refresh_ui()
+
+        store.connect(page, on_plant_change)
         page.add(root_stack)
-        page_resize(None) 
-        refresh_ui()
+        with sched.frame():
+            page_resize(None) 
+            settings_view.render_products()
+            refresh_ui()
 
     except Exception as e:
         error_msg = traceback.format_exc()
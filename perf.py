@@ -0,0 +1,112 @@
+import os
+import csv
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import flet as ft
+
+WINDOW = 500        # latest samples kept per span (and interactions kept) for the percentiles and exports
+SLOW_MS = 250       # interactions slower than this are logged as warnings
+
+log = logging.getLogger("erp.perf")
+
+def percentile(values, q):
+    if not values: return 0.0
+    values = sorted(values); return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# --- HOT-PATH PROFILER ---
+# Spans time handlers and render paths; the outermost span of a user event is an interaction, which also counts
+# the page updates sent, the controls they carried and the controls constructed. Disabled a span is a single flag
+# check: profiling runs while a listener (a shown perf overlay) is attached, or always with ERP_PERF=1.
+class Profiler:
+    def __init__(self, always_on=False):
+        self.always_on = always_on
+        self.enabled = False
+        self.samples = {}       # span name -> deque of ms
+        self.interactions = deque(maxlen=WINDOW)
+        self.local = threading.local()  # per thread: span nesting depth and counters of the interaction in progress
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.control_init = None
+
+    def enable(self):
+        if self.enabled: return
+        self.enabled = True
+        init = self.control_init = ft.Control.__init__
+        def counting_init(control, *args, **kwargs): self.count("controls_created"); init(control, *args, **kwargs)
+        ft.Control.__init__ = counting_init
+
+    def disable(self):
+        if not self.enabled: return
+        self.enabled = False; ft.Control.__init__ = self.control_init
+
+    def add_listener(self, listener):
+        with self.lock: self.listeners.append(listener); self.enable()
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners: self.listeners.remove(listener)
+            if not self.listeners and not self.always_on: self.disable()
+
+    def reset(self):
+        with self.lock: self.samples.clear(); self.interactions.clear()
+
+    def count(self, counter, n=1):
+        current = getattr(self.local, "current", None)
+        if current is not None: current[counter] += n
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled: yield; return
+        local = self.local; local.depth = getattr(local, "depth", 0) + 1
+        if local.depth == 1: local.current = {"name": name, "time": time.time(), "ms": 0.0, "updates": 0, "controls_sent": 0, "controls_created": 0}
+        start = time.perf_counter()
+        try: yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            with self.lock: self.samples.setdefault(name, deque(maxlen=WINDOW)).append(ms)
+            local.depth -= 1; finished = None
+            if not local.depth: finished, local.current = local.current, None
+            if finished: self.finish(finished, ms)
+
+    def finish(self, interaction, ms):
+        interaction["ms"] = ms; self.interactions.append(interaction)
+        if ms >= SLOW_MS: log.warning("slow interaction %s: %.1f ms, %d updates, %d controls sent, %d created", interaction["name"], ms, interaction["updates"], interaction["controls_sent"], interaction["controls_created"])
+        with self.lock: listeners = list(self.listeners)
+        for listener in listeners: listener(interaction)
+
+    def timed(self, name=None):
+        def decorate(fn):
+            label = name or fn.__qualname__.replace("<locals>.", "")
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(label): return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # --- REPORTS ---
+    def stats(self):
+        with self.lock: samples = {name: list(values) for name, values in self.samples.items()}
+        return [{"span": name, "count": len(values), "p50_ms": percentile(values, 0.5), "p95_ms": percentile(values, 0.95), "max_ms": max(values)} for name, values in sorted(samples.items())]
+
+    def export(self, path):
+        # .csv writes one row per interaction; anything else writes the span stats and the interactions as JSON
+        with self.lock: interactions = list(self.interactions)
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["time", "name", "ms", "updates", "controls_sent", "controls_created"]); writer.writeheader(); writer.writerows(interactions)
+        else:
+            with open(path, "w") as f: json.dump({"spans": self.stats(), "interactions": interactions}, f, indent=2)
+        return path
+
+
+PERF = Profiler(always_on=os.getenv("ERP_PERF") == "1")
+if PERF.always_on: PERF.enable()
+
+span = PERF.span
+timed = PERF.timed
@@ -0,0 +1,68 @@
+import os
+import flet as ft
+from datetime import datetime
+from perf import PERF
+from scheduler import batched, mark_dirty
+from storage import default_db_path
+
+PANEL_BG = "#F20F172A"
+TEXT_MAIN = "#F8FAFC"
+TEXT_SUB = "#94A3B8"
+PRIMARY = "#60A5FA"
+
+MAX_ROWS = 12       # slowest spans (by p95) listed
+
+class PerfOverlay(ft.Container):
+    def __init__(self, page: ft.Page):
+        super().__init__()
+        self.page = page
+        self.visible = False
+        self.right = 12
+        self.bottom = 12
+        self.width = 440
+        self.padding = 12
+        self.border_radius = 10
+        self.bgcolor = PANEL_BG
+
+        self.last = ft.Text("No interactions recorded yet.", size=11, color=TEXT_SUB)
+        self.table = ft.Column(spacing=2, tight=True)
+        btn_style = ft.ButtonStyle(color=PRIMARY, padding=ft.padding.symmetric(horizontal=6))
+        self.content = ft.Column(tight=True, spacing=8, controls=[
+            ft.Row([ft.Text("Performance", weight=ft.FontWeight.BOLD, color=TEXT_MAIN), ft.Row([
+                ft.TextButton("JSON", on_click=lambda e: self.export("json"), style=btn_style), ft.TextButton("CSV", on_click=lambda e: self.export("csv"), style=btn_style),
+                ft.TextButton("Reset", on_click=self.reset, style=btn_style), ft.IconButton(ft.Icons.CLOSE, icon_size=16, icon_color=TEXT_SUB, on_click=self.toggle, tooltip="Hide (Ctrl+Shift+P)")
+            ], spacing=0)], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+            self.last, self.table
+        ])
+
+    def row(self, cells, color=TEXT_MAIN, weight=None):
+        return ft.Row([ft.Text(cells[0], size=11, color=color, weight=weight, expand=True, no_wrap=True)] + [ft.Text(c, size=11, color=color, weight=weight, width=56, text_align=ft.TextAlign.RIGHT) for c in cells[1:]], spacing=4)
+
+    def refresh(self):
+        stats = sorted(PERF.stats(), key=lambda s: s["p95_ms"], reverse=True)[:MAX_ROWS]
+        self.table.controls = [self.row(["span", "n", "p50 ms", "p95 ms", "max ms"], TEXT_SUB, ft.FontWeight.W_600)] + [self.row([s["span"], str(s["count"]), f"{s['p50_ms']:.1f}", f"{s['p95_ms']:.1f}", f"{s['max_ms']:.1f}"]) for s in stats]
+
+    def on_interaction(self, interaction):
+        if not self.visible: return
+        self.last.value = f"Last: {interaction['name']} {interaction['ms']:.1f} ms · {interaction['updates']} updates · {interaction['controls_sent']} controls sent · {interaction['controls_created']} created"
+        self.refresh(); mark_dirty(self)
+
+    @batched
+    def toggle(self, e=None):
+        # only a shown overlay listens, so hidden (and closed) sessions leave nothing behind on the process-wide profiler
+        self.visible = not self.visible
+        if self.visible: PERF.add_listener(self.on_interaction); self.refresh()
+        else: PERF.remove_listener(self.on_interaction)
+        mark_dirty(self)
+
+    def detach(self): self.visible = False; PERF.remove_listener(self.on_interaction)
+
+    @batched
+    def reset(self, e):
+        PERF.reset(); self.last.value = "No interactions recorded yet."; self.refresh(); mark_dirty(self)
+
+    def export(self, fmt):
+        path = os.path.join(os.path.dirname(default_db_path()), f"perf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}")
+        try: PERF.export(path); msg, is_error = f"Profile saved to {path}", False
+        except OSError as err: msg, is_error = f"Could not save profile: {err}", True
+        self.page.open(ft.SnackBar(content=ft.Text(msg, color="#FFFFFF", weight=ft.FontWeight.W_500), bgcolor="#EF4444" if is_error else "#10B981", behavior=ft.SnackBarBehavior.FLOATING, margin=20, shape=ft.RoundedRectangleBorder(radius=8)))
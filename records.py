@@ -0,0 +1,87 @@
+import sys
+import uuid
+
+_routings = {}
+
+
+def to_id(value):
+    # batch ids are 62-bit ints (they fit a SQLite INTEGER); older data used uuid4 strings, folded the same way
+    if isinstance(value, int): return value
+    return int(value) if value.isdigit() else uuid.UUID(value).int >> 66
+
+def new_id(): return uuid.uuid4().int >> 66
+
+def intern_steps(steps):
+    # batches with the same routing share one tuple of interned step names; edits replace the tuple
+    steps = tuple(sys.intern(s) for s in steps)
+    return _routings.setdefault(steps, steps)
+
+def derive_step_times(steps, timeline):
+    # for records written before step_times existed: the last Started/Completed entry per step name, as cards used to look it up
+    last = {}
+    for log in timeline: last[log["step"]] = log["time"]
+    return [[last.get(f"Started: {s}"), last.get(f"Completed: {s}")] for s in steps]
+
+
+# --- COMPACT RECORDS ---
+# Batches, timeline entries and stock ledger entries are slotted objects. They keep the dict-style access used by
+# the reducers and views (item["name"], item.get("rev"), "seq" in item) and export plain dicts for JSON.
+class Record:
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, field):
+        try: return getattr(self, field)
+        except AttributeError: raise KeyError(field) from None
+
+    def __setitem__(self, field, value): setattr(self, field, value)
+    def __contains__(self, field): return hasattr(self, field)
+    def get(self, field, default=None): return getattr(self, field, default)
+    def items(self): return self.to_dict().items()
+    def to_dict(self): return {f: getattr(self, f) for f in self.FIELDS if hasattr(self, f)}
+
+
+class TimelineEvent(Record):
+    __slots__ = FIELDS = ("step", "time")
+
+    def __init__(self, step, time): self.step = sys.intern(step); self.time = time
+
+
+class Batch(Record):
+    __slots__ = FIELDS = ("id", "type", "name", "quantity", "routing", "steps", "step_times", "step_idx", "is_processing", "timeline", "entry_type", "date_completed", "seq", "rev")
+    OPTIONAL = ("entry_type", "date_completed", "seq", "rev")
+
+    # routing: [product, version] of the template the steps came from (None for batches older than templates)
+    # step_times: [started, completed] epoch seconds per step, kept in line with steps by the reducers
+    def __init__(self, id, type, name, quantity, steps, timeline, step_idx=0, is_processing=False, routing=None, step_times=None):
+        self.id = to_id(id); self.type = sys.intern(type); self.name = name; self.quantity = quantity; self.routing = routing
+        self.steps = intern_steps(steps); self.step_idx = step_idx; self.is_processing = is_processing; self.timeline = timeline
+        self.step_times = step_times if step_times is not None else derive_step_times(self.steps, timeline)
+
+    @classmethod
+    def from_dict(cls, data):
+        timeline = [log if isinstance(log, TimelineEvent) else TimelineEvent(log["step"], log["time"]) for log in data.get("timeline", ())]
+        item = cls(data["id"], data["type"], data["name"], data["quantity"], data.get("steps", ()), timeline, data.get("step_idx", 0), data.get("is_processing", False), data.get("routing"), data.get("step_times"))
+        for field in cls.OPTIONAL:
+            if field in data: setattr(item, field, data[field])
+        return item
+
+    def to_dict(self, timeline=True):
+        data = super().to_dict(); data["steps"] = list(self.steps)
+        if timeline: data["timeline"] = [log.to_dict() for log in self.timeline]
+        else: del data["timeline"]
+        return data
+
+
+class StockEntry(Record):
+    __slots__ = ("type", "action", "quantity", "date", "seq")
+    FIELDS = ("entry_type",) + __slots__
+    entry_type = "Stock"
+
+    def __init__(self, type, action, quantity, date): self.type = sys.intern(type); self.action = sys.intern(action); self.quantity = quantity; self.date = date
+
+    @classmethod
+    def from_dict(cls, data):
+        entry = cls(data["type"], data["action"], data["quantity"], data.get("date", 0))
+        if "seq" in data: entry.seq = data["seq"]
+        return entry
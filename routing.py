@@ -0,0 +1,22 @@
+from records import intern_steps
+
+
+# --- ROUTING TEMPLATES: every product's step list as used by batches, one immutable version per change ---
+# Batches keep a [product, version] reference and only store their own steps once they are edited, so a
+# later change in Settings never alters (or makes ambiguous) the routing a running batch was started with.
+class RoutingTemplates:
+    def __init__(self, versions=None):
+        self.versions = {product: [intern_steps(steps) for steps in history] for product, history in (versions or {}).items()}
+
+    def ref(self, product, steps):
+        # reference to the latest version of the product's routing; publishes `steps` first if they differ from it
+        steps = intern_steps(steps); history = self.versions.setdefault(product, [])
+        published = not history or history[-1] != steps
+        if published: history.append(steps)
+        return [product, len(history) - 1], published
+
+    def steps(self, product, version): return self.versions[product][version]
+
+    def is_template(self, item): return item["routing"] is not None and self.steps(*item["routing"]) == item["steps"]
+
+    def to_dict(self): return {product: [list(steps) for steps in history] for product, history in self.versions.items()}
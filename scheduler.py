@@ -0,0 +1,104 @@
+import logging
+import threading
+import weakref
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from perf import PERF
+
+FRAME_DELAY = 1 / 60    # s; controls marked outside an event handler are sent together on the next frame
+
+log = logging.getLogger("erp.scheduler")
+
+
+# --- UPDATE SCHEDULER: views mark controls dirty and one page.update() per user event (or frame) sends them all ---
+class UpdateScheduler:
+    def __init__(self, page, delay=FRAME_DELAY):
+        self.page = weakref.ref(page)   # weak: the registry is keyed by the page, which must stay collectable after its session closes
+        self.delay = delay
+        self.dirty = []
+        self.depth = 0          # nesting of running handlers; the outermost one flushes
+        self.timer = None
+        self.lock = threading.RLock()
+        self.origin = nullcontext   # entered around handlers and work done for this page; main tags store changes with it
+
+    def mark(self, *controls):
+        with self.lock:
+            for control in controls:
+                if not any(c is control for c in self.dirty): self.dirty.append(control)
+            if self.depth or self.timer: return
+            self.timer = threading.Timer(self.delay, self.flush); self.timer.daemon = True; self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.timer: self.timer.cancel(); self.timer = None
+            controls, self.dirty = self.dirty, []
+        page = self.page()
+        if page is None: return
+        if any(c is page for c in controls): PERF.count("updates"); page.update(); return
+        controls = [c for c in controls if c.uid]  # not mounted yet, they are sent with their parent
+        if controls: PERF.count("updates"); PERF.count("controls_sent", len(controls)); page.update(*controls)
+
+    @contextmanager
+    def frame(self):
+        with self.lock: self.depth += 1
+        try:
+            with self.origin(): yield self
+        finally:
+            with self.lock: self.depth -= 1; outermost = not self.depth
+            if outermost: self.flush()
+
+    def handler(self, fn):
+        name = fn.__qualname__.replace("<locals>.", "")
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with PERF.span(name), self.frame(): return fn(*args, **kwargs)
+        return wrapper
+
+
+# --- LATEST-ONLY BACKGROUND QUERIES ---
+# query(is_stale) runs off the UI thread through page.run_thread and apply(result) runs in an update frame.
+# A newer submit (or cancel) supersedes the query in flight: it can stop early by polling is_stale(), and its
+# result is dropped, so only the latest filter is ever rendered. A query that raises is logged and apply() receives a
+# QueryError instead of its result, so the view can replace its loading placeholder.
+class QueryError:
+    def __init__(self, error): self.error = error
+    def __str__(self): return f"{type(self.error).__name__}: {self.error}"
+
+class LatestQuery:
+    def __init__(self, page):
+        self.page = page
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def cancel(self):
+        with self.lock: self.generation += 1
+
+    def submit(self, query, apply):
+        with self.lock: self.generation += 1; generation = self.generation
+        def is_stale(): return generation != self.generation
+        def run():
+            try: result = query(is_stale)
+            except Exception as err: log.exception("background query failed"); result = QueryError(err)
+            with get_scheduler(self.page).frame(), self.lock:
+                if not is_stale(): apply(result)
+        self.page.run_thread(run)
+
+
+_schedulers = weakref.WeakKeyDictionary()
+
+def get_scheduler(page):
+    if page not in _schedulers: _schedulers[page] = UpdateScheduler(page)
+    return _schedulers[page]
+
+def mark_dirty(*controls):
+    page = controls[0].page
+    if page: get_scheduler(page).mark(*controls)
+
+def batched(fn):
+    # for event handlers on views: everything the handler marks dirty goes out in a single round trip when it returns
+    name = fn.__qualname__
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not self.page: return fn(self, *args, **kwargs)
+        with PERF.span(name), get_scheduler(self.page).frame(): return fn(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,74 @@
+import re
+import heapq
+from bisect import bisect_left, insort
+from functools import lru_cache
+import events
+from indexes import iter_batches
+from records import Batch
+
+MAX_RESULTS = 20
+FILTER_BELOW = 2000     # candidate count under which later query terms are checked per batch
+TOKEN_RE = re.compile(r"\w+")
+
+@lru_cache(maxsize=8192)
+def tokenize(text): return tuple(TOKEN_RE.findall(text.lower()))
+
+
+# --- FULL-TEXT BATCH SEARCH: inverted index token -> batch ids over names, products, "fac > loc > sub" and timeline text ---
+# The vocabulary is kept sorted so a query term matches every token it prefixes. Each batch event re-indexes just
+# that batch (diffing its token set), so typing a query never walks level3_data.
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}      # token -> set of batch ids
+        self.vocabulary = []    # sorted tokens
+        self.docs = {}          # batch id -> frozenset of its tokens
+        self.places = {}        # batch id -> (item, key, sub, status)
+        self.ranks = {}         # batch id -> sort key: active first, then most recently touched
+
+    def rebuild(self, level3_data):
+        self.__init__()
+        for key, sub, status, item in iter_batches(level3_data):
+            self.place(item, key, sub, status); tokens = self.docs[item["id"]] = self.batch_tokens(item, key, sub)
+            for token in tokens: self.postings.setdefault(token, set()).add(item["id"])
+        self.vocabulary = sorted(self.postings)
+
+    def place(self, item, key, sub, status):
+        self.places[item["id"]] = (item, key, sub, status); self.ranks[item["id"]] = (status != "active", -(item["timeline"][-1]["time"] if item["timeline"] else 0))
+
+    def batch_tokens(self, item, key, sub):
+        tokens = set(tokenize(item["name"])); tokens.update(tokenize(item["type"])); tokens.update(tokenize(key)); tokens.update(tokenize(sub))
+        for log in item["timeline"]: tokens.update(tokenize(log["step"]))
+        return frozenset(tokens)
+
+    def reindex(self, item, key, sub, status):
+        item_id = item["id"]; self.place(item, key, sub, status)
+        old = self.docs.get(item_id, frozenset()); new = self.docs[item_id] = self.batch_tokens(item, key, sub)
+        for token in old - new:
+            ids = self.postings[token]; ids.discard(item_id)
+            if not ids: del self.postings[token]; del self.vocabulary[bisect_left(self.vocabulary, token)]
+        for token in new - old:
+            if token not in self.postings: self.postings[token] = set(); insort(self.vocabulary, token)
+            self.postings[token].add(item_id)
+
+    def on_event(self, ev, result):
+        if not isinstance(result, Batch): return
+        if ev["type"] == events.BATCH_MOVED: self.reindex(result, ev["to_key"], ev["to_sub"], "active")
+        elif ev["type"] == events.BATCH_ARCHIVED: self.reindex(result, ev["key"], ev["sub"], "history")
+        else: self.reindex(result, ev["key"], ev["sub"], "active")
+
+    def matching(self, term):
+        start = bisect_left(self.vocabulary, term); end = bisect_left(self.vocabulary, term + "\uffff")
+        if end - start == 1: return self.postings[self.vocabulary[start]]
+        return set().union(*(self.postings[token] for token in self.vocabulary[start:end]))
+
+    def search(self, query, limit=MAX_RESULTS):
+        # (item, key, sub, status) of batches matching every term as a prefix; active first, then most recently touched
+        terms = tokenize(query)
+        if not terms: return []
+        matches = None
+        for term in sorted(set(terms), key=len, reverse=True):   # longer prefixes match less, so intersect them first
+            if matches is not None and len(matches) <= FILTER_BELOW:   # few candidates left: check their own tokens instead of unioning postings
+                matches = {item_id for item_id in matches if any(token.startswith(term) for token in self.docs[item_id])}
+            else: ids = self.matching(term); matches = ids if matches is None else matches & ids
+            if not matches: return []
+        return [self.places[item_id] for item_id in heapq.nsmallest(limit, matches, key=self.ranks.__getitem__)]
@@ -0,0 +1,43 @@
+import flet as ft
+from scheduler import batched, mark_dirty
+
+TEXT_MAIN = "#0F172A"
+TEXT_SUB = "#64748B"
+PRIMARY = "#2563EB"
+SUCCESS = "#10B981"
+
+class SearchDialog:
+    def __init__(self, page: ft.Page, journal, index, on_select):
+        self.page = page
+        self.journal = journal
+        self.index = index
+        self.on_select = on_select
+
+        self.query_input = ft.TextField(hint_text="Batch name, product, location or step...", prefix_icon=ft.Icons.SEARCH, autofocus=True, border_radius=8, border_color="#CBD5E1", focused_border_color=PRIMARY, on_change=self.on_query)
+        self.results = ft.ListView(spacing=4, height=360)
+        self.dialog = ft.AlertDialog(shape=ft.RoundedRectangleBorder(radius=12), title=ft.Text("Find a Batch", weight=ft.FontWeight.BOLD), content=ft.Column([self.query_input, self.results], tight=True, width=520), actions=[ft.TextButton("Close", on_click=lambda e: self.page.close(self.dialog), style=ft.ButtonStyle(color=TEXT_SUB))])
+
+    def hint(self, text): return ft.Container(padding=30, alignment=ft.alignment.center, content=ft.Text(text, color=TEXT_SUB, size=14))
+
+    def open(self, e=None):
+        self.query_input.value = ""; self.results.controls = [self.hint("Type to search. Every word matches as a prefix.")]
+        self.page.open(self.dialog)
+
+    @batched
+    def on_query(self, e):
+        with self.journal.db.lock: found = self.index.search(self.query_input.value)
+        self.results.controls = [self.build_result(*entry) for entry in found] or [self.hint("No batches found." if self.query_input.value.strip() else "Type to search. Every word matches as a prefix.")]
+        mark_dirty(self.results)
+
+    def build_result(self, item, key, sub, status):
+        fac, loc = key.split("::")
+        if status != "active": state = "Archived"
+        elif item["step_idx"] >= len(item["steps"]): state = "Ready to archive"
+        else: state = f"{'In process' if item.get('is_processing') else 'Next'}: {item['steps'][item['step_idx']]}"
+        return ft.ListTile(
+            leading=ft.Icon(ft.Icons.INVENTORY_2_OUTLINED if status == "active" else ft.Icons.ARCHIVE_OUTLINED, color=PRIMARY if status == "active" else SUCCESS),
+            title=ft.Text(f"{item['type']} - {item['name']}", weight=ft.FontWeight.W_600, color=TEXT_MAIN),
+            subtitle=ft.Text(f"{fac} → {loc} → {sub} · {state}", size=12, color=TEXT_SUB), dense=True,
+            on_click=lambda e, entry=(item, key, sub, status): self.select(entry))
+
+    def select(self, entry): self.page.close(self.dialog); self.on_select(*entry)
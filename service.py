@@ -0,0 +1,193 @@
+import csv
+import math
+import events
+from itertools import islice
+from indexes import BatchNameIndex
+from journal import RevisionConflict
+from records import new_id
+from timeutil import now_ts
+
+
+IMPORT_CHUNK = 500          # stock lines committed per transaction during a CSV import
+REJECTED_SAMPLES = 50       # rejected lines (with their reason) kept for the import summary
+EDITABLE_FIELDS = ("name", "quantity")   # batch fields update_batch may change; the rest belong to the reducers
+
+CSV_COLUMNS = {"product": "product", "quantity": "quantity", "qty": "quantity", "factory": "factory", "room": "room", "location": "room", "sub_zone": "sub_zone", "sub-zone": "sub_zone", "subzone": "sub_zone", "zone": "sub_zone"}
+CSV_POSITIONS = {"product": 0, "quantity": 1, "factory": 2, "room": 3, "sub_zone": 4}
+
+
+class ServiceError(ValueError): pass
+class ConflictError(ServiceError): pass
+
+
+def parse_qty(val):
+    # None for anything but a finite number: "nan" and "inf" parse as floats but no stock row can hold them
+    try: qty = float(val)
+    except (ValueError, TypeError): return None
+    return qty if math.isfinite(qty) else None
+
+def new_import_summary(): return {"added": 0, "quantity": 0.0, "rejected": 0, "samples": [], "zones": set()}
+
+def read_stock_csv(f, key, sub):
+    # streams (line_no, key, sub, product, qty) from "product, quantity[, factory, room, sub-zone]" rows; a header row may
+    # name (and reorder) the columns. Rows without a location go to key/sub; a row naming only the factory or only the room
+    # comes through with key None, unparseable quantities as None, and import_stock rejects both.
+    reader = csv.reader(f); columns = None
+    for row in reader:
+        if not any(cell.strip() for cell in row): continue
+        if columns is None:
+            names = [CSV_COLUMNS.get(cell.strip().lower()) for cell in row]
+            columns = {name: pos for pos, name in enumerate(names) if name} if "product" in names else CSV_POSITIONS
+            if columns is not CSV_POSITIONS: continue
+        cells = {name: row[pos].strip() if pos < len(row) else "" for name, pos in columns.items()}
+        fac, room = cells.get("factory"), cells.get("room")
+        yield reader.line_num, f"{fac}::{room}" if fac and room else None if fac or room else key, cells.get("sub_zone") or sub, cells.get("product", ""), parse_qty(cells.get("quantity"))
+
+
+# --- HEADLESS INVENTORY SERVICE ---
+# The shop-floor operations behind LocationView, taking plain arguments: a location key ("Factory::Location"),
+# a sub-zone name and batch ids. A rejected operation raises ServiceError carrying the message the UI shows.
+# Bulk variants run inside one journal transaction and return (done, rejected), rejected being (input, reason) pairs.
+# Batch operations are optimistic: they validate against the batch as read, without locking, and commit with a
+# compare-and-set on its revision. `rev` is the revision the operator was shown; if the batch changed since (or
+# changes between validation and commit) ConflictError is raised instead of overwriting the other change.
+class InventoryService:
+    def __init__(self, journal, products_config):
+        self.journal = journal
+        self.db = journal.db
+        self.products_config = products_config
+        self.names = journal.attach(BatchNameIndex(self.db.archived_names))
+
+    def emit(self, ev_type, key, sub, rev=None, check=None, **fields):
+        try: return self.journal.emit({"type": ev_type, "key": key, "sub": sub, **fields}, rev, check)
+        except RevisionConflict: raise self.conflict(fields["id"]) from None
+
+    def conflict(self, item_id):
+        entry = self.journal.batches.get(item_id)
+        return ConflictError(f"Batch '{entry[0]['name'] if entry else item_id}' was just changed by another operator. Check it and try again.")
+
+    def sub_zone(self, key, sub):
+        try: return events.get_sub_zone(self.journal.level3_data, key, sub)
+        except KeyError: raise ServiceError(f"Unknown sub-zone '{sub}'!") from None
+
+    def active_batch(self, key, sub, item_id, rev=None):
+        # (item, revision) to validate against; the revision is read first so a change racing the checks fails the commit
+        entry = self.journal.batches.get(item_id)
+        if entry is None or entry[1:] != (key, sub, "active"): raise (ServiceError if rev is None else ConflictError)("Batch is no longer active here!")
+        current = entry[0].get("rev", 0)
+        if rev is not None and current != rev: raise self.conflict(item_id)
+        return entry[0], current
+
+    # --- SINGLE OPERATIONS ---
+    def add_sub_zone(self, key, sub):
+        loc = self.journal.level3_data.get(key)
+        if loc and sub in loc["tabs"]: raise ServiceError("Name already exists!")
+        return self.emit(events.SUB_ZONE_ADDED, key, sub)
+
+    def add_stock(self, key, sub, product, qty):
+        if product not in self.products_config: raise ServiceError(f"Unknown product '{product}'!")
+        if qty is None: raise ServiceError("Quantity is missing or not a number!")
+        if qty <= 0: raise ServiceError("Quantity must be greater than zero!")
+        self.sub_zone(key, sub)
+        return self.emit(events.STOCK_ADDED, key, sub, product=product, qty=qty, time=now_ts())
+
+    def create_batch(self, key, sub, product, qty, name=None):
+        name = (name or "").strip() or self.names.unique_name()
+        if name in self.names: raise ServiceError(f"Batch name '{name}' is already in use!")
+        if qty is None or qty <= 0: raise ServiceError("Quantity must be greater than zero!")
+        stock = self.sub_zone(key, sub)["stock"]
+        if qty > stock.get(product, 0): raise ServiceError(f"Not enough stock! Only {stock.get(product, 0):g} available.")
+        def check():
+            # repeated under the journal lock: another operator may have taken the name or the stock since the checks above
+            if name in self.names: raise ConflictError(f"Batch name '{name}' was just taken by another operator. Choose another name.")
+            if qty > stock.get(product, 0): raise ConflictError(f"The stock was just used by another operator! Only {stock.get(product, 0):g} left.")
+        return self.emit(events.BATCH_CREATED, key, sub, check=check, id=new_id(), product=product, name=name, qty=qty, routing=self.db.routing_ref(product, self.products_config.get(product, [])), time=now_ts())
+
+    def update_batch(self, key, sub, item_id, field, value, rev=None):
+        if field not in EDITABLE_FIELDS: raise ServiceError(f"Field '{field}' cannot be edited!")
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        if field == "quantity":
+            value = parse_qty(value)
+            if value is None or value <= 0: raise ServiceError("Quantity must be greater than zero!")
+        if field == "name":
+            value = value.strip()
+            if value in self.names and value != item["name"]: raise ServiceError("This batch name exists elsewhere! Change reverted.")
+            value = value or item["name"]
+        if value == item.get(field): return item
+        def check():
+            # repeated under the journal lock: another operator may have given a batch this name since the check above
+            if field == "name" and value in self.names: raise ConflictError(f"Batch name '{value}' was just taken by another operator. Choose another name.")
+        return self.emit(events.BATCH_UPDATED, key, sub, rev, check=check, id=item_id, field=field, value=value)
+
+    def advance(self, key, sub, item_id, rev=None):
+        # starts the current step, or completes it when it is already running
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        if item["step_idx"] >= len(item["steps"]): raise ServiceError("All steps are completed, the batch is ready to archive.")
+        return self.emit(events.STEP_COMPLETED if item.get("is_processing", False) else events.STEP_STARTED, key, sub, rev, id=item_id, time=now_ts())
+
+    def insert_step(self, key, sub, item_id, step, pos=None, rev=None):
+        item, rev = self.active_batch(key, sub, item_id, rev); step = step.strip()
+        if not step: raise ServiceError("Step name cannot be empty!")
+        pos = len(item["steps"]) if pos is None else min(max(pos, 0), len(item["steps"]))
+        return self.emit(events.STEP_INSERTED, key, sub, rev, id=item_id, pos=pos, step=step)
+
+    def delete_step(self, key, sub, item_id, pos, rev=None):
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        if not 0 <= pos < len(item["steps"]): raise ServiceError("No such step!")
+        if pos < item["step_idx"] or (pos == item["step_idx"] and item.get("is_processing", False)): raise ServiceError("Only steps that have not started can be removed!")
+        return self.emit(events.STEP_DELETED, key, sub, rev, id=item_id, pos=pos)
+
+    def revert(self, key, sub, item_id, rev=None):
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        if not (item.get("is_processing", False) or item["step_idx"] > 0): raise ServiceError("Nothing to revert!")
+        return self.emit(events.STEP_REVERTED, key, sub, rev, id=item_id)
+
+    def move(self, key, sub, item_id, to_key, to_sub, rev=None):
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        if not (to_key and to_sub): raise ServiceError("Choose a destination sub-zone!")
+        if (to_key, to_sub) == (key, sub): raise ServiceError("The batch is already in this sub-zone!")
+        self.sub_zone(to_key, to_sub)
+        return self.emit(events.BATCH_MOVED, key, sub, rev, id=item_id, to_key=to_key, to_sub=to_sub, time=now_ts())
+
+    def archive(self, key, sub, item_id, rev=None):
+        item, rev = self.active_batch(key, sub, item_id, rev)
+        return self.emit(events.BATCH_ARCHIVED, key, sub, rev, id=item_id, time=now_ts())
+
+    # --- BULK OPERATIONS ---
+    def bulk(self, op, inputs):
+        done, rejected = [], []
+        with self.journal.transaction():
+            for args in inputs:
+                try: done.append(op(*args))
+                except ServiceError as e: rejected.append((args, str(e)))
+        return done, rejected
+
+    def bulk_add_stock(self, key, sub, lines): return self.bulk(lambda product, qty: self.add_stock(key, sub, product, qty), lines)
+    def bulk_create_batches(self, key, sub, orders): return self.bulk(lambda product, qty, name=None: self.create_batch(key, sub, product, qty, name), orders)
+    def bulk_advance(self, key, sub, item_ids): return self.bulk(lambda item_id: self.advance(key, sub, item_id), ((item_id,) for item_id in item_ids))
+    def bulk_move(self, key, sub, item_ids, to_key, to_sub): return self.bulk(lambda item_id: self.move(key, sub, item_id, to_key, to_sub), ((item_id,) for item_id in item_ids))
+    def import_stock(self, rows, chunk=IMPORT_CHUNK, summary=None):
+        # rows: (line_no, key, sub, product, qty) as read_stock_csv streams them. Each chunk is one transaction, and only
+        # counts and the first rejected lines are kept, so memory stays bounded whatever the file size. A caller passing
+        # `summary` still has the counts of the lines committed so far if reading the file fails part way.
+        # The whole import is one hold, so its changes are announced to other sessions once, when it finishes.
+        summary = new_import_summary() if summary is None else summary
+        rows = iter(rows)
+        with self.journal.hold():
+            while True:
+                block = list(islice(rows, chunk))
+                if not block: return summary
+                with self.journal.transaction():
+                    for line_no, key, sub, product, qty in block:
+                        try:
+                            if key is None: raise ServiceError("Give both the factory and the room, or neither!")
+                            self.add_stock(key, sub, product, qty)
+                        except ServiceError as e:
+                            summary["rejected"] += 1
+                            if len(summary["samples"]) < REJECTED_SAMPLES: summary["samples"].append((line_no, str(e)))
+                        else: summary["added"] += 1; summary["quantity"] += qty; summary["zones"].add((key, sub))
+
+    def import_stock_csv(self, path, key, sub, summary=None):
+        with open(path, newline="", encoding="utf-8-sig") as f: return self.import_stock(read_stock_csv(f, key, sub), summary=summary)
+
+    def archive_sub_zone(self, key, sub): return self.bulk(lambda item_id: self.archive(key, sub, item_id), [(item["id"],) for item in self.sub_zone(key, sub)["active"]])
@@ -1,4 +1,5 @@
 import flet as ft
+from scheduler import batched, mark_dirty
 
 class SettingsView(ft.Container):
     def __init__(self, page: ft.Page, products_config: dict, save_cb):
@@ -11,6 +12,7 @@ class SettingsView(ft.Container):
         self.save_cb = save_cb 
         self.products = products_config
         self.expanded_products = set() 
+        self.cards = {}  # product -> controls of its card, patched in place by render_products()
 
         self.product_name_input = ft.TextField(
             label="New Product Name", expand=True, 
@@ -61,20 +63,23 @@ class SettingsView(ft.Container):
     def show_snackbar(self, msg, is_error=False):
         self.page.open(ft.SnackBar(content=ft.Text(msg, color="#FFFFFF", weight=ft.FontWeight.W_500), bgcolor="#EF4444" if is_error else "#10B981", behavior=ft.SnackBarBehavior.FLOATING, margin=20, shape=ft.RoundedRectangleBorder(radius=8)))
 
+    @batched
     def add_product(self, e):
         name = self.product_name_input.value.strip()
         if name and name not in self.products:
-            self.products[name] = []; self.expanded_products.add(name); self.product_name_input.value = ""; self.render_products(); self.show_snackbar(f"Product '{name}' added!")
+            self.products[name] = []; self.expanded_products.add(name); self.product_name_input.value = ""; self.commit(); self.show_snackbar(f"Product '{name}' added!")
         else: self.show_snackbar("Name invalid or already exists!", True)
 
+    @batched
     def add_step(self, product_name, step_name, input_field):
-        if step_name: self.products[product_name].append(step_name); self.expanded_products.add(product_name); input_field.value = ""; self.render_products()
+        if step_name: self.products[product_name].append(step_name); self.expanded_products.add(product_name); input_field.value = ""; self.commit()
 
     def open_edit(self, edit_type, product_name, step_index=None):
         self.current_edit_data = {"type": edit_type, "product": product_name, "step": step_index}
         self.edit_input.value = product_name if edit_type == "product" else self.products[product_name][step_index]
         self.page.open(self.edit_dialog)
 
+    @batched
     def save_edit(self, e):
         new_val = self.edit_input.value.strip()
         if not new_val: self.show_snackbar("Name cannot be empty!", True); return
@@ -83,53 +88,78 @@ class SettingsView(ft.Container):
             if new_val != data["product"] and new_val in self.products: self.show_snackbar("Product already exists!", True); return
             self.products[new_val] = self.products.pop(data["product"])
             if data["product"] in self.expanded_products: self.expanded_products.remove(data["product"]); self.expanded_products.add(new_val)
+            if data["product"] in self.cards: self.cards[new_val] = self.cards.pop(data["product"]); self.cards[new_val]["name"] = new_val
         elif data["type"] == "step": self.products[data["product"]][data["step"]] = new_val
-        self.page.close(self.edit_dialog); self.render_products(); self.show_snackbar("Updated successfully!")
+        self.page.close(self.edit_dialog); self.commit(); self.show_snackbar("Updated successfully!")
 
-    def delete_step(self, product_name, step_index): self.products[product_name].pop(step_index); self.render_products()
-    def delete_product(self, product_name): del self.products[product_name]; self.expanded_products.discard(product_name); self.render_products()
-    def handle_expansion(self, e, prod_name):
-        if e.data == "true": self.expanded_products.add(prod_name)
-        else: self.expanded_products.discard(prod_name)
+    @batched
+    def delete_step(self, product_name, step_index): self.products[product_name].pop(step_index); self.commit()
+    @batched
+    def delete_product(self, product_name): del self.products[product_name]; self.expanded_products.discard(product_name); self.commit()
+    def handle_expansion(self, e, entry):
+        entry["expanded"] = e.data == "true"
+        if entry["expanded"]: self.expanded_products.add(entry["name"])
+        else: self.expanded_products.discard(entry["name"])
+
+    def commit(self): self.render_products(); self.save_cb()  # after an edit; changes from other sessions are only rendered
 
     def render_products(self):
-        self.products_grid.controls.clear()
-        
+        # cards are kept per product and only their title and step rows are patched; a card is rebuilt only when
+        # its expansion has to change, since ExpansionTile applies initially_expanded once
+        for prod_name in [p for p in self.cards if p not in self.products]: del self.cards[prod_name]
+        grid = []
         for prod_name, steps in self.products.items():
-            steps_column = ft.Column(spacing=0)
-            for i, step in enumerate(steps):
-                steps_column.controls.append(
-                    ft.Container(
-                        padding=ft.padding.only(left=10, top=8, bottom=8), 
-                        border=ft.border.only(bottom=ft.border.BorderSide(1, "#F1F5F9")),
-                        content=ft.Row([
-                            ft.Container(padding=6, bgcolor="#EFF6FF", border_radius=20, content=ft.Text(str(i+1), size=11, color="#2563EB", weight=ft.FontWeight.BOLD)),
-                            ft.Text(step, expand=True, size=13, color="#334155", weight=ft.FontWeight.W_500, overflow=ft.TextOverflow.ELLIPSIS),
-                            ft.IconButton(ft.Icons.EDIT, icon_color="#60A5FA", icon_size=16, padding=0, width=30, on_click=lambda e, p=prod_name, idx=i: self.open_edit("step", p, idx)),
-                            ft.IconButton(ft.Icons.DELETE_OUTLINE, icon_color="#F87171", icon_size=16, padding=0, width=30, on_click=lambda e, p=prod_name, idx=i: self.delete_step(p, idx))
-                        ]) 
-                    )
-                )
-
-            step_input = ft.TextField(label="Add routing step", expand=True, border_radius=8, content_padding=10, text_size=13, border_color="#E2E8F0", focused_border_color="#2563EB")
-            add_step_btn = ft.IconButton(ft.Icons.ADD, icon_color="#FFFFFF", bgcolor="#2563EB", style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8)), on_click=lambda e, p=prod_name, inp=step_input: self.add_step(p, inp.value.strip(), inp))
-            steps_column.controls.append(ft.Container(padding=ft.padding.only(left=10, right=10, top=10, bottom=15), content=ft.Row([step_input, add_step_btn])))
-
-            card = ft.Container(
-                bgcolor="#FFFFFF", border_radius=12, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)),
-                content=ft.ExpansionTile(
-                    title=ft.Text(prod_name, size=16, weight=ft.FontWeight.W_700, color="#0F172A"),
-                    leading=ft.Container(padding=8, bgcolor="#F8FAFC", border_radius=8, content=ft.Icon(ft.Icons.INVENTORY_2_OUTLINED, color="#64748B", size=20)),
-                    controls_padding=0, initially_expanded=(prod_name in self.expanded_products),
-                    on_change=lambda e, p=prod_name: self.handle_expansion(e, p),
-                    trailing=ft.Row([
-                        ft.IconButton(ft.Icons.EDIT, icon_color="#60A5FA", on_click=lambda e, p=prod_name: self.open_edit("product", p)),
-                        ft.IconButton(ft.Icons.DELETE_OUTLINE, icon_color="#F87171", on_click=lambda e, p=prod_name: self.delete_product(p)),
-                    ], tight=True),
-                    controls=[ft.Divider(height=1, color="#E2E8F0"), steps_column]
-                )
-            )
-            self.products_grid.controls.append(ft.Column(col={"xs": 12, "md": 6, "xl": 4}, controls=[card]))
+            entry = self.cards.get(prod_name)
+            if entry is None or entry["expanded"] != (prod_name in self.expanded_products): entry = self.cards[prod_name] = self.build_card(prod_name)
+            entry["title"].value = prod_name
+            self.sync_steps(entry, steps)
+            grid.append(entry["col"])
+        self.products_grid.controls = grid
         
-        if self.page: self.update()
-        self.save_cb()
\ No newline at end of file
+        if self.page: mark_dirty(self)
+
+    def sync_steps(self, entry, steps):
+        rows = entry["rows"]
+        del rows[len(steps):]
+        for i, step in enumerate(steps):
+            if i == len(rows): rows.append(self.build_step_row(entry, i))
+            rows[i].content.controls[1].value = step
+        entry["steps_column"].controls = rows + [entry["add_row"]]
+
+    def build_step_row(self, entry, i):
+        row = ft.Container(
+            padding=ft.padding.only(left=10, top=8, bottom=8), data=i,
+            border=ft.border.only(bottom=ft.border.BorderSide(1, "#F1F5F9")),
+            content=ft.Row([
+                ft.Container(padding=6, bgcolor="#EFF6FF", border_radius=20, content=ft.Text(str(i+1), size=11, color="#2563EB", weight=ft.FontWeight.BOLD)),
+                ft.Text("", expand=True, size=13, color="#334155", weight=ft.FontWeight.W_500, overflow=ft.TextOverflow.ELLIPSIS),
+                ft.IconButton(ft.Icons.EDIT, icon_color="#60A5FA", icon_size=16, padding=0, width=30, on_click=lambda e: self.open_edit("step", entry["name"], row.data)),
+                ft.IconButton(ft.Icons.DELETE_OUTLINE, icon_color="#F87171", icon_size=16, padding=0, width=30, on_click=lambda e: self.delete_step(entry["name"], row.data))
+            ]) 
+        )
+        return row
+
+    def build_card(self, prod_name):
+        entry = {"name": prod_name, "expanded": prod_name in self.expanded_products, "rows": []}
+        step_input = ft.TextField(label="Add routing step", expand=True, border_radius=8, content_padding=10, text_size=13, border_color="#E2E8F0", focused_border_color="#2563EB")
+        add_step_btn = ft.IconButton(ft.Icons.ADD, icon_color="#FFFFFF", bgcolor="#2563EB", style=ft.ButtonStyle(shape=ft.RoundedRectangleBorder(radius=8)), on_click=lambda e: self.add_step(entry["name"], step_input.value.strip(), step_input))
+        entry["add_row"] = ft.Container(padding=ft.padding.only(left=10, right=10, top=10, bottom=15), content=ft.Row([step_input, add_step_btn]))
+        entry["steps_column"] = ft.Column(spacing=0)
+        entry["title"] = ft.Text(prod_name, size=16, weight=ft.FontWeight.W_700, color="#0F172A")
+
+        card = ft.Container(
+            bgcolor="#FFFFFF", border_radius=12, border=ft.border.all(1, "#E2E8F0"), shadow=ft.BoxShadow(blur_radius=10, color="#00000008", offset=ft.Offset(0, 4)),
+            content=ft.ExpansionTile(
+                title=entry["title"],
+                leading=ft.Container(padding=8, bgcolor="#F8FAFC", border_radius=8, content=ft.Icon(ft.Icons.INVENTORY_2_OUTLINED, color="#64748B", size=20)),
+                controls_padding=0, initially_expanded=entry["expanded"],
+                on_change=lambda e: self.handle_expansion(e, entry),
+                trailing=ft.Row([
+                    ft.IconButton(ft.Icons.EDIT, icon_color="#60A5FA", on_click=lambda e: self.open_edit("product", entry["name"])),
+                    ft.IconButton(ft.Icons.DELETE_OUTLINE, icon_color="#F87171", on_click=lambda e: self.delete_product(entry["name"])),
+                ], tight=True),
+                controls=[ft.Divider(height=1, color="#E2E8F0"), entry["steps_column"]]
+            )
+        )
+        entry["col"] = ft.Column(col={"xs": 12, "md": 6, "xl": 4}, controls=[card])
+        return entry
\ No newline at end of file
@@ -0,0 +1,470 @@
+import os
+import json
+import zlib
+import logging
+import heapq
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from timeutil import to_ts, is_legacy, now_ts, in_range
+from records import Batch, StockEntry, TimelineEvent, to_id
+from routing import RoutingTemplates
+from events import new_sub_zone
+from kpis import summarize
+
+DB_NAME = "erp_data.db"
+SAVE_DELAY = 0.4  # seconds of quiet before a burst of edits is committed as one transaction
+SNAPSHOT_EVERY = 200  # journal events between two snapshot checkpoints
+ARCHIVE_AFTER_DAYS = int(os.getenv("ERP_ARCHIVE_DAYS", "180"))  # history older than this moves to cold segments; 0 keeps all resident
+ARCHIVE_EVERY = 86400  # s between two moves of aged history into the cold tier while the app runs
+ARCHIVE_CACHE = 64  # decoded cold segments kept in memory
+ARCHIVE_MMAP = 256 * 1024 * 1024  # bytes of the database file the archive reader may memory-map
+
+log = logging.getLogger("erp.storage")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (name TEXT PRIMARY KEY, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS locations (key TEXT PRIMARY KEY, tabs TEXT NOT NULL, active_tab INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS stock (key TEXT NOT NULL, sub TEXT NOT NULL, product TEXT NOT NULL, qty REAL NOT NULL, PRIMARY KEY (key, sub, product));
+CREATE TABLE IF NOT EXISTS batches (id TEXT PRIMARY KEY, key TEXT NOT NULL, sub TEXT NOT NULL, status TEXT NOT NULL, seq INTEGER NOT NULL, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ledger (seq INTEGER PRIMARY KEY, key TEXT NOT NULL, sub TEXT NOT NULL, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS timeline (batch_id TEXT NOT NULL, pos INTEGER NOT NULL, step TEXT NOT NULL, time INTEGER NOT NULL, PRIMARY KEY (batch_id, pos));
+CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY, type TEXT NOT NULL, body TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS archive (key TEXT NOT NULL, sub TEXT NOT NULL, month INTEGER NOT NULL, entries INTEGER NOT NULL, scan INTEGER NOT NULL, seq INTEGER NOT NULL, body BLOB NOT NULL, kpis TEXT, PRIMARY KEY (key, sub, month));
+CREATE TABLE IF NOT EXISTS archived_names (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS batches_loc ON batches (key, sub, status, seq);
+CREATE INDEX IF NOT EXISTS ledger_loc ON ledger (key, sub, seq);
+"""
+
+def default_db_path():
+    base = os.getenv("FLET_APP_STORAGE_DATA") or os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base, DB_NAME)
+
+def archive_time(entry):
+    if entry.get("entry_type") == "Stock": return entry["date"]
+    return entry.get("date_completed") or (entry["timeline"][-1]["time"] if entry.get("timeline") else 0)
+
+def entry_seq(entry): return entry["seq"]
+
+def month_of(ts): dt = datetime.fromtimestamp(ts); return dt.year * 12 + dt.month - 1
+
+def decode_entry(data): return StockEntry.from_dict(data) if data.get("entry_type") == "Stock" else Batch.from_dict(data)
+
+def scan_size(entry): return 1 + (len(entry["timeline"]) if entry.get("entry_type") != "Stock" else 0)
+
+def migrate_level3(level3_data):
+    # one-time schema upgrade at load, so hot paths never have to patch missing keys
+    for loc_data in level3_data.values():
+        loc_data.setdefault("tabs", list(loc_data.get("data", {}))); loc_data.pop("active_tab", None); loc_data.setdefault("data", {})
+        for tab_data in loc_data["data"].values():
+            for field, default in new_sub_zone().items(): tab_data.setdefault(field, default)
+    return level3_data
+
+
+# --- SQLITE (WAL) BACKEND ---
+# Every flush appends the pending journal events. The state tables act as the snapshot: the rows marked
+# dirty since the last checkpoint are only written every `snapshot_every` events (and on shutdown), and
+# load() replays the events recorded after that checkpoint. `lock` guards the in-memory state and is only held
+# to take the changes of a flush; the disk write runs outside it.
+# History (archived batches and stock logs) older than `archive_after_days` is moved into the cold tier at load, and
+# about once a day from the flush timer: zlib-compressed JSON segments, one per location, sub-zone and month, read
+# back on demand through archived().
+class Storage:
+    def __init__(self, path=None, delay=SAVE_DELAY, snapshot_every=SNAPSHOT_EVERY, archive_after_days=ARCHIVE_AFTER_DAYS):
+        self.path = path or default_db_path()
+        self.delay = delay
+        self.snapshot_every = snapshot_every
+        self.archive_after = archive_after_days * 86400
+        self.archive_before = now_ts() - self.archive_after if archive_after_days else None
+        self.archived_at = now_ts()
+        self.on_archived = None  # called under the lock once a periodic move evicted history; the journal rebuilds its indexes
+        self.file_time = int(os.path.getmtime(self.path)) if os.path.exists(self.path) else now_ts()  # dates legacy strings that cannot be parsed
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+        self.lock = threading.RLock()
+        self.writer = threading.Condition()  # serializes SQLite writes; flushes write in ticket order
+        self.tickets = self.written = 0
+        self.timer = None
+        self.seq = self.conn.execute("SELECT MAX(m) FROM (SELECT MAX(seq) AS m FROM batches UNION ALL SELECT MAX(seq) FROM ledger UNION ALL SELECT MAX(seq) FROM archive)").fetchone()[0] or 0
+        self.event_seq = self.conn.execute("SELECT MAX(seq) FROM events").fetchone()[0] or 0
+        self.checkpoint_seq = (self.conn.execute("SELECT value FROM meta WHERE name = 'checkpoint_seq'").fetchone() or (0,))[0]
+        self.pending_events = []
+
+        self.state = None
+        self.routings = RoutingTemplates()
+        self.config_dirty = False
+        self.dirty_locations = set()
+        self.dirty_stock = set()          # (key, sub, product)
+        self.dirty_batches = {}           # batch id -> (key, sub, status, item)
+        self.dirty_timeline = {}          # batch id -> first timeline position to rewrite
+        self.dirty_ledger = {}            # seq -> (key, sub, entry)
+        self.placement = {}               # batch id -> (key, sub, status) as last marked
+        self.legacy_ids = set()           # uuid string ids whose rows are rewritten under the integer id
+
+        # cold tier reads go through their own connection (WAL lets them run beside the writer) and a small segment cache
+        self.archive_conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.archive_conn.execute(f"PRAGMA mmap_size={ARCHIVE_MMAP}")
+        self.archive_lock = threading.Lock()
+        self.archive_zones = {(key, sub) for key, sub in self.conn.execute("SELECT DISTINCT key, sub FROM archive")}
+        self.archive_month = self.conn.execute("SELECT MAX(month) FROM archive").fetchone()[0]  # newest cold segment
+        self.segment = lru_cache(maxsize=ARCHIVE_CACHE)(self.read_segment)
+        self.index_archived_names()
+        self.summarize_segments()
+        atexit.register(self.close)
+
+    # --- LOADING ---
+    def load(self):
+        rows = dict(self.conn.execute("SELECT name, body FROM config"))
+        products_config = json.loads(rows.get("products_config", "{}"))
+        factories = json.loads(rows.get("factories", "[]"))
+        factory_sub_locations = json.loads(rows.get("factory_sub_locations", "{}"))
+        self.routings = RoutingTemplates(json.loads(rows.get("routings", "{}")))
+
+        level3_data = {}
+        for key, tabs in self.conn.execute("SELECT key, tabs FROM locations"):
+            tabs = json.loads(tabs)
+            level3_data[key] = {"tabs": tabs, "data": {t: new_sub_zone() for t in tabs}}
+
+        def sub_zone(key, sub):
+            loc = level3_data.setdefault(key, {"tabs": [], "data": {}})
+            if sub not in loc["data"]: loc["tabs"].append(sub); loc["data"][sub] = new_sub_zone()
+            return loc["data"][sub]
+
+        for key, sub, product, qty in self.conn.execute("SELECT key, sub, product, qty FROM stock"):
+            sub_zone(key, sub)["stock"][product] = qty
+
+        # legacy rows stored formatted time strings or uuid ids: convert them and queue them for rewrite
+        raw_timelines = {}; legacy_ids = set()
+        for batch_id, step, time in self.conn.execute("SELECT batch_id, step, time FROM timeline ORDER BY batch_id, pos"):
+            if is_legacy(time): legacy_ids.add(to_id(batch_id))
+            raw_timelines.setdefault(to_id(batch_id), []).append((step, time))
+        timelines = {batch_id: [TimelineEvent(step, ts) for (step, _), ts in zip(rows, self.legacy_times([time for _, time in rows]))] for batch_id, rows in raw_timelines.items()}
+
+        history_rows = []
+        for row_id, key, sub, status, seq, body in self.conn.execute("SELECT id, key, sub, status, seq, body FROM batches ORDER BY seq"):
+            data = json.loads(body); data["timeline"] = timelines.get(to_id(data["id"]), [])
+            if "steps" not in data: data["steps"] = self.routings.steps(*data["routing"])  # rows only store steps that differ from their template
+            item = Batch.from_dict(data); batch_id = item["id"]
+            if not row_id.isdigit(): self.legacy_ids.add(row_id); legacy_ids.add(batch_id)
+            self.placement[batch_id] = (key, sub, status)
+            if is_legacy(item.get("date_completed")): item["date_completed"] = self.legacy_ts(item["date_completed"], item["timeline"][-1]["time"] if item["timeline"] else None); legacy_ids.add(batch_id)
+            if batch_id in legacy_ids: self.mark_batch(key, sub, status, item, timeline_from=0)
+            if status == "active": sub_zone(key, sub)["active"].append(item)
+            else: history_rows.append((seq, key, sub, item))
+        near = None
+        for seq, key, sub, body in self.conn.execute("SELECT seq, key, sub, body FROM ledger ORDER BY seq"):
+            entry = StockEntry.from_dict(json.loads(body)); entry["seq"] = seq  # legacy bodies carry no seq; the row key is authoritative
+            if is_legacy(entry.get("date")): entry["date"] = self.legacy_ts(entry["date"], near); self.mark_ledger(key, sub, entry)
+            history_rows.append((seq, key, sub, entry)); near = entry["date"]
+        history_rows.sort(key=lambda r: r[0])
+        cold = [row for row in history_rows if self.archive_before is not None and archive_time(row[3]) < self.archive_before]
+        if cold: self.move_to_archive(cold); history_rows = [row for row in history_rows if archive_time(row[3]) >= self.archive_before]
+        for seq, key, sub, item in history_rows: sub_zone(key, sub)["history"].append(item)
+        for key, sub in self.archive_zones: sub_zone(key, sub)
+
+        self.state = (products_config, factories, factory_sub_locations, migrate_level3(level3_data))
+        return self.state
+
+    # --- LEGACY TIMES ---
+    def legacy_ts(self, value, near):
+        # a string no legacy format matches is dated at the snapshot's file time, so it sorts with the newest legacy data
+        ts = to_ts(value, self.file_time if near is None else near)
+        if ts is None: log.warning("unparseable legacy time %r dated at the snapshot's file time", value); ts = self.file_time
+        return ts
+
+    def legacy_times(self, values):
+        # a chronological run of stored times: short legacy strings take their year from the entry before them, the
+        # first one from the run's first absolute time, so a timeline spanning New Year stays in order
+        anchor = next((ts for ts in map(to_ts, values) if ts is not None), None); times = []
+        for value in values: times.append(self.legacy_ts(value, times[-1] if times else anchor))
+        return times
+
+    # --- COLD TIER ---
+    def move_to_archive(self, rows): self.write_cold(self.take_cold(rows))
+
+    def archive_due(self): return bool(self.archive_after) and self.state is not None and now_ts() - self.archived_at >= ARCHIVE_EVERY
+
+    def archive_aged(self):
+        # the running counterpart of the move at load. A checkpoint comes first, so no event replayed at the next load
+        # touches what moves; the segments are written behind the writer like a flush, and the entries leave the
+        # history lists (and the indexes, through on_archived) once they are committed
+        with self.lock:
+            if not self.archive_due(): return
+            self.archived_at = now_ts(); self.archive_before = self.archived_at - self.archive_after
+        self.flush(checkpoint=True)
+        with self.lock:
+            rows = sorted(((entry["seq"], key, sub, entry) for key, loc in self.state[3].items() for sub, tab_data in loc["data"].items() for entry in tab_data["history"] if archive_time(entry) < self.archive_before), key=lambda row: row[0])
+            if not rows: return
+            taken = self.take_cold(rows); ticket = self.tickets; self.tickets += 1
+        with self.writer:
+            while self.written != ticket: self.writer.wait()
+            try: self.write_cold(taken)
+            except Exception:
+                with self.lock: self.restore_cold(taken)
+                raise
+            finally: self.written += 1; self.writer.notify_all()
+        with self.lock:
+            moved = {id(entry) for seq, key, sub, entry in rows}
+            for key, sub, month in taken["segments"]:
+                tab_data = self.state[3].get(key, {}).get("data", {}).get(sub)
+                if tab_data is not None: tab_data["history"][:] = [entry for entry in tab_data["history"] if id(entry) not in moved]
+            self.segment.cache_clear()
+            if self.on_archived: self.on_archived()
+        log.info("moved %d history entries into the cold tier", len(rows))
+
+    def take_cold(self, rows):
+        # groups (seq, key, sub, entry) rows into their month segments and drops their dirty marks, so no later
+        # checkpoint writes them back into the state tables; restore_cold() puts the marks back if the move fails
+        legacy_rows = {to_id(row_id): row_id for row_id in self.legacy_ids}  # batch id -> uuid row id
+        taken = {"segments": {}, "row_ids": {}, "marks": [], "legacy": []}
+        def drop(table, key):
+            if key in getattr(self, table): taken["marks"].append((table, key, getattr(self, table).pop(key)))
+        for seq, key, sub, entry in rows:
+            entry["seq"] = seq; taken["segments"].setdefault((key, sub, month_of(archive_time(entry))), []).append(entry)
+            if entry.get("entry_type") == "Stock": drop("dirty_ledger", seq); continue
+            row_id = taken["row_ids"][entry["id"]] = legacy_rows.get(entry["id"], entry["id"])
+            if row_id in self.legacy_ids: self.legacy_ids.discard(row_id); taken["legacy"].append(row_id)
+            for table in ("dirty_batches", "dirty_timeline", "placement"): drop(table, entry["id"])
+        return taken
+
+    def restore_cold(self, taken):
+        for table, key, value in taken["marks"]: getattr(self, table).setdefault(key, value)
+        self.legacy_ids.update(taken["legacy"])
+
+    def write_cold(self, taken):
+        # appends the taken entries to their month segments and deletes their state rows, in one transaction
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for (key, sub, month), entries in taken["segments"].items():
+                row = cur.execute("SELECT body FROM archive WHERE key = ? AND sub = ? AND month = ?", (key, sub, month)).fetchone()
+                body = json.loads(zlib.decompress(row[0])) if row else []
+                body.extend(entry.to_dict() for entry in entries); body.sort(key=entry_seq)
+                cur.execute("INSERT OR REPLACE INTO archive (key, sub, month, entries, scan, seq, body, kpis) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (key, sub, month, len(body), sum(map(scan_size, body)), body[-1]["seq"], zlib.compress(json.dumps(body, separators=(",", ":")).encode()), json.dumps(summarize(body))))
+                for entry in entries:
+                    if entry.get("entry_type") == "Stock": cur.execute("DELETE FROM ledger WHERE seq = ?", (entry["seq"],))
+                    else:
+                        cur.execute("INSERT OR REPLACE INTO archived_names (id, name) VALUES (?, ?)", (entry["id"], entry["name"]))
+                        row_id = taken["row_ids"][entry["id"]]; cur.execute("DELETE FROM batches WHERE id = ?", (row_id,)); cur.execute("DELETE FROM timeline WHERE batch_id = ?", (row_id,))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK"); raise
+        for key, sub, month in taken["segments"]: self.archive_zones.add((key, sub)); self.archive_month = max(month, self.archive_month or month)
+
+    def index_archived_names(self):
+        # databases archived before archived_names existed: the names are read out of their segments once
+        if self.conn.execute("SELECT 1 FROM meta WHERE name = 'archived_names'").fetchone(): return
+        names = [(entry["id"], entry["name"]) for key, sub, entry in self.archived() if entry.get("entry_type") == "Batch"]
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.executemany("INSERT OR REPLACE INTO archived_names (id, name) VALUES (?, ?)", names)
+            cur.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('archived_names', 1)")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK"); raise
+        self.segment.cache_clear()
+
+    def summarize_segments(self):
+        # segments written before the kpis column existed get their KPI summary once, here
+        if not any(column[1] == "kpis" for column in self.conn.execute("PRAGMA table_info(archive)")): self.conn.execute("ALTER TABLE archive ADD COLUMN kpis TEXT")
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for key, sub, month, body in cur.execute("SELECT key, sub, month, body FROM archive WHERE kpis IS NULL").fetchall():
+                cur.execute("UPDATE archive SET kpis = ? WHERE key = ? AND sub = ? AND month = ?", (json.dumps(summarize(json.loads(zlib.decompress(body)))), key, sub, month))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK"); raise
+
+    def archive_kpis(self):
+        # (key, KPI summary) per cold segment, read without decoding the segment bodies
+        with self.archive_lock: rows = self.archive_conn.execute("SELECT key, kpis FROM archive").fetchall()
+        return [(key, json.loads(kpis)) for key, kpis in rows]
+
+    def archived_names(self):
+        # (batch id, name) of every cold batch; names stay taken after their batch leaves memory
+        with self.archive_lock: return self.archive_conn.execute("SELECT id, name FROM archived_names").fetchall()
+
+    def read_segment(self, key, sub, month):
+        with self.archive_lock: row = self.archive_conn.execute("SELECT body FROM archive WHERE key = ? AND sub = ? AND month = ?", (key, sub, month)).fetchone()
+        return tuple(decode_entry(data) for data in json.loads(zlib.decompress(row[0]))) if row else ()
+
+    def reaches_archive(self, lo): return self.archive_month is not None and (lo is None or month_of(lo) <= self.archive_month)
+
+    def archived(self, key=None, sub=None, lo=None, hi=None):
+        # (key, sub, entry) of cold entries archived inside [lo, hi], per location and sub-zone in archive (seq) order
+        if not self.reaches_archive(lo): return
+        query, args = "SELECT key, sub, month FROM archive WHERE 1", []
+        if key is not None: query += " AND key = ?"; args.append(key)
+        if sub is not None: query += " AND sub = ?"; args.append(sub)
+        if lo is not None: query += " AND month >= ?"; args.append(month_of(lo))
+        if hi is not None: query += " AND month <= ?"; args.append(month_of(hi))
+        with self.archive_lock: months = self.archive_conn.execute(query + " ORDER BY key, sub, month", args).fetchall()
+        for (seg_key, seg_sub), group in groupby(months, key=lambda row: row[:2]):
+            for entry in heapq.merge(*(self.segment(seg_key, seg_sub, month) for k, s, month in group), key=entry_seq):
+                if in_range(archive_time(entry), lo, hi): yield seg_key, seg_sub, entry
+
+    def archive_scan_size(self, lo=None):
+        # entries plus timeline events held in the cold segments a scan from `lo` has to read
+        if not self.reaches_archive(lo): return 0
+        with self.archive_lock: return self.archive_conn.execute("SELECT COALESCE(SUM(scan), 0) FROM archive WHERE month >= ?", (month_of(lo) if lo is not None else 0,)).fetchone()[0]
+
+    def events_since_checkpoint(self):
+        # events of older journals carry formatted times, dated here from the event before them
+        near = None
+        for seq, body in self.conn.execute("SELECT seq, body FROM events WHERE seq > ? ORDER BY seq", (self.checkpoint_seq,)):
+            ev = json.loads(body)
+            if is_legacy(ev.get("time")): ev["time"] = self.legacy_ts(ev["time"], near)
+            if "time" in ev: near = ev["time"]
+            yield ev
+
+    # --- DIRTY MARKING ---
+    def next_seq(self): self.seq += 1; return self.seq
+
+    def append_event(self, ev):
+        with self.lock:
+            self.event_seq += 1; ev["seq"] = self.event_seq
+            self.pending_events.append(ev)
+
+    def mark_config(self):
+        with self.lock: self.config_dirty = True
+
+    def routing_ref(self, product, steps):
+        with self.lock:
+            ref, published = self.routings.ref(product, steps)
+            if published: self.config_dirty = True  # written in the same transaction as the event that references it
+            return ref
+
+    def mark_location(self, key):
+        with self.lock: self.dirty_locations.add(key)
+
+    def mark_stock(self, key, sub, product):
+        with self.lock: self.dirty_stock.add((key, sub, product))
+
+    def mark_batch(self, key, sub, status, item, timeline_from=None):
+        with self.lock:
+            if self.placement.get(item["id"]) != (key, sub, status) or "seq" not in item: item["seq"] = self.next_seq()
+            self.placement[item["id"]] = (key, sub, status)
+            self.dirty_batches[item["id"]] = (key, sub, status, item)
+            if timeline_from is not None: self.dirty_timeline[item["id"]] = min(timeline_from, self.dirty_timeline.get(item["id"], timeline_from))
+
+    def mark_ledger(self, key, sub, entry):
+        with self.lock:
+            if "seq" not in entry: entry["seq"] = self.next_seq()
+            self.dirty_ledger[entry["seq"]] = (key, sub, entry)
+
+    # --- WRITING ---
+    def save(self):
+        with self.lock:
+            if self.timer or not self.has_changes(): return
+            self.timer = threading.Timer(self.delay, self.on_timer); self.timer.daemon = True; self.timer.start()
+
+    def on_timer(self):
+        self.flush()
+        if self.archive_due(): self.archive_aged()
+
+    def has_changes(self): return bool(self.config_dirty or self.pending_events or self.has_snapshot_changes())
+    def has_snapshot_changes(self): return bool(self.dirty_locations or self.dirty_stock or self.dirty_batches or self.dirty_timeline or self.dirty_ledger or self.legacy_ids)
+    def checkpoint_due(self): return self.event_seq - self.checkpoint_seq >= self.snapshot_every
+
+    def close(self): self.flush(checkpoint=True)
+
+    def flush(self, checkpoint=False):
+        # the changes are taken (rows serialized, dirty marks cleared) under the state lock; the SQLite transaction and
+        # its fsync run outside it, behind the writer, in the order the changes were taken. Operators never wait on the disk.
+        with self.lock:
+            if self.timer: self.timer.cancel(); self.timer = None
+            if self.state is None or not self.has_changes(): return
+            taken = self.take_changes((checkpoint or self.checkpoint_due()) and self.has_snapshot_changes())
+            ticket = self.tickets; self.tickets += 1
+        with self.writer:
+            while self.written != ticket: self.writer.wait()
+            try: self.write(taken["statements"])
+            except Exception:
+                with self.lock: self.restore(taken)  # marked again, so the next flush retries them
+                raise
+            finally: self.written += 1; self.writer.notify_all()
+        if taken["checkpoint"] is not None:
+            with self.lock: self.checkpoint_seq = max(self.checkpoint_seq, taken["checkpoint"])
+
+    def write(self, statements):
+        # a row the schema refuses would fail every retry and hold back every later save: it is logged and skipped
+        cur = self.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in statements:
+                cur.execute("SAVEPOINT statement")
+                try: cur.executemany(sql, rows)
+                except sqlite3.IntegrityError:
+                    cur.execute("ROLLBACK TO statement")
+                    for row in rows:
+                        try: cur.execute(sql, row)
+                        except sqlite3.IntegrityError as err: log.error("skipped a row the database refused (%s): %s %r", err, sql, row)
+                cur.execute("RELEASE statement")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK"); raise
+
+    def take_changes(self, checkpoint):
+        # (sql, rows) statements for everything pending, plus what restore() needs if writing them fails
+        products_config, factories, factory_sub_locations, level3_data = self.state
+        statements = []
+        if self.config_dirty:
+            statements.append(("INSERT OR REPLACE INTO config (name, body) VALUES (?, ?)", [("products_config", json.dumps(products_config)), ("factories", json.dumps(factories)), ("factory_sub_locations", json.dumps(factory_sub_locations)), ("routings", json.dumps(self.routings.to_dict()))]))
+        statements.append(("INSERT INTO events (seq, type, body) VALUES (?, ?, ?)", [(ev["seq"], ev["type"], json.dumps(ev)) for ev in self.pending_events]))
+        taken = {"statements": statements, "config": self.config_dirty, "events": self.pending_events, "checkpoint": None}
+        self.config_dirty = False; self.pending_events = []
+        if checkpoint:
+            statements.extend(self.snapshot_statements(level3_data)); taken["checkpoint"] = self.event_seq
+            taken["dirty"] = (self.dirty_locations, self.dirty_stock, self.dirty_batches, self.dirty_timeline, self.dirty_ledger, self.legacy_ids)
+            self.dirty_locations, self.dirty_stock, self.dirty_batches, self.dirty_timeline, self.dirty_ledger, self.legacy_ids = set(), set(), {}, {}, {}, set()
+        return taken
+
+    def restore(self, taken):
+        # puts back the marks of changes that could not be written; marks made since take precedence
+        self.pending_events[:0] = taken["events"]; self.config_dirty |= taken["config"]
+        if taken["checkpoint"] is None: return
+        locations, stock, batches, timeline, ledger, legacy_ids = taken["dirty"]
+        self.dirty_locations |= locations; self.dirty_stock |= stock; self.legacy_ids |= legacy_ids
+        for batch_id, row in batches.items(): self.dirty_batches.setdefault(batch_id, row)
+        for batch_id, start in timeline.items(): self.dirty_timeline[batch_id] = min(start, self.dirty_timeline.get(batch_id, start))
+        for seq, row in ledger.items(): self.dirty_ledger.setdefault(seq, row)
+
+    def snapshot_statements(self, level3_data):
+        statements = [("INSERT OR REPLACE INTO meta (name, value) VALUES ('checkpoint_seq', ?)", [(self.event_seq,)])]
+        def add(sql, *params): statements.append((sql, [params]))
+
+        for key in self.dirty_locations:
+            loc = level3_data.get(key)
+            if loc is None: add("DELETE FROM locations WHERE key = ?", key)
+            else: add("INSERT OR REPLACE INTO locations (key, tabs, active_tab) VALUES (?, ?, 0)", key, json.dumps(loc["tabs"]))  # active_tab is unused: each session keeps its own selected sub-zone
+
+        for key, sub, product in self.dirty_stock:
+            qty = level3_data.get(key, {}).get("data", {}).get(sub, {}).get("stock", {}).get(product)
+            if qty is None: add("DELETE FROM stock WHERE key = ? AND sub = ? AND product = ?", key, sub, product)
+            else: add("INSERT OR REPLACE INTO stock (key, sub, product, qty) VALUES (?, ?, ?, ?)", key, sub, product, qty)
+
+        for row_id in self.legacy_ids:
+            add("DELETE FROM batches WHERE id = ?", row_id); add("DELETE FROM timeline WHERE batch_id = ?", row_id)
+
+        for batch_id, (key, sub, status, item) in self.dirty_batches.items():
+            body = item.to_dict(timeline=False)
+            if self.routings.is_template(item): del body["steps"]
+            add("INSERT OR REPLACE INTO batches (id, key, sub, status, seq, body) VALUES (?, ?, ?, ?, ?, ?)", batch_id, key, sub, status, item["seq"], json.dumps(body))
+
+        for batch_id, start in self.dirty_timeline.items():
+            key, sub, status, item = self.dirty_batches[batch_id]
+            add("DELETE FROM timeline WHERE batch_id = ? AND pos >= ?", batch_id, start)
+            statements.append(("INSERT INTO timeline (batch_id, pos, step, time) VALUES (?, ?, ?, ?)", [(batch_id, pos, log["step"], log["time"]) for pos, log in enumerate(item["timeline"][start:], start)]))
+
+        for seq, (key, sub, entry) in self.dirty_ledger.items():
+            add("INSERT OR REPLACE INTO ledger (seq, key, sub, body) VALUES (?, ?, ?, ?)", seq, key, sub, json.dumps(entry.to_dict()))
+        return statements
@@ -0,0 +1,90 @@
+import threading
+from contextlib import contextmanager
+import events
+from storage import Storage
+from journal import Journal
+from service import InventoryService
+from indexes import ActivityIndex, ConsolidatedHistory
+from kpis import ProductionKPIs
+from search import SearchIndex
+
+TOPIC = "plant"
+NOTIFY_DELAY = 1 / 20   # s; the events of a burst of single operations are announced together
+
+
+def event_locations(ev):
+    return (ev["key"], ev["to_key"]) if ev["type"] == events.BATCH_MOVED else (ev["key"],)
+
+
+# --- PROCESS-WIDE PLANT STORE ---
+# One copy of the plant state, its journal, indexes and service per server process, shared by every Flet session.
+# Changes are announced on the "plant" pubsub topic as {"version", "locations", "config", "origins"}; sessions only
+# re-render when they show an affected location, and skip announcements older than the last one they handled or made only of
+# their own changes (origins: the sessions the changes were made for, see acting_for).
+class PlantStore:
+    def __init__(self, path=None):
+        self.db = Storage(path)
+        self.journal = Journal(self.db)
+        self.products_config, self.factories, self.factory_sub_locations, self.level3_data = self.journal.load()
+        self.service = InventoryService(self.journal, self.products_config)
+        self.activity = self.journal.attach(ActivityIndex())
+        self.kpis = self.journal.attach(ProductionKPIs(self.db.archive_kpis))
+        self.search = self.journal.attach(SearchIndex())
+        self.archive = self.journal.attach(ConsolidatedHistory())
+
+        self.lock = threading.RLock()
+        self.version = 0
+        self.changed_locations = set()
+        self.config_changed = False
+        self.origins = set()
+        self.local = threading.local()
+        self.timer = None
+        self.pubsub = None
+        self.journal.subscribe(self.on_event, self.on_settled)
+
+    def connect(self, page, on_change):
+        # on_change(message) runs on a pubsub worker thread; flet drops the subscription when the session closes
+        with self.lock: self.pubsub = self.pubsub or page.pubsub  # every session's client reaches the same hub
+        page.pubsub.subscribe_topic(TOPIC, on_change)
+
+    @contextmanager
+    def acting_for(self, session):
+        # changes made by this thread inside the block are announced as made for `session`
+        outer = getattr(self.local, "session", None); self.local.session = session
+        try: yield
+        finally: self.local.session = outer
+
+    def save_config(self): self.db.mark_config(); self.db.save(); self.touch(config=True)
+
+    def on_event(self, ev, result):
+        # events of a bulk operation (journal hold) are collected per thread and announced once when it ends
+        if not self.journal.held(): self.touch(event_locations(ev)); return
+        if not hasattr(self.local, "held"): self.local.held = set()
+        self.local.held.update(event_locations(ev))
+
+    def on_settled(self):
+        locations = getattr(self.local, "held", None)
+        if locations: self.local.held = set(); self.touch(locations)
+
+    def touch(self, locations=(), config=False):
+        with self.lock:
+            self.version += 1; self.changed_locations.update(locations); self.config_changed |= config; self.origins.add(getattr(self.local, "session", None))
+            if self.timer: return
+            self.timer = threading.Timer(NOTIFY_DELAY, self.notify); self.timer.daemon = True; self.timer.start()
+
+    def notify(self):
+        with self.lock:
+            message = {"version": self.version, "locations": frozenset(self.changed_locations), "config": self.config_changed, "origins": frozenset(self.origins)}
+            self.timer = None; self.changed_locations = set(); self.config_changed = False; self.origins = set()
+            pubsub = self.pubsub
+        if pubsub: pubsub.send_all_on_topic(TOPIC, message)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None: _store = PlantStore()
+        return _store
@@ -0,0 +1,38 @@
+import time
+from datetime import datetime, time as dtime
+from functools import lru_cache
+
+LEGACY_FORMATS = ("%Y-%m-%d %I:%M %p", "%I:%M %p, %d %b")
+DISPLAY_FORMAT = "%d %b %Y, %I:%M %p"
+
+
+def now_ts(): return int(time.time())
+
+def is_legacy(value): return isinstance(value, str) and not value.isdigit()
+
+def to_ts(value, near=None):
+    # timestamps are stored as epoch seconds; strings only come from legacy data and are converted once at load.
+    # The short legacy format carries no year: it takes the one putting the time closest to `near`, a neighbouring
+    # entry's time. None when the value cannot be dated (no format matches, or a short one without `near`).
+    if isinstance(value, (int, float)): return int(value)
+    if value and value.isdigit(): return int(value)
+    for fmt in LEGACY_FORMATS:
+        try: dt = datetime.strptime(value or "", fmt)
+        except ValueError: continue
+        if "%Y" in fmt: return int(dt.timestamp())
+        if near is None: return None
+        year = datetime.fromtimestamp(near).year
+        return min((int(dt.replace(year=y).timestamp()) for y in (year - 1, year, year + 1)), key=lambda ts: abs(ts - near))
+    return None
+
+@lru_cache(maxsize=8192)
+def _fmt_minute(minute, fmt): return datetime.fromtimestamp(minute * 60).strftime(fmt)
+
+def fmt_ts(ts, fmt=DISPLAY_FORMAT): return _fmt_minute(ts // 60, fmt)
+
+def day_bounds(start_date, end_date):
+    lo = int(datetime.combine(start_date.date(), dtime.min).timestamp()) if start_date else None
+    hi = int(datetime.combine(end_date.date(), dtime.max).timestamp()) if end_date else None
+    return lo, hi
+
+def in_range(ts, lo, hi): return (lo is None or ts >= lo) and (hi is None or ts <= hi)
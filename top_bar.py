@@ -1,7 +1,8 @@
 import flet as ft
+from scheduler import batched, mark_dirty
 
 class FactoryHeader(ft.Column):
-    def __init__(self, on_tab_change, on_add_click, on_edit_click, on_delete_click, on_menu_click):
+    def __init__(self, on_tab_change, on_add_click, on_edit_click, on_delete_click, on_menu_click, on_search_click):
         super().__init__()
         self.spacing = 0
         self.is_visible = True
@@ -17,6 +18,7 @@ class FactoryHeader(ft.Column):
 
         btn_style = ft.ButtonStyle(shape=ft.CircleBorder())
         self.add_btn = ft.IconButton(icon=ft.Icons.ADD, icon_color="#FFFFFF", bgcolor="#3B82F6", tooltip="Add Factory", on_click=on_add_click, style=btn_style)
+        self.search_btn = ft.IconButton(icon=ft.Icons.SEARCH, icon_color="#FFFFFF", tooltip="Find a Batch", on_click=on_search_click, style=btn_style)
         self.edit_btn = ft.IconButton(icon=ft.Icons.EDIT, icon_color="#94A3B8", tooltip="Edit Active Factory", on_click=on_edit_click, style=btn_style)
         self.delete_btn = ft.IconButton(icon=ft.Icons.DELETE_OUTLINE, icon_color="#F87171", tooltip="Delete Active Factory", on_click=on_delete_click, style=btn_style)
 
@@ -30,7 +32,7 @@ class FactoryHeader(ft.Column):
                     ),
                     ft.Container(width=10),
                     ft.Container(content=self.tabs, expand=True),
-                    self.edit_btn, self.delete_btn, ft.Container(width=5), self.add_btn
+                    self.search_btn, self.edit_btn, self.delete_btn, ft.Container(width=5), self.add_btn
                 ],
                 alignment=ft.MainAxisAlignment.START,
                 vertical_alignment=ft.CrossAxisAlignment.CENTER
@@ -50,7 +52,7 @@ class FactoryHeader(ft.Column):
 
     def set_menu_visible(self, is_visible):
         self.menu_btn.visible = is_visible
-        self.update()
+        mark_dirty(self)
 
     def handle_tab_change(self, e):
         if self.tabs.tabs: self.on_tab_change(self.tabs.selected_index)
@@ -62,11 +64,12 @@ class FactoryHeader(ft.Column):
         self.tabs.selected_index = active_index
         self.edit_btn.visible = len(locations) > 0
         self.delete_btn.visible = len(locations) > 0
-        self.update()
+        mark_dirty(self)
 
+    @batched
     def toggle_bar(self, e):
         self.is_visible = not self.is_visible
         self.bar_container.height = 65 if self.is_visible else 0
         self.bar_container.opacity = 1 if self.is_visible else 0
         self.arrow_icon.icon = ft.Icons.KEYBOARD_ARROW_UP if self.is_visible else ft.Icons.KEYBOARD_ARROW_DOWN
-        self.update()
\ No newline at end of file
+        mark_dirty(self)
\ No newline at end of file